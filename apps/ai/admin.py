@@ -0,0 +1,11 @@
+# apps/ai/admin.py
+
+from django.contrib import admin
+from .models import AIResponseCache
+
+@admin.register(AIResponseCache)
+class AIResponseCacheAdmin(admin.ModelAdmin):
+    list_display = ('cache_key', 'model_name', 'created_at', 'last_accessed_at', 'hit_count')
+    list_filter = ('model_name', 'created_at')
+    search_fields = ('cache_key',)
+    readonly_fields = ('cache_key', 'model_name', 'response_text', 'created_at', 'last_accessed_at', 'hit_count')
@@ -0,0 +1,10 @@
+# apps/ai/apps.py
+
+from django.apps import AppConfig
+
+
+class AiConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    # The 'name' attribute must match the dotted path to this app
+    name = 'apps.ai'
+    verbose_name = 'AI' # A human-readable name for the app
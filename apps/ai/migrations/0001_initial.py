@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIResponseCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64, unique=True)),
+                ('model_name', models.CharField(max_length=100)),
+                ('response_text', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(db_index=True)),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'AI Response Cache Entry',
+                'verbose_name_plural': 'AI Response Cache',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# apps/ai/models.py
+
+from django.db import models
+
+
+class AIResponseCache(models.Model):
+    """
+    A cached Gemini response.
+    The key is a SHA-256 over (model name, prompt text, hash of the content sent),
+    so byte-identical requests are answered from here instead of the API.
+    """
+    cache_key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=100)
+    response_text = models.TextField()
+
+    created_at = models.DateTimeField(auto_now_add=True) # Used for TTL expiry
+    last_accessed_at = models.DateTimeField(db_index=True) # Used for LRU eviction
+    hit_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.model_name}: {self.cache_key[:12]}"
+
+    class Meta:
+        verbose_name = "AI Response Cache Entry"
+        verbose_name_plural = "AI Response Cache"
@@ -0,0 +1,82 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.ai import utils
+from apps.ai.models import AIResponseCache
+
+
+@override_settings(AI_CACHE_TTL_SECONDS=3600, AI_CACHE_MAX_ENTRIES=100, AI_CACHE_PRUNE_EVERY=1)
+class GenerateContentCacheTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        # A stub Gemini client answering every prompt with a numbered response
+        self.calls = []
+
+        def generate(prompt):
+            self.calls.append(prompt)
+            return mock.Mock(text=f'Response {len(self.calls)}')
+
+        model = mock.Mock(generate_content=generate)
+        for patcher in (
+            mock.patch.object(utils, 'genai', mock.Mock(GenerativeModel=mock.Mock(return_value=model))),
+            mock.patch.object(utils, '_writes_since_prune', 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_request_is_served_from_the_cache(self):
+        self.assertEqual(utils.generate_content('Summarize:', 'Deed'), 'Response 1')
+        self.assertEqual(utils.generate_content('Summarize:', 'Deed'), 'Response 1')
+        self.assertEqual(self.calls, ['Summarize:Deed'])
+        self.assertEqual(AIResponseCache.objects.get().hit_count, 1)
+
+        # Other content or another prompt is a miss
+        self.assertEqual(utils.generate_content('Summarize:', 'Lease'), 'Response 2')
+        self.assertEqual(utils.generate_content('Segment:', 'Deed'), 'Response 3')
+        self.assertEqual(AIResponseCache.objects.count(), 3)
+
+    def test_bypass_cache_calls_the_api_and_replaces_the_cached_response(self):
+        utils.generate_content('Summarize:', 'Deed')
+        self.assertEqual(utils.generate_content('Summarize:', 'Deed', bypass_cache=True), 'Response 2')
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(utils.generate_content('Summarize:', 'Deed'), 'Response 2')
+        self.assertEqual(AIResponseCache.objects.get().response_text, 'Response 2')
+
+    def test_expired_response_is_not_served(self):
+        utils.generate_content('Summarize:', 'Deed')
+        AIResponseCache.objects.update(created_at=timezone.now() - timedelta(seconds=3601))
+
+        self.assertEqual(utils.generate_content('Summarize:', 'Deed'), 'Response 2')
+        self.assertEqual(utils.generate_content('Summarize:', 'Deed'), 'Response 2') # Stored again, fresh
+        self.assertEqual(len(self.calls), 2)
+
+    @override_settings(AI_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        utils.generate_content('Summarize:', 'Deed')
+        utils.generate_content('Summarize:', 'Lease')
+        AIResponseCache.objects.update(last_accessed_at=timezone.now() - timedelta(minutes=1))
+        utils.generate_content('Summarize:', 'Deed') # A hit: Deed is now more recent than Lease
+        utils.generate_content('Summarize:', 'Will')
+
+        self.assertEqual(AIResponseCache.objects.count(), 2)
+        self.assertEqual(utils.generate_content('Summarize:', 'Deed'), 'Response 1')
+        self.assertEqual(utils.generate_content('Summarize:', 'Lease'), 'Response 4') # Evicted, asked again
+
+    def test_pruning_deletes_expired_entries(self):
+        utils.generate_content('Summarize:', 'Deed')
+        AIResponseCache.objects.update(created_at=timezone.now() - timedelta(seconds=3601))
+        utils.generate_content('Summarize:', 'Lease')
+        self.assertEqual(list(AIResponseCache.objects.values_list('response_text', flat=True)), ['Response 2'])
+
+    @override_settings(AI_CACHE_PRUNE_EVERY=3)
+    def test_cache_is_pruned_once_per_prune_every_writes(self):
+        with mock.patch.object(utils, 'prune_ai_cache') as pruned:
+            for number in range(7):
+                utils.generate_content('Summarize:', f'Deed {number}')
+            self.assertEqual(pruned.call_count, 2)
+
+            utils.generate_content('Summarize:', 'Deed 0') # Hits write nothing
+            self.assertEqual(pruned.call_count, 2)
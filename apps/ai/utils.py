@@ -0,0 +1,137 @@
+# apps/ai/utils.py
+# Shared Gemini AI access with a persistent response cache.
+
+import google.generativeai as genai
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+from datetime import timedelta
+import hashlib
+import threading
+
+from .models import AIResponseCache
+
+# Configure Gemini AI with the API key from settings
+if settings.GEMINI_API_KEY:
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+else:
+    print("WARNING: GEMINI_API_KEY not found in settings. Gemini AI features will not be available.")
+    genai = None  # Set genai to None if API key is missing
+
+DEFAULT_MODEL_NAME = 'gemini-pro'
+
+# In-process counters; per-entry hit counts are also kept on AIResponseCache rows
+_cache_stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+_cache_stats_lock = threading.Lock()
+
+# Cache writes in this process since prune_ai_cache() last ran
+_writes_since_prune = 0
+
+
+def _count(stat):
+    with _cache_stats_lock:
+        _cache_stats[stat] += 1
+
+
+def get_cache_stats():
+    """
+    Returns cache hit/miss counters for this process plus totals from the database.
+    """
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    stats['entries'] = AIResponseCache.objects.count()
+    stats['stored_hits'] = AIResponseCache.objects.aggregate(total=Sum('hit_count'))['total'] or 0
+    return stats
+
+
+def make_cache_key(model_name, prompt, content=''):
+    """
+    Builds the cache key for a request from the model name, the prompt text
+    and a hash of the content appended to it.
+    """
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    key_source = '\x00'.join([model_name, prompt, content_hash])
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+def prune_ai_cache():
+    """
+    Deletes entries older than AI_CACHE_TTL_SECONDS and trims the cache to
+    AI_CACHE_MAX_ENTRIES, evicting the least recently used entries first.
+    """
+    ttl = getattr(settings, 'AI_CACHE_TTL_SECONDS', None)
+    max_entries = getattr(settings, 'AI_CACHE_MAX_ENTRIES', None)
+
+    if ttl:
+        AIResponseCache.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+
+    if max_entries:
+        excess = AIResponseCache.objects.count() - max_entries
+        if excess > 0:
+            stale_ids = list(
+                AIResponseCache.objects.order_by('last_accessed_at').values_list('pk', flat=True)[:excess]
+            )
+            AIResponseCache.objects.filter(pk__in=stale_ids).delete()
+
+
+def _prune_after_write():
+    # Pruning counts the whole table, so it only runs every AI_CACHE_PRUNE_EVERY writes;
+    # expired entries left until then are never served (see generate_content())
+    global _writes_since_prune
+    with _cache_stats_lock:
+        _writes_since_prune += 1
+        due = _writes_since_prune >= getattr(settings, 'AI_CACHE_PRUNE_EVERY', 100)
+        if due:
+            _writes_since_prune = 0
+    if due:
+        prune_ai_cache()
+
+
+def generate_content(prompt, content='', model_name=DEFAULT_MODEL_NAME, bypass_cache=False):
+    """
+    Sends `prompt + content` to Gemini and returns the response text.
+    Identical requests are served from the AIResponseCache. With bypass_cache=True
+    the API is always called and the fresh response replaces the cached one.
+    Raises if Gemini is not configured or the API call fails.
+    """
+    if not genai:
+        raise RuntimeError("Gemini AI is not configured.")
+
+    cache_key = make_cache_key(model_name, prompt, content)
+    now = timezone.now()
+
+    if bypass_cache:
+        _count('bypassed')
+    else:
+        cached = AIResponseCache.objects.filter(cache_key=cache_key)
+        ttl = getattr(settings, 'AI_CACHE_TTL_SECONDS', None)
+        if ttl:
+            cached = cached.filter(created_at__gte=now - timedelta(seconds=ttl))
+        response_text = cached.values_list('response_text', flat=True).first()
+        if response_text is not None:
+            _count('hits')
+            cached.update(hit_count=F('hit_count') + 1, last_accessed_at=now)
+            return response_text
+        _count('misses')
+
+    model = genai.GenerativeModel(model_name)
+    response = model.generate_content(prompt + content)
+    response_text = response.text
+
+    if response_text:
+        try:
+            # A bypassed or expired entry may already exist for this key; refresh it.
+            # Single-statement writes rather than update_or_create's transaction,
+            # so concurrent writers on SQLite wait for the lock instead of failing.
+            fields = {'model_name': model_name, 'response_text': response_text, 'created_at': now, 'last_accessed_at': now}
+            if not AIResponseCache.objects.filter(cache_key=cache_key).update(**fields):
+                AIResponseCache.objects.create(cache_key=cache_key, **fields)
+            _prune_after_write()
+        except IntegrityError:
+            pass  # Another worker stored the same request meanwhile
+        except DatabaseError as e:
+            # e.g. SQLite busy under concurrent writers; the response is still good
+            print(f"Could not store AI response in the cache: {e}")
+
+    return response_text
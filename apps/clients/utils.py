@@ -3,6 +3,7 @@
 
 import google.generativeai as genai
 from django.conf import settings
+from apps.ai.utils import generate_content
 import json  # To handle JSON data for segmentation tags
 
 # Configure Gemini AI with the API key from settings
@@ -12,9 +13,10 @@ else:
     print("WARNING: GEMINI_API_KEY not found in settings. Gemini AI features will not be available.")
     genai = None  # Set genai to None if API key is missing
 
-def generate_segmentation_tags(client_instance):
+def generate_segmentation_tags(client_instance, bypass_cache=False):
     """
     Uses Gemini AI to generate segmentation tags based on client data.
+    Identical requests are answered from the AI response cache unless bypass_cache is True.
     """
     if not genai:
         print("Gemini AI is not configured. Cannot generate segmentation tags.")
@@ -58,10 +60,9 @@ JSON Tags:
 """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
+        response_text = generate_content(prompt, bypass_cache=bypass_cache)
         try:
-            json_string = response.text.strip()
+            json_string = response_text.strip()
             if json_string.startswith('[') and json_string.endswith(']'):
                 tags = json.loads(json_string)
                 if isinstance(tags, list):
@@ -75,7 +76,7 @@ JSON Tags:
 
         except json.JSONDecodeError as e:
             print(f"Error decoding JSON from AI response: {e}")
-            print(f"AI Response Text: {response.text}")
+            print(f"AI Response Text: {response_text}")
             return None
 
     except Exception as e:
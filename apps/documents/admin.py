@@ -1,69 +1,149 @@
 # apps/documents/admin.py
 
-from django.contrib import admin
-from .models import Document
+from django.contrib import admin, messages
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import (
+    ConvertedFile, Document, DocumentBlob, ExtractedText, ProcessingBatch, ProcessingJob, ReplacedFile, UploadSession,
+)
 
 # Customize the admin interface for the Document model
 class DocumentAdmin(admin.ModelAdmin):
     list_display = ('name', 'uploaded_by', 'upload_date', 'file_type', 'file_size', 'status')
     list_filter = ('status', 'upload_date', 'file_type')
     search_fields = ('name', 'uploaded_by__username') # Allow searching by document name or uploader username
-    readonly_fields = ('upload_date', 'file_size', 'file_type', 'summary', 'segmentation_result') # Fields that should not be editable in admin
+    readonly_fields = ('upload_date', 'file_size', 'file_type', 'content_hash', 'blob', 'original_filename', 'derived_from', 'near_duplicate_of', 'near_duplicate_score', 'summary', 'segmentation_result') # Fields that should not be editable in admin
 
     # Add actions to trigger AI processing from the admin list view
-    actions = ['summarize_selected_documents', 'segment_selected_documents']
+    actions = ['summarize_selected_documents', 'segment_selected_documents', 'merge_selected_documents', 'split_selected_documents']
 
-    def summarize_selected_documents(self, request, queryset):
-        from .utils import summarize_document
+    def delete_queryset(self, request, queryset):
+        # Delete one by one so Document.delete() releases each shared file blob
         for document in queryset:
-            # You might want to run this in a background task for large documents
-            # For simplicity here, we run it directly
-            if document.file:
-                 try:
-                     document.status = 'processing'
-                     document.save()
-                     summary = summarize_document(document.file.path)
-                     if summary:
-                         document.summary = summary
-                         document.status = 'processed'
-                         document.save()
-                         self.message_user(request, f"Successfully summarized document: {document.name}")
-                     else:
-                         document.status = 'error'
-                         document.save()
-                         self.message_user(request, f"Failed to summarize document: {document.name}", level='ERROR')
-                 except Exception as e:
-                     document.status = 'error'
-                     document.save()
-                     self.message_user(request, f"Error processing document {document.name}: {e}", level='ERROR')
+            document.delete()
+
+    def summarize_selected_documents(self, request, queryset):
+        return self._queue_batch(request, queryset, 'summarize')
 
     summarize_selected_documents.short_description = "Summarize selected documents using AI"
 
     def segment_selected_documents(self, request, queryset):
-        from .utils import segment_document
-        for document in queryset:
-            # Similar to summarization, consider background tasks
-            if document.file:
-                 try:
-                     document.status = 'processing'
-                     document.save()
-                     segmentation_result = segment_document(document.file.path)
-                     if segmentation_result:
-                         document.segmentation_result = segmentation_result
-                         document.status = 'processed'
-                         document.save()
-                         self.message_user(request, f"Successfully segmented document: {document.name}")
-                     else:
-                         document.status = 'error'
-                         document.save()
-                         self.message_user(request, f"Failed to segment document: {document.name}", level='ERROR')
-                 except Exception as e:
-                     document.status = 'error'
-                     document.save()
-                     self.message_user(request, f"Error processing document {document.name}: {e}", level='ERROR')
+        return self._queue_batch(request, queryset, 'segment')
 
     segment_selected_documents.short_description = "Segment selected documents using AI"
 
+    def merge_selected_documents(self, request, queryset):
+        # Merging thousands of pages takes longer than a request may, so the
+        # process_documents worker does it; the job page shows how it went
+        from .jobs import enqueue_document_job
+        documents = list(queryset.exclude(file='').order_by('upload_date', 'pk').only('pk'))
+        if len(documents) < 2:
+            self.message_user(request, "Select at least two PDF documents to merge.", level=messages.ERROR)
+            return None
+        job = enqueue_document_job(
+            documents[0], 'merge', requested_by=request.user,
+            options={'document_ids': [document.pk for document in documents], 'owner_id': request.user.pk},
+        )
+        self.message_user(request, f"Queued the merge of {len(documents)} documents.")
+        return redirect('admin:documents_processingjob_change', job.pk)
+
+    merge_selected_documents.short_description = "Merge selected PDFs into a new document (in upload order)"
+
+    def split_selected_documents(self, request, queryset):
+        return self._queue_batch(request, queryset, 'split', options={'owner_id': request.user.pk})
+
+    split_selected_documents.short_description = "Split selected PDFs into single-page documents"
+
+    def _queue_batch(self, request, queryset, task, options=None):
+        # Queue the whole selection as one batch for the process_documents worker
+        # and send the admin to the batch progress page instead of blocking here.
+        from .jobs import enqueue_document_batch
+        batch = enqueue_document_batch(queryset, task, requested_by=request.user, options=options)
+        if not batch.total:
+            self.message_user(request, "No documents were queued (no file attached or already queued).", level=messages.WARNING)
+            return None
+        self.message_user(request, f"Queued {batch.total} document(s) for {task}.")
+        return redirect('admin:documents_processingbatch_progress', batch.pk)
+
+
+class DocumentBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'mime_type', 'ref_count', 'compression', 'stored_size', 'last_accessed_at', 'created_at')
+    list_filter = ('compression',)
+    search_fields = ('sha256',)
+    readonly_fields = (
+        'sha256', 'file', 'size', 'mime_type', 'ref_count', 'compression', 'stored_size', 'last_accessed_at', 'created_at',
+    )
+
+
+class ReplacedFileAdmin(admin.ModelAdmin):
+    list_display = ('file', 'delete_after', 'created_at')
+    readonly_fields = ('file', 'delete_after', 'created_at')
+
+
+class ExtractedTextAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'extractor_version', 'created_at')
+    list_filter = ('extractor_version',)
+    search_fields = ('content_hash',)
+    readonly_fields = ('content_hash', 'extractor_version', 'text', 'created_at')
+
+
+class ConvertedFileAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'converter_version', 'blob', 'page_count', 'created_at')
+    list_filter = ('converter_version',)
+    search_fields = ('content_hash',)
+    readonly_fields = ('content_hash', 'converter_version', 'blob', 'page_count', 'created_at')
+
+
+class ProcessingBatchAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'task', 'total', 'max_parallel', 'requested_by', 'created_at')
+    list_filter = ('task',)
+    readonly_fields = ('task', 'total', 'requested_by', 'created_at')
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:batch_id>/progress/',
+                self.admin_site.admin_view(self.progress_view),
+                name='documents_processingbatch_progress',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def progress_view(self, request, batch_id):
+        batch = get_object_or_404(ProcessingBatch, pk=batch_id)
+        progress = batch.get_progress()
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"Batch {batch.pk}: {batch.task}",
+            'batch': batch,
+            'progress': progress,
+            'failed_jobs': batch.jobs.filter(status='error').select_related('document')[:50],
+        }
+        return TemplateResponse(request, 'admin/documents/processingbatch/progress.html', context)
+
+
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ('document', 'task', 'status', 'priority', 'batch', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'created_at')
+    list_filter = ('status', 'task', 'priority')
+    search_fields = ('document__name',)
+    readonly_fields = ('created_at', 'updated_at', 'finished_at', 'locked_by', 'lease_expires_at', 'last_error')
+
+
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'user', 'matter', 'received_bytes', 'total_size', 'status', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('filename', 'user__username')
+    readonly_fields = ('upload_id', 'received_bytes', 'document', 'created_at', 'updated_at')
+
 
 # Register the Document model with the custom admin class
 admin.site.register(Document, DocumentAdmin)
+admin.site.register(DocumentBlob, DocumentBlobAdmin)
+admin.site.register(ReplacedFile, ReplacedFileAdmin)
+admin.site.register(ExtractedText, ExtractedTextAdmin)
+admin.site.register(ConvertedFile, ConvertedFileAdmin)
+admin.site.register(ProcessingBatch, ProcessingBatchAdmin)
+admin.site.register(ProcessingJob, ProcessingJobAdmin)
+admin.site.register(UploadSession, UploadSessionAdmin)
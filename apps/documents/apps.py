@@ -8,3 +8,6 @@ class DocumentsConfig(AppConfig):
     # The 'name' attribute must match the dotted path to this app
     name = 'apps.documents'
     verbose_name = 'Documents' # A human-readable name for the app
+
+    def ready(self):
+        from . import signals # noqa: F401 -- connects the extract-on-upload receiver
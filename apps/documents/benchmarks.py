@@ -0,0 +1,131 @@
+# apps/documents/benchmarks.py
+# Sample inputs and reference implementations for `manage.py benchmark_documents`.
+# Each measurement runs in a freshly spawned process, so the peak RSS reported
+# is that of one run alone. Like extraction.py, this module is imported by those
+# processes and must not import Django models or read Django settings.
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import resource
+import time
+
+from pypdf import PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject, StreamObject
+
+from .pdf_tools import StreamingPdfWriter
+
+MB = 1024 * 1024
+
+
+def write_sample_pdf(path, pages, image_kb=0, label='Page'):
+    """
+    Writes a PDF of `pages` Letter pages, page n showing the text "<label> n".
+    With image_kb, each page also carries an incompressible image of that size
+    (like a scan), so the file grows with the page count.
+    """
+    with open(path, 'wb') as output:
+        writer = StreamingPdfWriter(output)
+        font = writer.add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+        }))
+        for number in range(1, pages + 1):
+            resources = DictionaryObject({NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})})
+            content = f'BT /F1 24 Tf 72 700 Td ({label} {number}) Tj ET'.encode()
+            if image_kb:
+                image = StreamObject()
+                image._data = os.urandom(image_kb * 1024)
+                image.update({
+                    NameObject('/Type'): NameObject('/XObject'),
+                    NameObject('/Subtype'): NameObject('/Image'),
+                    NameObject('/Width'): NumberObject(image_kb * 1024 // 3 // 8),
+                    NameObject('/Height'): NumberObject(8),
+                    NameObject('/ColorSpace'): NameObject('/DeviceRGB'),
+                    NameObject('/BitsPerComponent'): NumberObject(8),
+                })
+                resources[NameObject('/XObject')] = DictionaryObject({NameObject('/Im1'): writer.add_object(image)})
+                content += b' q 468 0 0 200 72 400 cm /Im1 Do Q'
+            writer.add_page(content, resources, (0, 0, 612, 792))
+        return writer.close()
+
+
+def merge_pdfs_with_pypdf(pdf_paths, output_path):
+    """The reference merge: pypdf's PdfWriter, which keeps every page in memory until written."""
+    writer = PdfWriter()
+    for path in pdf_paths:
+        writer.append(path)
+    writer.write(output_path)
+    return len(writer.pages)
+
+
+def write_sample_contract(path, pages):
+    """
+    Writes a DOCX shaped like a long contract with python-docx: per page a
+    clause heading and 12 paragraphs, a 15-row schedule table every 5 pages,
+    and a header and footer.
+    """
+    import docx # python-docx; only the benchmark generates DOCX files
+
+    document = docx.Document()
+    section = document.sections[0]
+    section.header.paragraphs[0].text = 'Master Services Agreement - Confidential'
+    section.footer.paragraphs[0].text = 'Initials of the parties: ______'
+    clause = (
+        'The Supplier shall indemnify and hold harmless the Customer against all losses, damages, '
+        'costs and expenses arising out of any breach of this Agreement. '
+    )
+    for page in range(pages):
+        document.add_heading(f'Clause {page + 1}', 2)
+        for _ in range(12):
+            document.add_paragraph(clause * 2)
+        if page % 5 == 0:
+            table = document.add_table(rows=15, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = 'Schedule item value'
+    document.save(path)
+
+
+def docx_text_with_python_docx(path):
+    """The reference DOCX extraction: python-docx's object tree, body paragraphs only."""
+    import docx
+
+    return '\n'.join(paragraph.text for paragraph in docx.Document(path).paragraphs)
+
+
+def _memory_mb():
+    # (current RSS, peak RSS) in MB. /proc's peak belongs to this process image;
+    # ru_maxrss would still include the peak of the process that spawned it
+    try:
+        with open('/proc/self/status') as status:
+            fields = dict(line.split(':', 1) for line in status)
+        return int(fields['VmRSS'].split()[0]) / 1024, int(fields['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+        return peak, peak
+
+
+def _run_measured(func, args):
+    # Runs in the spawned process
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5') # Resets the peak to the current RSS
+    except OSError:
+        pass
+    baseline, _ = _memory_mb()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed, baseline, _memory_mb()[1]
+
+
+def measure(func, *args):
+    """
+    Runs func(*args) in a new process. Returns (result, seconds, baseline RSS MB,
+    peak RSS MB); the baseline is the process's RSS once its modules are imported.
+    func must be a picklable module-level function.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(_run_measured, func, args).result()
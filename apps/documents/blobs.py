@@ -0,0 +1,216 @@
+# apps/documents/blobs.py
+# Content-addressed, deduplicated storage for document files.
+# Every distinct file content is stored once, under a name derived from its
+# SHA-256, and shared by all Documents with that content. DocumentBlob.ref_count
+# tracks the Documents using a blob; the file is deleted with the last of them.
+# DocumentBlob.last_accessed_at records reads, so unused blobs can be moved to
+# the compressed cold tier (see cold_storage.py).
+
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+import hashlib
+import os
+
+from .models import Document, DocumentBlob
+from .search import remove_from_index
+
+BLOB_PREFIX = 'blobs'
+
+
+def get_blob_storage():
+    # Blobs live in the same storage as Document files so `document.file` can point at them
+    return Document._meta.get_field('file').storage
+
+
+def hash_file(content):
+    """Returns the SHA-256 hex digest of a File, reading it in chunks."""
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    content.seek(0)
+    return sha256.hexdigest()
+
+
+def get_blob_name(sha256, filename=''):
+    """
+    Storage name for content with this hash: blobs/ab/cd/<sha256><ext>.
+    The original extension is kept so MIME type detection by name keeps working.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if len(ext) > 10 or not ext[1:].isalnum():
+        ext = ''
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def _add_reference(sha256):
+    # Takes a reference on an existing blob; returns it, or None if there is no blob for this hash
+    with transaction.atomic():
+        blob = DocumentBlob.objects.select_for_update().filter(sha256=sha256).first()
+        if blob is not None:
+            DocumentBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            blob.ref_count += 1
+        return blob
+
+
+def _delete_unused_file(name):
+    # Deletes a blob file unless a blob row uses that name (again: a storage
+    # that overwrites on save hands out the same name to the next upload)
+    if not DocumentBlob.objects.filter(file=name).exists():
+        get_blob_storage().delete(name)
+
+
+def acquire_blob(content, filename='', sha256=None):
+    """
+    Returns the DocumentBlob for a File's content with one more reference taken.
+    The content is only written to storage when no blob with its hash exists yet,
+    so uploading a duplicate costs a hash pass and no storage write.
+    """
+    sha256 = sha256 or hash_file(content)
+    blob = _add_reference(sha256)
+    if blob is not None:
+        return blob
+
+    storage = get_blob_storage()
+    name = get_blob_name(sha256, filename)
+    # Always write: a file at `name` without a row may be one whose blob was just
+    # released and whose deletion is still pending (see release_blob()). The
+    # storage then picks a free name; the leftover file goes with that deletion
+    # or with `manage.py collect_orphaned_files`.
+    content.seek(0)
+    saved_name = storage.save(name, content)
+
+    try:
+        with transaction.atomic():
+            return DocumentBlob.objects.create(sha256=sha256, file=saved_name, size=content.size, ref_count=1)
+    except IntegrityError:
+        # Another upload stored the same content at the same time; use its blob
+        _delete_unused_file(saved_name)
+        return _add_reference(sha256)
+
+
+def attach_blob(document):
+    """
+    Points a Document with a newly assigned file at the blob for that content,
+    taking a reference. Sets blob, file, content_hash and original_filename;
+    Document.save() calls this before writing the row. A file that was already
+    written to storage some other way (e.g. FieldFile.save()) is moved into the blob.
+    """
+    stray_name = document.file.name if document.file._committed else None
+    filename = os.path.basename(document.file.name or '')
+    content = document.file.file
+    try:
+        sha256 = hash_file(content)
+        blob = acquire_blob(content, filename, sha256)
+    finally:
+        if stray_name:
+            document.file.close()
+    if stray_name and stray_name != blob.file.name and not Document.objects.filter(file=stray_name).exists():
+        get_blob_storage().delete(stray_name)
+
+    document.blob = blob
+    document.file = blob.file.name
+    document.content_hash = sha256
+    document.original_filename = filename
+    if not document.file_size:
+        document.file_size = blob.size
+    if not document.name:
+        document.name = filename
+    return blob
+
+
+def share_blob(document, blob, filename=''):
+    """
+    Points an unsaved Document at an existing blob (e.g. a cached conversion),
+    taking a reference, so saving it stores nothing new. Returns the blob, or
+    None if the blob was deleted in the meantime. If the document is then not
+    saved, the reference must be given back with release_blob().
+    """
+    blob = _add_reference(blob.sha256)
+    if blob is None:
+        return None
+    document.blob = blob
+    document.file = blob.file.name
+    document.content_hash = blob.sha256
+    document.original_filename = filename
+    document.file_size = blob.size
+    if not document.name:
+        document.name = filename
+    return blob
+
+
+def release_blob(blob_id):
+    """
+    Drops one reference to a blob. When none are left (and no Document row
+    still points at it) the blob row is deleted and its file removed after commit.
+    Returns True if the blob was deleted.
+    """
+    if not blob_id:
+        return False
+    with transaction.atomic():
+        DocumentBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = DocumentBlob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None or blob.ref_count > 0:
+            return False
+        users = Document.objects.filter(blob_id=blob_id).count()
+        if users:
+            # Count drifted (e.g. rows removed by a bulk delete); trust the rows
+            DocumentBlob.objects.filter(pk=blob_id).update(ref_count=users)
+            return False
+        name, sha256 = blob.file.name, blob.sha256
+        blob.delete()
+        transaction.on_commit(lambda: _delete_unused_file(name))
+        transaction.on_commit(lambda: remove_from_index(sha256))
+    return True
+
+
+def touch_blob(blob):
+    """
+    Records that a blob's content was read (downloaded, exported, extracted).
+    Written at most once a day per blob, so frequent reads cost no writes.
+    """
+    now = timezone.now()
+    if blob.last_accessed_at and now - blob.last_accessed_at < timedelta(days=1):
+        return
+    DocumentBlob.objects.filter(pk=blob.pk).filter(
+        Q(last_accessed_at__isnull=True) | Q(last_accessed_at__lt=now - timedelta(days=1))
+    ).update(last_accessed_at=now)
+    blob.last_accessed_at = now
+
+
+def recount_blob_references():
+    """
+    Resets every blob's ref_count to the number of Documents using it and
+    deletes blobs nobody uses. Returns the number of blobs deleted.
+    """
+    deleted = 0
+    for blob in DocumentBlob.objects.annotate(users=Count('documents')).iterator():
+        if blob.ref_count != blob.users:
+            DocumentBlob.objects.filter(pk=blob.pk).update(ref_count=blob.users)
+        if blob.users == 0:
+            deleted += release_blob(blob.pk)
+    return deleted
+
+
+def move_document_to_blob(document):
+    """
+    Moves a legacy Document (file under documents/%Y/%m/%d/) onto a shared blob
+    and deletes the old file if no other document uses it. Returns the blob.
+    """
+    old_name = document.file.name
+    storage = document.file.storage
+    with storage.open(old_name, 'rb') as content:
+        blob = acquire_blob(content, os.path.basename(old_name))
+    moved = Document.objects.filter(pk=document.pk, blob__isnull=True).update(
+        blob=blob,
+        file=blob.file.name,
+        content_hash=blob.sha256,
+        original_filename=document.original_filename or os.path.basename(old_name),
+    )
+    if not moved:
+        release_blob(blob.pk) # Moved by someone else meanwhile
+        return blob
+    if old_name != blob.file.name and not Document.objects.filter(file=old_name).exists():
+        storage.delete(old_name)
+    return blob
@@ -0,0 +1,201 @@
+# apps/documents/bulk_upload.py
+# Bulk upload of a ZIP archive: every file in it becomes a Document.
+# Members are streamed out of the archive; nothing is unpacked to disk. A
+# first pass over each member computes its SHA-256, size and MIME type (from
+# its first bytes); only content that isn't stored yet is decompressed a second
+# time, straight into blob storage (see blobs.py). All Documents are then
+# created with one bulk_create and queued for text extraction as one batch.
+# An archive that unpacks to more than DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES
+# (a ZIP bomb) is rejected: the sizes in its directory are checked up front and
+# the bytes actually decompressed are counted while scanning.
+
+from dataclasses import dataclass, field
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+import hashlib
+import mimetypes
+import os
+import posixpath
+import zipfile
+
+from .blobs import acquire_blob, release_blob
+from .extractors import SNIFF_BYTES, prefer_hint, sniff_head_mime_type
+from .models import Document, DocumentBlob, ExtractedText, ProcessingJob
+
+# Bytes decompressed per read
+READ_BLOCK_SIZE = 64 * 1024
+
+# Archive entries that are never documents (macOS resource forks, OS thumbnails)
+IGNORED_NAMES = ('thumbs.db', 'desktop.ini')
+IGNORED_DIRECTORIES = ('__MACOSX',)
+
+
+class BulkUploadError(Exception):
+    """The archive as a whole can't be imported (not a ZIP, too many files, ...)."""
+    pass
+
+
+class ArchiveTooLargeError(BulkUploadError):
+    """The archive's files add up to more than DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES."""
+    pass
+
+
+@dataclass
+class BulkUploadResult:
+    """Documents created from an archive, and (member name, reason) for each file skipped."""
+    documents: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+
+
+def _document_members(archive):
+    # ZipInfo of every file worth importing, in archive order
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        parts = info.filename.replace('\\', '/').split('/')
+        filename = parts[-1]
+        if not filename or filename.startswith('.') or filename.lower() in IGNORED_NAMES:
+            continue
+        if any(part in IGNORED_DIRECTORIES for part in parts[:-1]):
+            continue
+        yield info
+
+
+class _ReadBudget:
+    # Bytes decompressed from one archive, including members later skipped
+    def __init__(self, max_total):
+        self.max_total = max_total
+        self.used = 0
+
+    def _check(self, size):
+        if size > self.max_total:
+            raise ArchiveTooLargeError(
+                f"The archive's files add up to more than {self.max_total // (1024 * 1024)} MB; "
+                "split it into smaller archives."
+            )
+
+    def check_declared(self, members):
+        # The sizes the archive's directory gives, before anything is read
+        self._check(sum(info.file_size for info in members))
+
+    def consume(self, size):
+        self._check(self.used + size)
+        self.used += size
+
+
+def _scan_member(archive, info, max_size, budget):
+    # Streams a member once: returns (sha256, size, first bytes)
+    sha256 = hashlib.sha256()
+    head = b''
+    size = 0
+    with archive.open(info) as member:
+        while True:
+            block = member.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            size += len(block)
+            budget.consume(len(block))
+            if size > max_size:
+                raise BulkUploadError(f"larger than the {max_size // (1024 * 1024)} MB limit")
+            if len(head) < SNIFF_BYTES:
+                head += block[:SNIFF_BYTES - len(head)]
+            sha256.update(block)
+    return sha256.hexdigest(), size, head
+
+
+def import_zip(archive_file, user, matter=None, client=None):
+    """
+    Creates a Document (linked to `matter` and/or `client`) for every file in a
+    ZIP archive, given as a path or file object, and queues them for text
+    extraction. Files that can't be read are skipped and reported.
+    Returns a BulkUploadResult.
+    """
+    from .jobs import (
+        ACTIVE_JOB_STATUSES, EXTRACTOR_VERSION, PRIORITY_BACKGROUND,
+        enqueue_document_batch, enqueue_search_indexing, needs_indexing,
+    )
+
+    max_files = getattr(settings, 'DOCUMENT_BULK_UPLOAD_MAX_FILES', 500)
+    max_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+    budget = _ReadBudget(getattr(settings, 'DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES', 4 * 1024 * 1024 * 1024))
+    try:
+        archive = zipfile.ZipFile(archive_file)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise BulkUploadError(f"Not a readable ZIP archive: {e}")
+
+    result = BulkUploadResult()
+    pending = [] # Unsaved Documents, each holding a reference on its blob
+    with archive:
+        members = list(_document_members(archive))
+        if len(members) > max_files:
+            raise BulkUploadError(f"The archive holds {len(members)} files; at most {max_files} can be uploaded at once.")
+        budget.check_declared(members)
+
+        try:
+            for info in members:
+                filename = posixpath.basename(info.filename.replace('\\', '/'))
+                if info.flag_bits & 0x1:
+                    result.skipped.append((info.filename, "password protected"))
+                    continue
+                try:
+                    sha256, size, head = _scan_member(archive, info, max_size, budget)
+                    mime_type = prefer_hint(sniff_head_mime_type(head), mimetypes.guess_type(filename)[0])
+                    # Only decompressed a second time if this content isn't stored yet
+                    with archive.open(info) as member:
+                        content = File(member, name=filename)
+                        content.size = size
+                        blob = acquire_blob(content, filename, sha256)
+                except ArchiveTooLargeError:
+                    raise
+                except (BulkUploadError, zipfile.BadZipFile, NotImplementedError, OSError) as e:
+                    # Too large, corrupt (CRC mismatch) or an unsupported compression method
+                    result.skipped.append((info.filename, str(e)))
+                    continue
+
+                if mime_type and not blob.mime_type:
+                    DocumentBlob.objects.filter(pk=blob.pk, mime_type='').update(mime_type=mime_type)
+                pending.append(Document(
+                    uploaded_by=user,
+                    matter=matter,
+                    client=client,
+                    name=os.path.splitext(filename)[0] or filename,
+                    file=blob.file.name,
+                    blob=blob,
+                    content_hash=sha256,
+                    original_filename=filename,
+                    file_type=mime_type or 'application/octet-stream',
+                    file_size=size,
+                ))
+
+            with transaction.atomic():
+                result.documents = Document.objects.bulk_create(pending)
+        except Exception:
+            # Give back the blob references taken for documents that weren't created
+            for document in pending:
+                release_blob(document.blob_id)
+            raise
+
+    # New content is extracted by one background batch, one job per content
+    # (its other documents are flagged by that job). Content that is already
+    # indexed, extracted or queued is handled by enqueue_search_indexing().
+    pending = set(ProcessingJob.objects.filter(
+        task='index', status__in=ACTIVE_JOB_STATUSES,
+        document__content_hash__in={document.content_hash for document in result.documents},
+    ).values_list('document__content_hash', flat=True))
+    extracted = set(ExtractedText.objects.filter(
+        content_hash__in={document.content_hash for document in result.documents},
+        extractor_version=EXTRACTOR_VERSION, is_complete=True,
+    ).values_list('content_hash', flat=True))
+    batch_ids = {}
+    for document in result.documents:
+        if document.content_hash not in batch_ids:
+            new = document.content_hash not in (pending | extracted) and needs_indexing(document)
+            batch_ids[document.content_hash] = document.pk if new else None
+    new_ids = set(filter(None, batch_ids.values()))
+    if new_ids:
+        enqueue_document_batch(Document.objects.filter(pk__in=new_ids), 'index', requested_by=user, priority=PRIORITY_BACKGROUND)
+    for document in result.documents:
+        if not batch_ids[document.content_hash]:
+            enqueue_search_indexing(document)
+    return result
@@ -0,0 +1,172 @@
+# apps/documents/cold_storage.py
+# Compressed cold tier for document files nobody reads any more.
+# A blob (see blobs.py) that hasn't been downloaded, exported or extracted for
+# DOCUMENT_COLD_AFTER_DAYS is rewritten gzip or zstd compressed under
+# <name>.gz / <name>.zst, and its Documents are pointed at the new file.
+# Formats that are already compressed (PDF, JPEG, DOCX, ...) barely shrink, so
+# the first MB of each file is compressed as a sample first and files whose
+# measured saving is below DOCUMENT_COLD_MIN_SAVING are left alone.
+# Reading is transparent: Document.file and the readers in storage_io.py
+# decompress on the fly. The file a blob moved away from is kept for
+# DOCUMENT_COLD_DELETE_GRACE_HOURS, so downloads already streaming it can finish.
+# Run with `python manage.py compress_cold_documents`.
+
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+import gzip
+import io
+import tempfile
+
+from .blobs import _delete_unused_file, get_blob_storage
+from .models import Document, DocumentBlob, ReplacedFile
+from .storage_io import COMPRESSED_SUFFIXES, COPY_CHUNK_SIZE, content_name, open_stored, read_range
+
+CODECS = tuple(COMPRESSED_SUFFIXES)
+
+# Bytes compressed to estimate how well a file compresses
+SAMPLE_SIZE = 1024 * 1024
+
+# Cold files are written once and rarely read, so spend some CPU on the ratio
+GZIP_LEVEL = 9
+ZSTD_LEVEL = 12
+
+
+class ColdStorageError(Exception):
+    """A codec can't be used (unknown, or its package isn't installed)."""
+    pass
+
+
+def check_codec(codec):
+    """Raises ColdStorageError if files can't be compressed with `codec`."""
+    if codec not in CODECS:
+        raise ColdStorageError(f"Unknown codec {codec!r}; use one of: {', '.join(CODECS)}.")
+    if codec == 'zstd':
+        try:
+            import zstandard # noqa: F401
+        except ImportError:
+            raise ColdStorageError("The zstd codec needs the zstandard package (pip install zstandard).")
+
+
+def _compressing_writer(codec, fileobj):
+    # Writable stream that compresses into fileobj; closing it finishes the frame, not fileobj
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+    import zstandard
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(fileobj, closefd=False)
+
+
+def measure_saving(blob, codec):
+    """Fraction of a blob's size compression saves, measured on its first SAMPLE_SIZE bytes."""
+    sample = read_range(get_blob_storage(), blob.file.name, 0, SAMPLE_SIZE)
+    if not sample:
+        return 0.0
+    compressed = io.BytesIO()
+    with _compressing_writer(codec, compressed) as writer:
+        writer.write(sample)
+    return 1 - len(compressed.getvalue()) / len(sample)
+
+
+def cold_candidates(days=None):
+    """Uncompressed blobs nobody has read (or uploaded) in the last `days` days, oldest first."""
+    if days is None:
+        days = getattr(settings, 'DOCUMENT_COLD_AFTER_DAYS', 180)
+    cutoff = timezone.now() - timedelta(days=days)
+    return DocumentBlob.objects.filter(compression='', ref_count__gt=0).annotate(
+        last_used=Coalesce('last_accessed_at', 'created_at'),
+    ).filter(last_used__lt=cutoff).order_by('last_used', 'pk')
+
+
+def _switch_file(blob, old_name, new_name, **values):
+    # Points the blob and its Documents at new_name and schedules the old file
+    # for deletion once the grace period is over; returns False (and deletes
+    # new_name) if the blob changed meanwhile
+    storage = get_blob_storage()
+    with transaction.atomic():
+        current = DocumentBlob.objects.select_for_update().filter(pk=blob.pk).first()
+        if current is None or current.file.name != old_name:
+            transaction.on_commit(lambda: storage.delete(new_name))
+            return False
+        DocumentBlob.objects.filter(pk=blob.pk).update(file=new_name, **values)
+        Document.objects.filter(blob_id=blob.pk).update(file=new_name)
+        grace = timedelta(hours=getattr(settings, 'DOCUMENT_COLD_DELETE_GRACE_HOURS', 24))
+        ReplacedFile.objects.create(file=old_name, delete_after=timezone.now() + grace)
+    blob.file.name = new_name
+    for field, value in values.items():
+        setattr(blob, field, value)
+    return True
+
+
+def compress_blob(blob, codec=None, min_saving=None):
+    """
+    Moves a blob to the cold tier. Returns the bytes of storage reclaimed, or 0
+    if the blob was left as it is (already compressed, or compresses too poorly).
+    """
+    codec = codec or getattr(settings, 'DOCUMENT_COLD_CODEC', 'gzip')
+    if min_saving is None:
+        min_saving = getattr(settings, 'DOCUMENT_COLD_MIN_SAVING', 0.1)
+    check_codec(codec)
+    if blob.compression or measure_saving(blob, codec) < min_saving:
+        return 0
+
+    storage = get_blob_storage()
+    old_name = blob.file.name
+    with tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as compressed:
+        with open_stored(storage, old_name) as source, _compressing_writer(codec, compressed) as writer:
+            while chunk := source.read(COPY_CHUNK_SIZE):
+                writer.write(chunk)
+        stored_size = compressed.tell()
+        if stored_size > blob.size * (1 - min_saving):
+            return 0 # The sample was not representative of the whole file
+        compressed.seek(0)
+        new_name = storage.save(old_name + COMPRESSED_SUFFIXES[codec], File(compressed))
+
+    if not _switch_file(blob, old_name, new_name, compression=codec, stored_size=stored_size):
+        return 0
+    return blob.size - stored_size
+
+
+def restore_blob(blob):
+    """
+    Moves a blob back out of the cold tier (stored uncompressed again).
+    Returns the bytes of storage this takes, or 0 if it wasn't compressed.
+    """
+    if not blob.compression:
+        return 0
+    storage = get_blob_storage()
+    old_name, compression = blob.file.name, blob.compression
+    grown = blob.size - (blob.stored_size or 0)
+    with open_stored(storage, old_name, compression) as stream:
+        content = File(stream)
+        content.size = blob.size # The decompressed stream can't tell its own size
+        new_name = storage.save(content_name(old_name, compression), content)
+
+    if not _switch_file(blob, old_name, new_name, compression='', stored_size=None):
+        return 0
+    return grown
+
+
+def delete_replaced_files():
+    """
+    Deletes the files left behind by compress_blob() and restore_blob() whose
+    grace period is over. Returns the number of files deleted.
+    """
+    deleted = 0
+    for replaced in ReplacedFile.objects.filter(delete_after__lte=timezone.now()).order_by('pk').iterator(chunk_size=100):
+        # Unless a later move stored a blob under the same name again
+        _delete_unused_file(replaced.file.name)
+        replaced.delete()
+        deleted += 1
+    return deleted
+
+
+def cold_tier_totals():
+    """(blobs, content bytes, stored bytes) of everything in the cold tier."""
+    totals = DocumentBlob.objects.exclude(compression='').aggregate(
+        blobs=Count('pk'), size=Sum('size'), stored_size=Sum('stored_size'),
+    )
+    return totals['blobs'], totals['size'] or 0, totals['stored_size'] or 0
@@ -0,0 +1,163 @@
+# apps/documents/conversion.py
+# Conversion of document files to PDF (plain text, DOCX and images).
+# Runs in the extraction process pool (see extraction.ExtractionEngine), so like
+# extraction.py this module must not import Django models or read settings.
+# Text and DOCX are rendered as plain monospaced text: the words and paragraph
+# breaks are kept, DOCX formatting is not.
+
+from dataclasses import dataclass
+import signal
+import textwrap
+import threading
+
+from pypdf.generic import DictionaryObject, NameObject
+
+from .extraction import ExtractionTimeout, _raise_timeout
+from .extractors import DOCX_MIME_TYPE, iter_docx_text
+from .pdf_tools import StreamingPdfWriter
+
+# Bump whenever a converter's output changes, so cached conversions are redone
+CONVERTER_VERSION = 2
+
+IMAGE_MIME_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/tiff', 'image/webp')
+
+# Page layout for rendered text: A4, 10pt Courier
+PAGE_SIZE = (595.0, 842.0)
+MARGIN = 50.0
+FONT_SIZE = 10
+LEADING = 12
+CHAR_WIDTH = FONT_SIZE * 0.6 # Courier glyphs are 600/1000 em wide
+LINE_CHARS = int((PAGE_SIZE[0] - 2 * MARGIN) // CHAR_WIDTH)
+PAGE_LINES = int((PAGE_SIZE[1] - 2 * MARGIN) // LEADING)
+
+
+class ConversionError(Exception):
+    """A document can't be converted (unsupported type, damaged file, ...)."""
+    pass
+
+
+@dataclass
+class ConversionResult:
+    """Outcome of converting one file; `error` is None on success."""
+    pages: int = None
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def can_convert(mime_type):
+    """True if convert_file() can turn files of this type into PDF."""
+    return bool(mime_type) and (
+        mime_type == DOCX_MIME_TYPE or mime_type.startswith('text/') or mime_type in IMAGE_MIME_TYPES
+    )
+
+
+def _escape(line):
+    # PDF string literal in WinAnsi; characters outside it become '?'
+    data = line.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _wrap(lines):
+    # Splits long lines to the page width; a form feed is passed on as its own line
+    for line in lines:
+        parts = line.rstrip('\r\n').split('\x0c')
+        for number, part in enumerate(parts):
+            if number:
+                yield '\x0c'
+            if part or len(parts) == 1:
+                yield from textwrap.wrap(part.expandtabs(4), LINE_CHARS, drop_whitespace=False) or ['']
+
+
+def text_lines_to_pdf(lines, output_path):
+    """
+    Renders an iterable of text lines as a PDF, one page at a time, so
+    memory use doesn't depend on the length of the text. Returns the page count.
+    """
+    with open(output_path, 'wb') as output:
+        writer = StreamingPdfWriter(output)
+        font = writer.add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Courier'),
+            NameObject('/Encoding'): NameObject('/WinAnsiEncoding'),
+        }))
+        resources = writer.add_object(DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        }))
+
+        def write_page(page_lines):
+            top = PAGE_SIZE[1] - MARGIN
+            content = [f'BT /F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {top} Td'.encode()]
+            content.extend(b'T* (' + _escape(line) + b') Tj' for line in page_lines)
+            content.append(b'ET')
+            writer.add_page(b'\n'.join(content), resources, (0, 0) + PAGE_SIZE)
+
+        page_lines = []
+        for line in _wrap(lines):
+            if line == '\x0c': # Form feed: start a new page
+                if page_lines:
+                    write_page(page_lines)
+                    page_lines = []
+                continue
+            if len(page_lines) == PAGE_LINES:
+                write_page(page_lines)
+                page_lines = []
+            page_lines.append(line)
+        if page_lines or not writer.page_numbers:
+            write_page(page_lines)
+        return writer.close()
+
+
+def _iter_text_file(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        yield from f
+
+
+def image_to_pdf(path, output_path):
+    """Writes an image (every frame of a multi-page TIFF/GIF) as a PDF, one image per page."""
+    from PIL import Image, ImageSequence
+
+    with Image.open(path) as image:
+        # convert() gives standalone single-frame copies; Pillow pulls the
+        # remaining frames from the generator one at a time as it writes them
+        frames = (frame.convert('L' if frame.mode in ('1', 'L') else 'RGB') for frame in ImageSequence.Iterator(image))
+        first = next(frames)
+        first.save(output_path, 'PDF', save_all=True, append_images=frames, resolution=150.0)
+        return getattr(image, 'n_frames', 1)
+
+
+def convert_file(path, mime_type, output_path):
+    """Converts a local file to a PDF at `output_path`. Returns the page count."""
+    if mime_type in IMAGE_MIME_TYPES:
+        return image_to_pdf(path, output_path)
+    if mime_type == DOCX_MIME_TYPE:
+        return text_lines_to_pdf(iter_docx_text(path), output_path)
+    if mime_type and mime_type.startswith('text/'):
+        return text_lines_to_pdf(_iter_text_file(path), output_path)
+    raise ValueError(f"Unsupported file type for conversion to PDF: {mime_type}")
+
+
+def run_conversion(path, mime_type, output_path, timeout=None):
+    """
+    Runs convert_file() and turns every failure into a ConversionResult error.
+    When called on a main thread (as pool workers are), a SIGALRM enforces `timeout`.
+    """
+    use_alarm = bool(timeout) and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(int(timeout))
+    try:
+        return ConversionResult(pages=convert_file(path, mime_type, output_path))
+    except ExtractionTimeout:
+        return ConversionResult(error=f"Conversion timed out after {timeout}s")
+    except MemoryError:
+        return ConversionResult(error="Conversion exceeded the worker memory limit")
+    except Exception as e:
+        return ConversionResult(error=f"{type(e).__name__}: {e}")
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
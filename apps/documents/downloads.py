@@ -0,0 +1,196 @@
+# apps/documents/downloads.py
+# Serving document files: streamed responses with HTTP Range support,
+# ETag / Last-Modified conditional GET and optional web server offload
+# (nginx X-Accel-Redirect, Apache/lighttpd X-Sendfile) or, for object storage,
+# a redirect to a presigned URL. Files in the compressed cold tier are
+# decompressed on the fly.
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from urllib.parse import quote
+import os
+import re
+
+from .blobs import touch_blob
+from .storage_io import content_name, iter_range, local_path
+
+# Bytes read per chunk when streaming a file
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header asks for bytes past the end of the file."""
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Parses a single `Range: bytes=start-end` header into an inclusive (start, end) pair.
+    Returns None when the whole file should be sent instead (no header, a syntax
+    we don't support such as multiple ranges). Raises RangeNotSatisfiable when
+    the range lies entirely outside the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None  # An invalid range (last < first) is ignored, per RFC 9110
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def iter_file_range(file, start, end, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yields bytes start..end (inclusive) of an open file, then closes it."""
+    try:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def get_file_validators(document):
+    """
+    Returns (etag, last_modified timestamp) for a document's file.
+    The content hash makes a strong ETag; without one we fall back to size and mtime.
+    """
+    storage = document.file.storage
+    try:
+        modified = storage.get_modified_time(document.file.name)
+        last_modified = int(modified.timestamp())
+    except (NotImplementedError, OSError):
+        last_modified = int(document.upload_date.timestamp()) if document.upload_date else None
+
+    if document.content_hash:
+        etag = quote_etag(document.content_hash)
+    else:
+        etag = quote_etag(f"{document.file_size or 0:x}-{last_modified or 0:x}")
+    return etag, last_modified
+
+
+def _if_range_matches(request, etag, last_modified):
+    # A Range is only honoured if the client's copy is still current (RFC 9110 13.1.5)
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return last_modified is not None and parse_http_date_safe(if_range) == last_modified
+
+
+def _offload_response(document, filename):
+    # Let the web server send the bytes; Django only did the permission check.
+    mode = getattr(settings, 'DOCUMENT_DOWNLOAD_OFFLOAD', '')
+    response = HttpResponse(content_type=document.file_type or 'application/octet-stream')
+    if mode == 'nginx':
+        prefix = getattr(settings, 'DOCUMENT_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(document.file.name)
+    else:
+        response['X-Sendfile'] = document.file.path
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+def _redirect_response(document, filename):
+    # Send the browser to a short-lived presigned URL; the bytes come from object storage
+    response = HttpResponseRedirect(document.file.storage.download_url(document.file.name, filename, document.file_type or None))
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def serve_document_file(request, document):
+    """
+    Builds the download response for a document whose file exists on storage.
+    Handles conditional GET (304 / 412), single byte ranges (206 / 416) and,
+    when DOCUMENT_DOWNLOAD_OFFLOAD is 'nginx' or 'sendfile', hands the transfer
+    to the web server; with 'redirect' (object storage) to a presigned URL.
+    Files on remote storage are streamed with ranged reads (see storage_io.py).
+    Compressed (cold) files are never offloaded; they are streamed decompressed.
+    """
+    storage = document.file.storage
+    compression = document.file.compression
+    filename = document.original_filename or os.path.basename(content_name(document.file.name, compression))
+    if document.blob_id:
+        touch_blob(document.blob)
+    offload = '' if compression else getattr(settings, 'DOCUMENT_DOWNLOAD_OFFLOAD', '')
+    if offload == 'redirect' and hasattr(storage, 'download_url'):
+        # The object store answers Range and conditional requests itself
+        return _redirect_response(document, filename)
+
+    etag, last_modified = get_file_validators(document)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    path = None if compression else local_path(storage, document.file.name)
+    if offload == 'nginx' or (offload == 'sendfile' and path):
+        # nginx and mod_xsendfile handle Range and their own validators
+        response = _offload_response(document, filename)
+    else:
+        size = document.file.size
+        try:
+            byte_range = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range and not _if_range_matches(request, etag, last_modified):
+            byte_range = None
+
+        if byte_range:
+            start, end = byte_range
+            if path:
+                chunks = iter_file_range(storage.open(document.file.name, 'rb'), start, end)
+            else:
+                chunks = iter_range(storage, document.file.name, start, end, DOWNLOAD_CHUNK_SIZE, compression)
+            response = StreamingHttpResponse(
+                chunks,
+                status=206,
+                content_type=document.file_type or 'application/octet-stream',
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Disposition'] = content_disposition_header(True, filename)
+        elif path:
+            # FileResponse streams the file in blocks and sets Content-Length
+            response = FileResponse(
+                storage.open(document.file.name, 'rb'), as_attachment=True, filename=filename,
+                content_type=document.file_type or None,
+            )
+            response.block_size = DOWNLOAD_CHUNK_SIZE
+        else:
+            # One streamed GET (or decompression pass) instead of reading the whole file before the first byte
+            response = StreamingHttpResponse(
+                iter_range(storage, document.file.name, 0, size - 1, DOWNLOAD_CHUNK_SIZE, compression) if size else iter(()),
+                content_type=document.file_type or 'application/octet-stream',
+            )
+            response['Content-Length'] = str(size)
+            response['Content-Disposition'] = content_disposition_header(True, filename)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Documents are private: browsers may revalidate, shared caches must not store them
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,241 @@
+# apps/documents/extraction.py
+# Text extraction engine for document files.
+# Parsing runs in a bounded process pool so a pathological PDF cannot pin a web
+# worker or balloon its memory. This module is imported by the pool's child
+# processes, so it must not import Django models or read Django settings.
+
+import io
+import mimetypes
+import resource
+import signal
+import threading
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+# Extra seconds the parent waits past the per-job timeout before it gives up on a
+# worker that ignored its alarm (e.g. stuck inside C code) and kills the pool.
+TIMEOUT_GRACE_SECONDS = 10
+
+
+@dataclass
+class ExtractionResult:
+    """
+    Outcome of extracting text from one file.
+    `text` is None and `error` describes the problem when extraction failed.
+    `page_offsets[n]` is the offset in `text` where page n + 1 starts (paged formats only).
+    `complete` is False when extraction stopped early at a character or page budget.
+    """
+    text: str = None
+    pages: int = None
+    error: str = None
+    page_offsets: list = field(default_factory=list)
+    complete: bool = True
+
+    @property
+    def ok(self):
+        return self.error is None and self.text is not None
+
+
+class ExtractionTimeout(Exception):
+    """Raised inside a worker when a job runs past its wall-clock timeout."""
+    pass
+
+
+def open_source(source, mode='rb', encoding=None, errors=None):
+    """
+    Opens a file to extract from: `source` is a local path, or the file's bytes
+    (how small files on remote storage are passed to the pool).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(source)
+        return stream if 'b' in mode else io.TextIOWrapper(stream, encoding=encoding, errors=errors)
+    return open(source, mode, encoding=encoding, errors=errors)
+
+
+def iter_pdf_pages(path):
+    """
+    Yields the text of each page of a PDF lazily, one page at a time.
+    Produces the same text as pdfminer's extract_text(), page by page.
+    """
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    with open_source(path) as fp, StringIO() as buffer:
+        rsrcmgr = PDFResourceManager(caching=True)
+        device = TextConverter(rsrcmgr, buffer, laparams=LAParams())
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        for page in PDFPage.get_pages(fp, caching=True):
+            interpreter.process_page(page)
+            yield buffer.getvalue()
+            # Reuse the buffer so only one page of text is held at a time
+            buffer.seek(0)
+            buffer.truncate(0)
+
+
+def extract_pdf(path, max_chars=None, max_pages=None):
+    """
+    Extracts a PDF page by page, stopping after the page that reaches
+    `max_chars` characters or after `max_pages` pages.
+    """
+    parts = []
+    page_offsets = []
+    length = 0
+    pages = iter_pdf_pages(path)
+    complete = True
+    for page_text in pages:
+        page_offsets.append(length)
+        parts.append(page_text)
+        length += len(page_text)
+        if (max_chars and length >= max_chars) or (max_pages and len(page_offsets) >= max_pages):
+            # Stopping here; we can't tell without parsing on whether more pages follow
+            complete = False
+            break
+    pages.close()
+    return ExtractionResult(text=''.join(parts), pages=len(page_offsets), page_offsets=page_offsets, complete=complete)
+
+
+def extract_file(path, mime_type=None, max_chars=None, max_pages=None):
+    """
+    Extracts text from a local file (or a file's bytes, see open_source()) with
+    the extractor registered for its type (see extractors.py). Without
+    `mime_type` the type is sniffed from the content.
+    PDF, ODT and text extraction stop early once `max_chars` / `max_pages` is reached.
+    Runs in the calling process; use ExtractionEngine to run it in the pool.
+    """
+    from .extractors import detect_mime_type, get_extractor
+
+    if mime_type is None:
+        hint = mimetypes.guess_type(path)[0] if isinstance(path, str) else None
+        mime_type = detect_mime_type(path, hint)
+    if mime_type is None:
+        return ExtractionResult(error="Could not determine file type")
+
+    extractor = get_extractor(mime_type)
+    if extractor is None:
+        return ExtractionResult(error=f"Unsupported file type for text extraction: {mime_type}")
+    return extractor(path, max_chars=max_chars, max_pages=max_pages)
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+def run_extraction(path, mime_type=None, timeout=None, max_chars=None, max_pages=None):
+    """
+    Runs extract_file() and turns every failure into an ExtractionResult error.
+    When called on a main thread (as pool workers are), a SIGALRM enforces `timeout`.
+    """
+    use_alarm = bool(timeout) and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(int(timeout))
+    try:
+        return extract_file(path, mime_type, max_chars=max_chars, max_pages=max_pages)
+    except ExtractionTimeout:
+        return ExtractionResult(error=f"Extraction timed out after {timeout}s")
+    except MemoryError:
+        return ExtractionResult(error="Extraction exceeded the worker memory limit")
+    except Exception as e:
+        return ExtractionResult(error=f"{type(e).__name__}: {e}")
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+def _init_worker(max_memory_mb):
+    # Cap the worker's address space so a runaway parse fails with MemoryError
+    # in the worker instead of growing until the box starts swapping.
+    if max_memory_mb:
+        limit = int(max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class ExtractionEngine:
+    """
+    Runs extraction jobs in a bounded ProcessPoolExecutor.
+
+    - max_workers: pool size; 0 runs jobs inline in the calling process (no limits applied)
+    - timeout: wall-clock seconds allowed per job
+    - max_memory_mb: address-space ceiling for each worker process
+    - max_jobs_per_worker: workers are replaced after this many jobs to release leaked memory
+    """
+
+    def __init__(self, max_workers=2, timeout=120, max_memory_mb=1024, max_jobs_per_worker=50):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._executor = None
+        self._lock = threading.Lock()
+        # One in-flight job per worker, so request threads wait here instead of
+        # in the executor's queue: a job's timeout starts when it is submitted,
+        # and one timing out while queued would kill the workers of the others.
+        self._slots = threading.BoundedSemaphore(max(max_workers, 1))
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # max_tasks_per_child makes the executor use the 'spawn' start method,
+                # so workers never inherit the web process's threads or DB connections.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self.max_memory_mb,),
+                    max_tasks_per_child=self.max_jobs_per_worker or None,
+                )
+            return self._executor
+
+    def _reset_executor(self, executor, kill=False):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if kill:
+            # ProcessPoolExecutor has no public way to stop a running job before Python 3.14
+            for process in list(getattr(executor, '_processes', {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func, *args):
+        """
+        Runs func(*args) in the pool and returns its result, or raises
+        FutureTimeoutError / BrokenProcessPool after resetting the pool.
+        func must be a picklable module-level function.
+        """
+        if self.max_workers <= 0:
+            return func(*args)
+
+        with self._slots:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(func, *args)
+                wait = self.timeout + TIMEOUT_GRACE_SECONDS if self.timeout else None
+                return future.result(timeout=wait)
+            except FutureTimeoutError:
+                self._reset_executor(executor, kill=True)
+                raise
+            except BrokenProcessPool:
+                # A worker died abruptly (e.g. killed by the kernel's OOM killer)
+                self._reset_executor(executor)
+                raise
+
+    def extract(self, path, mime_type=None, max_chars=None, max_pages=None):
+        """
+        Extracts text from a local file path or a file's bytes. Always returns an ExtractionResult.
+        """
+        try:
+            return self.submit(run_extraction, path, mime_type, self.timeout, max_chars, max_pages)
+        except FutureTimeoutError:
+            return ExtractionResult(error=f"Extraction timed out after {self.timeout}s")
+        except BrokenProcessPool:
+            return ExtractionResult(error="Extraction worker crashed while processing the file")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,529 @@
+# apps/documents/extractors.py
+# File type detection and the registry of text extractors.
+# The type of a file is sniffed from its first bytes (magic numbers, ZIP
+# contents, markup) rather than trusted from its name, and the extractor
+# registered for that type is used. Extractors can be registered as a
+# "module:function" path so heavy parser libraries are only imported when a
+# file of their type is actually extracted.
+# Runs inside the extraction pool's workers, so no Django imports here either.
+
+from html.parser import HTMLParser
+import importlib
+import re
+import zipfile
+
+from .extraction import ExtractionResult, open_source
+
+# Bytes read from the start of a file to detect its type
+SNIFF_BYTES = 8192
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+ODT_MIME_TYPE = 'application/vnd.oasis.opendocument.text'
+
+# (prefix, MIME type) checked against the first bytes of a file
+MAGIC_SIGNATURES = (
+    (b'{\\rtf', 'application/rtf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'BM', 'image/bmp'),
+)
+
+# Files inside a ZIP that identify Office Open XML formats
+OOXML_MARKERS = (
+    ('word/document.xml', DOCX_MIME_TYPE),
+    ('xl/workbook.xml', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    ('ppt/presentation.xml', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+)
+
+# Header names that mark the start of an email message (RFC 5322)
+EMAIL_HEADERS = {'from', 'to', 'subject', 'date', 'received', 'return-path', 'message-id', 'mime-version', 'delivered-to'}
+
+
+def _sniff_zip(source):
+    try:
+        with zipfile.ZipFile(source) as archive:
+            names = set(archive.namelist())
+            if 'mimetype' in names:
+                # OpenDocument files start with an uncompressed 'mimetype' entry
+                mime_type = archive.read('mimetype').decode('ascii', errors='ignore').strip()
+                if mime_type.startswith('application/vnd.oasis.opendocument.'):
+                    return mime_type
+            for marker, mime_type in OOXML_MARKERS:
+                if marker in names:
+                    return mime_type
+    except (zipfile.BadZipFile, OSError):
+        pass
+    return 'application/zip'
+
+
+def _decode_head(head):
+    # Text decoding of the sniffed bytes, or None if they look binary
+    if b'\x00' in head:
+        return None
+    for cut in range(4):
+        # The sniffed block may end in the middle of a UTF-8 sequence
+        try:
+            return head[:len(head) - cut].decode('utf-8')
+        except UnicodeDecodeError:
+            continue
+    text = head.decode('cp1252', errors='replace')
+    printable = sum(1 for c in text if c.isprintable() or c in '\r\n\t\x0c')
+    return text if printable >= len(text) * 0.95 else None
+
+
+def _looks_like_email(text):
+    names = []
+    for line in text.splitlines():
+        if not line.strip():
+            break
+        if line[0] in ' \t':
+            continue # Folded header continuation
+        match = re.match(r'([!-9;-~]+):', line)
+        if not match:
+            return False
+        names.append(match.group(1).lower())
+    return len(names) >= 2 and bool(EMAIL_HEADERS.intersection(names))
+
+
+def sniff_head_mime_type(head, zip_source=None):
+    """
+    Detects a MIME type from the first SNIFF_BYTES of a file. Returns None for
+    empty or unrecognised binary data, 'text/plain' for text that isn't HTML or
+    email. ZIP-based formats (DOCX, ODT, ...) are only told apart when the whole
+    file is available as `zip_source` (a path or seekable file); otherwise they
+    are reported as 'application/zip'.
+    """
+    if not head:
+        return None
+    if b'%PDF-' in head[:1024]: # Some generators put junk before the header
+        return 'application/pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return _sniff_zip(zip_source) if zip_source is not None else 'application/zip'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime_type in MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+
+    text = _decode_head(head)
+    if text is None:
+        return None
+    start = text.lstrip('\ufeff \t\r\n')[:2048].lower()
+    if start.startswith(('<!doctype html', '<html')) or re.search(r'<(html|head|body)[\s>]', start):
+        return 'text/html'
+    if _looks_like_email(text.lstrip('\ufeff')):
+        return 'message/rfc822'
+    return 'text/plain'
+
+
+def sniff_mime_type(path):
+    """Detects a file's MIME type from its content (see sniff_head_mime_type())."""
+    with open_source(path) as f:
+        head = f.read(SNIFF_BYTES)
+        f.seek(0)
+        return sniff_head_mime_type(head, f)
+
+
+def detect_mime_type(path, hint=None):
+    """
+    Returns the MIME type to extract a file as: the sniffed type, except that
+    a more specific `hint` (e.g. guessed from the file name) wins for plain
+    text (text/csv, message/rfc822, ...) and for unrecognised content.
+    """
+    return prefer_hint(sniff_mime_type(path), hint)
+
+
+def prefer_hint(sniffed, hint):
+    """Combines a sniffed MIME type with a name-based hint as detect_mime_type() does."""
+    if sniffed in (None, 'application/zip'):
+        return hint or sniffed
+    if sniffed == 'text/plain' and hint and (hint.startswith('text/') or hint == 'message/rfc822'):
+        return hint
+    return sniffed
+
+
+# MIME type (or 'family/*') -> extractor(path, max_chars=None, max_pages=None) returning an
+# ExtractionResult, or a 'module:function' path to one that is imported on first use.
+# `path` may also be the file's bytes; extractors open it with extraction.open_source()
+_extractors = {}
+
+
+def register_extractor(mime_types, extractor):
+    """Registers an extractor (callable or 'module:function' path) for one or more MIME types."""
+    if isinstance(mime_types, str):
+        mime_types = [mime_types]
+    for mime_type in mime_types:
+        _extractors[mime_type] = extractor
+
+
+def get_extractor(mime_type):
+    """Returns the extractor callable for a MIME type, or None if no extractor handles it."""
+    if not mime_type:
+        return None
+    key = mime_type if mime_type in _extractors else mime_type.split('/')[0] + '/*'
+    extractor = _extractors.get(key)
+    if isinstance(extractor, str):
+        module_name, _, function_name = extractor.partition(':')
+        extractor = getattr(importlib.import_module(module_name, __package__), function_name)
+        _extractors[key] = extractor # Imported once per process
+    return extractor
+
+
+def extract_text_file(path, max_chars=None, max_pages=None):
+    with open_source(path, 'r', encoding='utf-8', errors='replace') as f:
+        if max_chars:
+            text = f.read(max_chars)
+            return ExtractionResult(text=text, complete=f.read(1) == '')
+        return ExtractionResult(text=f.read())
+
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_P, W_T, W_R, W_TAB, W_BR, W_CR = (W_NS + tag for tag in ('p', 't', 'r', 'tab', 'br', 'cr'))
+W_TBL, W_TR, W_TC = (W_NS + tag for tag in ('tbl', 'tr', 'tc'))
+W_NOTES = (W_NS + 'footnote', W_NS + 'endnote')
+W_NOTE_REFERENCES = (W_NS + 'footnoteReference', W_NS + 'endnoteReference')
+# Alternative content for old readers (e.g. a VML copy of a text box); the preferred copy is read instead
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+DOCX_NOTE_SEPARATORS = ('separator', 'continuationSeparator', 'continuationNotice')
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def _docx_parts(archive):
+    # Text parts of a DOCX in reading order: headers, body, footnotes, endnotes, footers
+    import posixpath
+    import xml.etree.ElementTree as ET
+
+    names = set(archive.namelist())
+    related = {'header': [], 'footnotes': [], 'endnotes': [], 'footer': []}
+    if 'word/_rels/document.xml.rels' in names:
+        for rel in ET.fromstring(archive.read('word/_rels/document.xml.rels')):
+            kind = rel.get('Type', '').rsplit('/', 1)[-1]
+            target = rel.get('Target', '')
+            if kind not in related or rel.get('TargetMode') == 'External':
+                continue
+            name = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('word', target))
+            if name in names:
+                related[kind].append(name)
+    parts = sorted(related['header'], key=_natural_key) + ['word/document.xml']
+    for kind in ('footnotes', 'endnotes', 'footer'):
+        parts += sorted(related[kind], key=_natural_key)
+    return parts
+
+
+def _iter_docx_part(stream):
+    # Yields the paragraphs of one WordprocessingML part; a table row is one
+    # line with its cells separated by ' | '. Elements are dropped as soon as
+    # they have been read, so memory doesn't grow with the document.
+    import xml.etree.ElementTree as ET
+
+    stack = [] # Open elements
+    paragraphs = [] # Text runs of each open paragraph (text boxes nest paragraphs)
+    cells = [] # Paragraphs of each open table cell
+    rows = [] # Cells of each open table row
+    note_prefix = None # '[id] ' for the first paragraph of a footnote/endnote
+    skip_depth = 0
+
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            stack.append(element)
+            if tag == MC_FALLBACK:
+                skip_depth += 1
+            elif skip_depth:
+                pass
+            elif tag == W_P:
+                paragraphs.append([])
+            elif tag == W_TC:
+                cells.append([])
+            elif tag == W_TR:
+                rows.append([])
+            elif tag in W_NOTE_REFERENCES and paragraphs:
+                paragraphs[-1].append(f"[{element.get(W_NS + 'id')}]")
+            elif tag in W_NOTES:
+                skip_depth += element.get(W_NS + 'type') in DOCX_NOTE_SEPARATORS
+                note_prefix = f"[{element.get(W_NS + 'id')}] "
+            continue
+
+        stack.pop()
+        if tag == MC_FALLBACK or (tag in W_NOTES and element.get(W_NS + 'type') in DOCX_NOTE_SEPARATORS):
+            skip_depth -= 1
+        elif skip_depth:
+            pass
+        elif tag == W_T:
+            if paragraphs:
+                paragraphs[-1].append(element.text or '')
+        elif tag in (W_TAB, W_BR, W_CR):
+            # Only inside runs; w:tab also defines tab stops in paragraph properties
+            if paragraphs and stack and stack[-1].tag == W_R:
+                paragraphs[-1].append('\t' if tag == W_TAB else '\n')
+        elif tag == W_P and paragraphs:
+            text = ''.join(paragraphs.pop())
+            if note_prefix:
+                text, note_prefix = note_prefix + text, None
+            if cells:
+                cells[-1].append(text)
+            else:
+                yield text
+        elif tag == W_TC and cells:
+            rows[-1].append(' '.join(p for p in cells.pop() if p))
+        elif tag == W_TR and rows:
+            line = ' | '.join(rows.pop())
+            if cells: # Nested table
+                cells[-1].append(line)
+            else:
+                yield line
+
+        if tag in (W_P, W_TR, W_TBL) or tag in W_NOTES:
+            element.clear()
+            if stack:
+                stack[-1].remove(element)
+
+
+def iter_docx_text(path):
+    """
+    Yields the text of a DOCX paragraph by paragraph in reading order:
+    headers, body (tables row by row), footnotes, endnotes, footers.
+    The XML parts are parsed incrementally straight from the ZIP.
+    """
+    with open_source(path) as f, zipfile.ZipFile(f) as archive:
+        for name in _docx_parts(archive):
+            with archive.open(name) as stream:
+                yield from _iter_docx_part(stream)
+
+
+def extract_docx(path, max_chars=None, max_pages=None):
+    parts = []
+    length = 0
+    for text in iter_docx_text(path):
+        parts.append(text)
+        length += len(text) + 1
+        if max_chars and length >= max_chars:
+            return ExtractionResult(text='\n'.join(parts), complete=False)
+    return ExtractionResult(text='\n'.join(parts))
+
+
+def _odf_text(element, text_ns):
+    # Text of an ODF paragraph, expanding <text:s/>, <text:tab/> and <text:line-break/>
+    parts = [element.text or '']
+    for child in element:
+        tag = child.tag
+        if tag == f'{{{text_ns}}}s':
+            parts.append(' ' * int(child.get(f'{{{text_ns}}}c', '1')))
+        elif tag == f'{{{text_ns}}}tab':
+            parts.append('\t')
+        elif tag == f'{{{text_ns}}}line-break':
+            parts.append('\n')
+        elif not tag.endswith('}annotation'): # Skip comments
+            parts.append(_odf_text(child, text_ns))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def extract_odt(path, max_chars=None, max_pages=None):
+    """OpenDocument text: paragraphs and headings of content.xml, parsed incrementally."""
+    import xml.etree.ElementTree as ET
+
+    text_ns = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+    paragraph_tags = (f'{{{text_ns}}}p', f'{{{text_ns}}}h')
+    parts = []
+    length = 0
+    with open_source(path) as f, zipfile.ZipFile(f) as archive, archive.open('content.xml') as content:
+        depth = 0
+        for event, element in ET.iterparse(content, events=('start', 'end')):
+            if element.tag not in paragraph_tags:
+                continue
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth: # Paragraph nested in another one (e.g. in a text box); the outer one includes it
+                continue
+            parts.append(_odf_text(element, text_ns))
+            length += len(parts[-1]) + 1
+            element.clear()
+            if max_chars and length >= max_chars:
+                return ExtractionResult(text='\n'.join(parts), complete=False)
+    return ExtractionResult(text='\n'.join(parts))
+
+
+# RTF groups whose content is not document text
+RTF_DESTINATIONS = {
+    'fonttbl', 'colortbl', 'stylesheet', 'info', 'pict', 'object', 'objdata', 'datastore', 'themedata',
+    'listtable', 'listoverridetable', 'rsidtbl', 'generator', 'xmlnstbl', 'latentstyles', 'fldinst',
+    'filetbl', 'revtbl', 'pgdsctbl', 'colorschememapping', 'mmathPr', 'wgrffmtfilter', 'private',
+}
+RTF_SPECIAL_CHARS = {
+    'par': '\n', 'line': '\n', 'sect': '\n\n', 'page': '\n\n', 'row': '\n', 'cell': '\t', 'tab': '\t',
+    'emdash': '\u2014', 'endash': '\u2013', 'emspace': ' ', 'enspace': ' ', 'qmspace': ' ', 'bullet': '\u2022',
+    'lquote': '\u2018', 'rquote': '\u2019', 'ldblquote': '\u201c', 'rdblquote': '\u201d',
+}
+RTF_TOKEN = re.compile(r"\\([a-z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-f]{2})|\\([^a-z])|([{}])|[\r\n]+|(.)", re.IGNORECASE)
+
+
+def rtf_to_text(rtf):
+    """Plain text of an RTF document: visible text only, control words and metadata groups dropped."""
+    codepage = 'cp1252'
+    match = re.search(r'\\ansicpg(\d+)', rtf[:4096])
+    if match:
+        codepage = f'cp{match.group(1)}'
+    stack = []
+    ignorable = False
+    unicode_skip = 1 # Fallback characters following each \uN
+    skip = 0
+    out = []
+    for word, arg, hex_code, symbol, brace, char in RTF_TOKEN.findall(rtf):
+        if brace:
+            skip = 0
+            if brace == '{':
+                stack.append((unicode_skip, ignorable))
+            elif stack:
+                unicode_skip, ignorable = stack.pop()
+        elif symbol:
+            skip = 0
+            if symbol == '*':
+                ignorable = True
+            elif ignorable:
+                pass
+            elif symbol == '~':
+                out.append('\xa0')
+            elif symbol in '{}\\':
+                out.append(symbol)
+        elif word:
+            skip = 0
+            if word in RTF_DESTINATIONS:
+                ignorable = True
+            elif ignorable:
+                pass
+            elif word in RTF_SPECIAL_CHARS:
+                out.append(RTF_SPECIAL_CHARS[word])
+            elif word == 'uc':
+                unicode_skip = int(arg or 1)
+            elif word == 'u' and arg:
+                code = int(arg)
+                out.append(chr(code + 0x10000 if code < 0 else code))
+                skip = unicode_skip
+        elif hex_code:
+            if skip:
+                skip -= 1
+            elif not ignorable:
+                try:
+                    out.append(bytes([int(hex_code, 16)]).decode(codepage))
+                except (LookupError, UnicodeDecodeError):
+                    out.append(bytes([int(hex_code, 16)]).decode('cp1252', errors='replace'))
+        elif char:
+            if skip:
+                skip -= 1
+            elif not ignorable:
+                out.append(char)
+    return ''.join(out)
+
+
+def extract_rtf(path, max_chars=None, max_pages=None):
+    with open_source(path, 'r', encoding='latin-1') as f: # RTF is 7-bit; other characters are escaped
+        return ExtractionResult(text=rtf_to_text(f.read()))
+
+
+class _HTMLTextParser(HTMLParser):
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+    BLOCK_TAGS = {
+        'p', 'div', 'br', 'li', 'tr', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'title', 'section',
+        'article', 'header', 'footer', 'blockquote', 'pre', 'ul', 'ol', 'dl', 'dt', 'dd', 'hr',
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+        self.pre_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'pre':
+            self.pre_depth += 1
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag in ('td', 'th'):
+            self.parts.append('\t')
+
+    def handle_endtag(self, tag):
+        if tag == 'pre':
+            self.pre_depth = max(self.pre_depth - 1, 0)
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            # Line breaks in the source are just spaces, except in <pre>
+            self.parts.append(data if self.pre_depth else data.replace('\n', ' '))
+
+
+def html_to_text(html):
+    """Visible text of an HTML document, one line per block element."""
+    parser = _HTMLTextParser()
+    parser.feed(html)
+    parser.close()
+    lines = (re.sub(r'[ \t\r\f\v\xa0]+', ' ', line).strip() for line in ''.join(parser.parts).split('\n'))
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def _decode_html(data):
+    # Declared charset (<meta charset> or http-equiv), else UTF-8, else Windows-1252
+    match = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', data[:4096], re.IGNORECASE)
+    if match:
+        try:
+            return data.decode(match.group(1).decode('ascii'), errors='replace')
+        except LookupError:
+            pass
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors='replace')
+
+
+def extract_html(path, max_chars=None, max_pages=None):
+    with open_source(path) as f:
+        return ExtractionResult(text=html_to_text(_decode_html(f.read())))
+
+
+def extract_eml(path, max_chars=None, max_pages=None):
+    """Email message: main headers, the text body (or HTML body as text) and attachment names."""
+    from email import policy
+    from email.parser import BytesParser
+
+    with open_source(path) as f:
+        message = BytesParser(policy=policy.default).parse(f)
+    lines = [f"{header}: {message[header]}" for header in ('From', 'To', 'Cc', 'Date', 'Subject') if message[header]]
+
+    body = message.get_body(preferencelist=('plain', 'html'))
+    if body is not None:
+        try:
+            content = body.get_content()
+        except (LookupError, UnicodeDecodeError): # Unknown or wrong declared charset
+            content = (body.get_payload(decode=True) or b'').decode('utf-8', errors='replace')
+        if body.get_content_type() == 'text/html':
+            content = html_to_text(content)
+        lines.extend(['', content.strip()])
+
+    attachments = [part.get_filename() for part in message.iter_attachments() if part.get_filename()]
+    if attachments:
+        lines.extend(['', 'Attachments: ' + ', '.join(attachments)])
+    return ExtractionResult(text='\n'.join(lines))
+
+
+register_extractor('application/pdf', '.extraction:extract_pdf')
+register_extractor(DOCX_MIME_TYPE, extract_docx)
+register_extractor(ODT_MIME_TYPE, extract_odt)
+register_extractor(['application/rtf', 'text/rtf'], extract_rtf)
+register_extractor(['text/html', 'application/xhtml+xml'], extract_html)
+register_extractor('message/rfc822', extract_eml)
+register_extractor('text/*', extract_text_file)
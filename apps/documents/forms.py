@@ -1,7 +1,10 @@
 # apps/documents/forms.py
 
 from django import forms
+from django.conf import settings
 from .models import Document
+from apps.clients.models import Client
+from apps.workflows.models import Matter
 
 class DocumentUploadForm(forms.ModelForm):
     """
@@ -34,3 +37,33 @@ class DocumentEditForm(forms.ModelForm):
         model = Document
         fields = ['name', 'client', 'matter'] # Example fields for editing links
 
+
+class BulkUploadForm(forms.Form):
+    """
+    Form for uploading a ZIP archive of documents (see bulk_upload.py).
+    Only matters the user is assigned to and clients they created are offered,
+    unless they are an admin.
+    """
+    archive = forms.FileField(
+        help_text="A ZIP file; every file inside it becomes a document.",
+        widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.zip,application/zip'}),
+    )
+    matter = forms.ModelChoiceField(queryset=Matter.objects.none(), required=False, widget=forms.Select(attrs={'class': 'form-select'}))
+    client = forms.ModelChoiceField(queryset=Client.objects.none(), required=False, widget=forms.Select(attrs={'class': 'form-select'}))
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        matters = Matter.objects.all()
+        clients = Client.objects.all()
+        if user is not None and not (user.is_superuser or user.role == 'admin'):
+            matters = matters.filter(assigned_users=user)
+            clients = clients.filter(created_by=user)
+        self.fields['matter'].queryset = matters
+        self.fields['client'].queryset = clients
+
+    def clean_archive(self):
+        archive = self.cleaned_data.get('archive')
+        max_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+        if archive.size > max_size:
+            raise forms.ValidationError(f"The archive cannot exceed {max_size // (1024 * 1024)} MB.")
+        return archive
@@ -0,0 +1,502 @@
+# apps/documents/jobs.py
+# Database-backed job queue for document AI processing.
+# Views enqueue ProcessingJob rows; `manage.py process_documents` claims and runs them.
+# Jobs a user is waiting on (summarize, segment, convert, and merge/split from
+# the admin) run at interactive priority. Every new Document is queued for text extraction and indexing at
+# background priority (see signals.py), so its text is ready before anyone asks
+# for it; during DOCUMENT_PEAK_HOURS a worker keeps most of its slots free for
+# interactive jobs.
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from datetime import timedelta
+import os
+import socket
+import threading
+import time
+
+from .models import Document, DocumentBlob, ExtractedText, ProcessingBatch, ProcessingJob, TextSignature
+from .utils import (
+    EXTRACTOR_VERSION, convert_document, get_extracted_text, merge_documents, segment_document, split_document,
+    summarize_document,
+)
+from .conversion import ConversionError
+from .pdf_tools import PdfToolError
+from .search import index_extracted_text, is_indexed
+from .similarity import (
+    DEFAULT_NEAR_DUPLICATE_SIMILARITY, DEFAULT_SUMMARY_REUSE_SIMILARITY,
+    find_reusable_summary, flag_near_duplicate, index_signature,
+)
+
+ACTIVE_JOB_STATUSES = ('queued', 'processing')
+
+# Tasks that never change Document.status, which tracks AI processing.
+# 'convert', 'merge' and 'split' create new Documents instead of changing this one.
+BACKGROUND_TASKS = ('index', 'convert', 'merge', 'split')
+
+# Tasks whose options choose their inputs: a waiting job only stands in for
+# a new one with the same options (merging the same selection again)
+OPTION_KEYED_TASKS = ('merge',)
+
+# Tasks that call the Gemini API; only these count against a worker's rate limit
+AI_TASKS = ('summarize', 'segment')
+
+# Rows per INSERT/UPDATE statement when enqueueing or recording large batches
+BULK_BATCH_SIZE = 500
+
+# ProcessingJob.priority; lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class JobFailed(Exception):
+    """Raised by a task handler when the task produced no usable result."""
+    pass
+
+
+def _summarize(document, bypass_cache=False):
+    # A near-identical document of the same uploader that is already summarized
+    # (e.g. a re-upload with small edits) lends its summary instead of a new AI call
+    reuse_threshold = getattr(settings, 'DOCUMENT_SUMMARY_REUSE_SIMILARITY', DEFAULT_SUMMARY_REUSE_SIMILARITY)
+    if reuse_threshold and not bypass_cache and get_extracted_text(document):
+        source = find_reusable_summary(document, EXTRACTOR_VERSION, reuse_threshold)
+        if source:
+            document.summary = source.summary
+            return ['summary']
+
+    summary = summarize_document(document, bypass_cache=bypass_cache)
+    if not summary:
+        raise JobFailed("Failed to summarize document. Check logs.")
+    document.summary = summary
+    return ['summary']
+
+
+def _segment(document, bypass_cache=False):
+    segmentation_result = segment_document(document, bypass_cache=bypass_cache)
+    if not segmentation_result:
+        raise JobFailed("Failed to segment document. Check logs.")
+    document.segmentation_result = segmentation_result
+    return ['segmentation_result']
+
+
+def _index(document, force=False):
+    # Full extraction; get_extracted_text() adds complete text to the search index
+    extracted = get_extracted_text(document)
+    if extracted is None:
+        raise JobFailed("Failed to extract document text for search. Check logs.")
+    # Also completes the index when an earlier attempt stored the text but failed before indexing it
+    index_extracted_text(extracted, force=force)
+    index_signature(extracted) # Extractions stored before near-duplicate detection have none yet
+    flag_near_duplicate(document, EXTRACTOR_VERSION, _near_duplicate_threshold())
+    # Documents with the same content uploaded meanwhile shared this job (see enqueue_search_indexing)
+    if document.content_hash:
+        for other in Document.objects.filter(content_hash=document.content_hash).exclude(pk=document.pk):
+            flag_near_duplicate(other, EXTRACTOR_VERSION, _near_duplicate_threshold())
+    return []
+
+
+def _near_duplicate_threshold():
+    return getattr(settings, 'DOCUMENT_NEAR_DUPLICATE_SIMILARITY', DEFAULT_NEAR_DUPLICATE_SIMILARITY)
+
+
+def _convert(document):
+    # Runs the conversion in the extraction process pool; the PDF becomes a new Document
+    try:
+        convert_document(document)
+    except ConversionError as e:
+        raise JobFailed(str(e))
+    return []
+
+
+def _get_owner(document, owner_id):
+    # The user who asked for the new documents; the input's uploader if they were deleted since
+    return get_user_model().objects.filter(pk=owner_id).first() or document.uploaded_by
+
+
+def _merge(document, document_ids, owner_id=None):
+    # `document` is the first input; `document_ids` lists all of them in merge order
+    documents = Document.objects.in_bulk(document_ids)
+    if len(documents) < len(set(document_ids)):
+        raise JobFailed("A document selected for merging was deleted.")
+    try:
+        merge_documents([documents[pk] for pk in document_ids], _get_owner(document, owner_id))
+    except PdfToolError as e:
+        raise JobFailed(str(e))
+    return []
+
+
+def _split(document, owner_id=None):
+    try:
+        split_document(document, _get_owner(document, owner_id))
+    except PdfToolError as e:
+        raise JobFailed(str(e))
+    return []
+
+
+# Task name -> handler(document, **job.options), returning the Document fields it changed
+TASK_HANDLERS = {
+    'summarize': _summarize,
+    'segment': _segment,
+    'index': _index,
+    'convert': _convert,
+    'merge': _merge,
+    'split': _split,
+}
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `per_minute` job starts per minute (0 means unlimited).
+    Used by the worker to stay under the Gemini API quota, for AI_TASKS only.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        if not self.per_minute:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60.0)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def refund(self):
+        """Returns a token taken by try_acquire() that ended up unused."""
+        if self.per_minute:
+            with self.lock:
+                self.tokens = min(self.per_minute, self.tokens + 1)
+
+
+def get_worker_id():
+    """Identifies this worker process in job leases."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_document_job(document, task, requested_by=None, options=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Queues a task for a document and marks the document as processing.
+    If the same task is already waiting for this document (with the same options,
+    for OPTION_KEYED_TASKS), that job is returned instead (moved up to `priority`
+    if it was queued at a lower one).
+    """
+    with transaction.atomic():
+        # Locking the document row makes concurrent enqueues for it wait, so two can't both miss `existing`
+        list(Document.objects.select_for_update().filter(pk=document.pk).values_list('pk'))
+        existing = ProcessingJob.objects.filter(document=document, task=task, status='queued')
+        if task in OPTION_KEYED_TASKS:
+            existing = existing.filter(options=options or {})
+        existing = existing.first()
+        if existing:
+            if existing.priority > priority:
+                ProcessingJob.objects.filter(pk=existing.pk).update(priority=priority)
+                existing.priority = priority
+            return existing
+
+        job = ProcessingJob.objects.create(
+            document=document,
+            task=task,
+            options=options or {},
+            requested_by=requested_by,
+            priority=priority,
+            max_attempts=getattr(settings, 'DOCUMENT_JOB_MAX_ATTEMPTS', 3),
+        )
+    if task not in BACKGROUND_TASKS:
+        Document.objects.filter(pk=document.pk).update(status='processing')
+        document.status = 'processing'
+    return job
+
+
+def enqueue_search_indexing(document, priority=PRIORITY_BACKGROUND):
+    """
+    Queues a document for text extraction (stored with its page offsets),
+    full-text indexing and near-duplicate detection unless its content is already
+    indexed (e.g. a duplicate upload), in which case it is checked for
+    near-duplicates straight away. Content whose text was already extracted
+    (e.g. for a summary) is indexed from the stored text without a job, and
+    content that already has an index job pending shares that job.
+    Returns the job, or None if nothing needed doing.
+    """
+    if not document.file:
+        return None
+    if needs_indexing(document):
+        extracted = document.content_hash and ExtractedText.objects.filter(
+            content_hash=document.content_hash, extractor_version=EXTRACTOR_VERSION, is_complete=True
+        ).first()
+        if not extracted:
+            return _enqueue_index_job(document, priority)
+        # Parsed before (e.g. for a summary) but not indexed: index the stored text
+        index_extracted_text(extracted)
+        index_signature(extracted)
+    flag_near_duplicate(document, EXTRACTOR_VERSION, _near_duplicate_threshold())
+    return None
+
+
+def _enqueue_index_job(document, priority):
+    # One pending index job per content; later uploads of the same content share it
+    with transaction.atomic():
+        # The blob row lock makes concurrent uploads of the same content see each other's job
+        if document.blob_id:
+            list(DocumentBlob.objects.select_for_update().filter(pk=document.blob_id).values_list('pk'))
+        if document.content_hash:
+            pending = ProcessingJob.objects.filter(
+                task='index', status__in=ACTIVE_JOB_STATUSES, document__content_hash=document.content_hash
+            ).first()
+            if pending:
+                return pending # _index() flags every document with this content when it's done
+        return enqueue_document_job(document, 'index', priority=priority)
+
+
+def needs_indexing(document):
+    """False if the document's content is already in the search and near-duplicate indexes."""
+    return not (
+        document.content_hash
+        and is_indexed(document.content_hash, EXTRACTOR_VERSION)
+        and TextSignature.objects.filter(content_hash=document.content_hash, extractor_version=EXTRACTOR_VERSION).exists()
+    )
+
+
+def enqueue_document_batch(documents, task, requested_by=None, options=None, max_parallel=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Queues a task for every document in a queryset as one ProcessingBatch.
+    Jobs are created with bulk_create and documents (for AI tasks) marked
+    processing with a single UPDATE per chunk. Documents without a file, or that already have
+    the same task waiting, are skipped.
+    """
+    batch = ProcessingBatch.objects.create(
+        task=task,
+        requested_by=requested_by,
+        max_parallel=max_parallel or getattr(settings, 'DOCUMENT_BATCH_FAN_OUT', 4),
+    )
+    already_queued = ProcessingJob.objects.filter(task=task, status='queued').values('document_id')
+    document_ids = list(
+        documents.exclude(file='').exclude(pk__in=already_queued).values_list('pk', flat=True)
+    )
+    max_attempts = getattr(settings, 'DOCUMENT_JOB_MAX_ATTEMPTS', 3)
+
+    for start in range(0, len(document_ids), BULK_BATCH_SIZE):
+        chunk = document_ids[start:start + BULK_BATCH_SIZE]
+        ProcessingJob.objects.bulk_create([
+            ProcessingJob(
+                document_id=document_id,
+                task=task,
+                options=options or {},
+                requested_by=requested_by,
+                batch=batch,
+                priority=priority,
+                max_attempts=max_attempts,
+            )
+            for document_id in chunk
+        ])
+        if task not in BACKGROUND_TASKS:
+            Document.objects.filter(pk__in=chunk).update(status='processing')
+
+    batch.total = len(document_ids)
+    batch.save(update_fields=['total'])
+    return batch
+
+
+def _full_batch_ids(candidates, now):
+    # Batches that already have max_parallel jobs running; their other jobs must wait
+    batch_limits = {job.batch_id: job.batch.max_parallel for job in candidates if job.batch_id}
+    if not batch_limits:
+        return set()
+    running = ProcessingJob.objects.filter(
+        batch_id__in=batch_limits, status='processing', lease_expires_at__gte=now
+    ).values('batch_id').annotate(count=Count('pk'))
+    return {row['batch_id'] for row in running if row['count'] >= batch_limits[row['batch_id']]}
+
+
+def claim_next_job(worker_id, lease_seconds=None, max_priority=None, exclude_tasks=None):
+    """
+    Claims the next runnable job for this worker, or returns None.
+    Runnable jobs are queued jobs whose retry delay has passed, and processing
+    jobs whose lease expired because their worker died; interactive jobs come
+    first. With `max_priority`, only jobs of that priority or a more urgent one
+    are claimed; with `exclude_tasks`, jobs of those tasks are not. Jobs of a
+    batch that already has max_parallel jobs running are skipped.
+    Claiming is a compare-and-set update, so concurrent workers never share a job.
+    """
+    lease_seconds = lease_seconds or getattr(settings, 'DOCUMENT_JOB_LEASE_SECONDS', 300)
+    now = timezone.now()
+    runnable = ProcessingJob.objects.filter(
+        Q(status='queued', run_after__lte=now) |
+        Q(status='processing', lease_expires_at__lt=now)
+    )
+    if max_priority is not None:
+        runnable = runnable.filter(priority__lte=max_priority)
+    if exclude_tasks:
+        runnable = runnable.exclude(task__in=exclude_tasks)
+    candidates = list(runnable.select_related('batch').order_by('priority', 'run_after', 'pk')[:20])
+    full_batches = _full_batch_ids(candidates, now)
+
+    for job in candidates:
+        if job.batch_id in full_batches:
+            continue
+        claimed = ProcessingJob.objects.filter(
+            pk=job.pk, status=job.status, lease_expires_at=job.lease_expires_at
+        ).update(
+            status='processing',
+            locked_by=worker_id,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return ProcessingJob.objects.select_related('document').get(pk=job.pk)
+    return None
+
+
+def parse_hour_ranges(value):
+    """
+    Parses hours like '8-18' or '8-12,13-18' (start inclusive, end exclusive;
+    '22-6' wraps past midnight) into a list of (start, end). '' means none.
+    Raises ValueError for anything else.
+    """
+    ranges = []
+    for part in filter(None, (part.strip() for part in (value or '').split(','))):
+        start, _, end = part.partition('-')
+        start, end = int(start), int(end)
+        if not (0 <= start <= 23 and 0 <= end <= 24) or start == end:
+            raise ValueError(f"Invalid hour range '{part}'")
+        ranges.append((start, end))
+    return ranges
+
+
+def in_peak_hours(now=None):
+    """True if the local time falls within DOCUMENT_PEAK_HOURS."""
+    try:
+        ranges = parse_hour_ranges(getattr(settings, 'DOCUMENT_PEAK_HOURS', ''))
+    except ValueError as e:
+        print(f"Ignoring DOCUMENT_PEAK_HOURS: {e}")
+        return False
+    hour = timezone.localtime(now).hour
+    return any(start <= hour < end if start < end else (hour >= start or hour < end) for start, end in ranges)
+
+
+def renew_leases(job_ids, worker_id, lease_seconds=None):
+    """
+    Heartbeat: extends the leases this worker holds on the given jobs.
+    Returns the ids whose lease was lost (reclaimed by another worker).
+    """
+    lease_seconds = lease_seconds or getattr(settings, 'DOCUMENT_JOB_LEASE_SECONDS', 300)
+    renewed = set(ProcessingJob.objects.filter(
+        pk__in=job_ids, status='processing', locked_by=worker_id
+    ).values_list('pk', flat=True))
+    ProcessingJob.objects.filter(pk__in=renewed).update(
+        lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds)
+    )
+    return [job_id for job_id in job_ids if job_id not in renewed]
+
+
+def get_retry_delay(attempts):
+    """Exponential backoff: DOCUMENT_JOB_RETRY_BACKOFF seconds, doubled per failed attempt."""
+    base = getattr(settings, 'DOCUMENT_JOB_RETRY_BACKOFF', 30)
+    return min(base * (2 ** max(attempts - 1, 0)), 3600)
+
+
+def _refresh_document_statuses(document_ids, finished_status):
+    # A document stays 'processing' while it still has other jobs in flight
+    busy = ProcessingJob.objects.filter(
+        document_id__in=document_ids, status__in=ACTIVE_JOB_STATUSES
+    ).exclude(task__in=BACKGROUND_TASKS).values_list('document_id', flat=True)
+    Document.objects.filter(pk__in=document_ids).exclude(pk__in=busy).update(status=finished_status)
+
+
+def execute_job(job):
+    """
+    Runs a claimed job's task handler without writing anything.
+    Returns (job, changed_fields, error); error is None on success.
+    """
+    handler = TASK_HANDLERS.get(job.task)
+    try:
+        if handler is None:
+            raise JobFailed(f"Unknown task '{job.task}'")
+        if job.attempts > job.max_attempts:
+            raise JobFailed(f"Gave up after {job.max_attempts} attempts")
+        return job, handler(job.document, **job.options), None
+    except Exception as e:
+        return job, None, e
+
+
+def record_job_results(results, worker_id):
+    """
+    Writes the outcomes of execute_job() calls back to the database.
+    Successful jobs and their documents are saved with bulk_update (one statement
+    per chunk); failed jobs are re-queued with backoff or marked as error.
+    Results are only written for jobs whose lease this worker still holds.
+    Returns the number of jobs recorded as processed.
+    """
+    successes = [(job, fields) for job, fields, error in results if error is None]
+    for job, fields, error in results:
+        if error is not None:
+            _fail_job(job, worker_id, error)
+    if not successes:
+        return 0
+
+    held = set(ProcessingJob.objects.filter(
+        pk__in=[job.pk for job, fields in successes], status='processing', locked_by=worker_id
+    ).values_list('pk', flat=True))
+    now = timezone.now()
+    finished_jobs = []
+    documents_by_fields = {}
+    for job, fields in successes:
+        if job.pk not in held:
+            print(f"Lost the lease on job {job.pk}; discarding its result.")
+            continue
+        job.status = 'processed'
+        job.last_error = None
+        job.lease_expires_at = None
+        job.finished_at = now
+        job.updated_at = now
+        finished_jobs.append(job)
+        # Only write the fields each task changed, so concurrent tasks don't overwrite each other
+        if fields:
+            documents_by_fields.setdefault(tuple(fields), []).append(job.document)
+
+    with transaction.atomic():
+        ProcessingJob.objects.bulk_update(
+            finished_jobs, ['status', 'last_error', 'lease_expires_at', 'finished_at', 'updated_at'],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        for fields, documents in documents_by_fields.items():
+            Document.objects.bulk_update(documents, list(fields), batch_size=BULK_BATCH_SIZE)
+    _refresh_document_statuses(
+        [job.document_id for job in finished_jobs if job.task not in BACKGROUND_TASKS], 'processed'
+    )
+    return len(finished_jobs)
+
+
+def run_job(job, worker_id):
+    """
+    Runs a single claimed job and records its outcome. Returns True on success.
+    """
+    return record_job_results([execute_job(job)], worker_id) == 1
+
+
+def _fail_job(job, worker_id, error):
+    now = timezone.now()
+    print(f"Job {job.pk} ({job.task} document {job.document_id}) failed on attempt {job.attempts}: {error}")
+    jobs = ProcessingJob.objects.filter(pk=job.pk, status='processing', locked_by=worker_id)
+    if job.attempts < job.max_attempts and job.task in TASK_HANDLERS:
+        jobs.update(
+            status='queued',
+            last_error=str(error),
+            lease_expires_at=None,
+            run_after=now + timedelta(seconds=get_retry_delay(job.attempts)),
+            updated_at=now,
+        )
+    else:
+        jobs.update(status='error', last_error=str(error), lease_expires_at=None, finished_at=now, updated_at=now)
+        if job.task not in BACKGROUND_TASKS:
+            _refresh_document_statuses([job.document_id], 'error')
@@ -0,0 +1,269 @@
+# apps/documents/management/commands/benchmark_documents.py
+# Benchmarks for the document file pipeline, printed as tables.
+# - storage: reading and extracting text files from local disk vs object
+#   storage (see storage_io.py and storage_backends.py)
+# - upload: storing a large scan in object storage with 1..N multipart parts
+#   in flight (DOCUMENT_S3_MULTIPART_CONCURRENCY)
+# - pdf: peak RSS of merging 4 PDFs with pdf_tools.merge_pdfs() vs pypdf's
+#   PdfWriter, as the inputs grow (see benchmarks.py)
+# - docx: time and peak RSS of extracting a long contract with the streaming
+#   extractor (extractors.extract_docx()) vs python-docx's object tree
+# Object storage is the bucket at --endpoint-url (MinIO, ...) or, without it, an
+# in-process moto bucket behind a simulated network (--latency, --bandwidth).
+# Nothing touches MEDIA_ROOT or the database; files are written under a
+# temp directory / the benchmark/ prefix of the bucket and deleted afterwards.
+# Usage: python manage.py benchmark_documents storage [--sizes 1,4,40]
+#        [--endpoint-url URL --bucket NAME] [--latency 20] [--bandwidth 100]
+#        python manage.py benchmark_documents upload [--upload-size 256]
+#        [--concurrency 1,4,8,16] [--endpoint-url URL --bucket NAME] [...]
+#        python manage.py benchmark_documents pdf [--pages 200,800,3200] [--image-kb 100]
+#        python manage.py benchmark_documents docx [--contract-pages 500]
+
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+import logging
+import os
+import tempfile
+import time
+
+from apps.documents.benchmarks import (
+    docx_text_with_python_docx, measure, merge_pdfs_with_pypdf, write_sample_contract, write_sample_pdf,
+)
+from apps.documents.extractors import extract_docx
+from apps.documents.pdf_tools import merge_pdfs
+from apps.documents.storage_io import extraction_source, iter_range, sniff_stored_mime_type
+from apps.documents.utils import get_extraction_engine
+
+MB = 1024 * 1024
+
+BENCHMARKS = ('storage', 'upload', 'pdf', 'docx')
+
+# Their DEBUG logging (on with the root logger at DEBUG) costs more than the requests being timed
+QUIET_LOGGERS = ('boto3', 'botocore', 's3transfer', 'urllib3')
+
+# Text the extraction benchmark files are made of
+CLAUSE = b'The Supplier shall indemnify the Customer against all losses arising out of any breach.\n'
+
+
+def parse_sizes(value):
+    try:
+        return [float(size) for size in value.split(',')]
+    except ValueError:
+        raise CommandError(f"Invalid size list {value!r}; use e.g. 1,4,40.")
+
+
+def parse_counts(value):
+    try:
+        return [int(count) for count in value.split(',')]
+    except ValueError:
+        raise CommandError(f"Invalid list {value!r}; use e.g. 1,4,8,16.")
+
+
+class SimulatedNetwork:
+    """
+    Adds a round trip per S3 request and a per-connection transfer time to a
+    boto3 client, so an in-process moto bucket behaves like a remote one.
+    """
+
+    def __init__(self, latency_ms, bandwidth_mb):
+        self.latency = latency_ms / 1000
+        self.bandwidth = bandwidth_mb * MB
+
+    def install(self, client):
+        client.meta.events.register('before-call.s3.*', self.before_call)
+        client.meta.events.register('after-call.s3.*', self.after_call)
+
+    def before_call(self, params, **kwargs):
+        body = params.get('body')
+        sent = len(body) if hasattr(body, '__len__') else 0 # bytes, or the file chunk of a part
+        time.sleep(self.latency + sent / self.bandwidth)
+
+    def after_call(self, parsed, **kwargs):
+        if 'Body' in parsed:
+            time.sleep(parsed.get('ContentLength', 0) / self.bandwidth)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks document storage and extraction and prints the results."
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmark', choices=BENCHMARKS, help="Which benchmark to run.")
+        parser.add_argument(
+            '--sizes', type=parse_sizes, default=[1, 4, 40],
+            help="storage: comma-separated file sizes in MB (default: 1,4,40).",
+        )
+        parser.add_argument(
+            '--upload-size', type=float, default=256,
+            help="upload: size of the uploaded file in MB (default: 256).",
+        )
+        parser.add_argument(
+            '--concurrency', type=parse_counts, default=[1, 4, 8, 16],
+            help="upload: comma-separated numbers of parts in flight (default: 1,4,8,16).",
+        )
+        parser.add_argument(
+            '--pages', type=parse_counts, default=[200, 800, 3200],
+            help="pdf: comma-separated total page counts of the merged output (default: 200,800,3200).",
+        )
+        parser.add_argument(
+            '--image-kb', type=int, default=100,
+            help="pdf: size of the scanned image on each page in KB (default: 100).",
+        )
+        parser.add_argument(
+            '--contract-pages', type=int, default=500,
+            help="docx: length of the generated contract in pages (default: 500).",
+        )
+        parser.add_argument(
+            '--endpoint-url', default=None,
+            help="storage, upload: S3-compatible endpoint to benchmark (default: an in-process moto bucket).",
+        )
+        parser.add_argument(
+            '--bucket', default='benchmark',
+            help="storage, upload: bucket to use with --endpoint-url; it must exist (default: benchmark).",
+        )
+        parser.add_argument(
+            '--latency', type=float, default=20,
+            help="storage, upload: simulated round trip per request in ms, without --endpoint-url (default: 20).",
+        )
+        parser.add_argument(
+            '--bandwidth', type=float, default=100,
+            help="storage, upload: simulated MB/s per connection, without --endpoint-url (default: 100).",
+        )
+
+    def handle(self, *args, **options):
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        getattr(self, f"benchmark_{options['benchmark']}")(options)
+
+    def open_bucket(self, stack, options, **kwargs):
+        # A DocumentS3Storage on the benchmark bucket; kwargs override its settings
+        try:
+            from apps.documents.storage_backends import DocumentS3Storage
+        except ImportError:
+            raise CommandError("The storage benchmark needs boto3 and django-storages.")
+        if options['endpoint_url']:
+            return DocumentS3Storage(endpoint_url=options['endpoint_url'], bucket_name=options['bucket'], location='benchmark', **kwargs)
+
+        try:
+            import boto3
+            from moto import mock_aws
+        except ImportError:
+            raise CommandError("Without --endpoint-url the storage benchmark needs moto (pip install moto).")
+        if not getattr(self, 'mocked', False):
+            stack.enter_context(mock_aws())
+            boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='benchmark')
+            self.mocked = True
+            self.stdout.write(
+                f"Object storage: in-process moto bucket, {options['latency']:g} ms round trip, "
+                f"{options['bandwidth']:g} MB/s per connection."
+            )
+        storage = DocumentS3Storage(
+            bucket_name='benchmark', region_name='us-east-1', endpoint_url=None,
+            access_key='benchmark', secret_key='benchmark', location='benchmark', **kwargs
+        )
+        SimulatedNetwork(options['latency'], options['bandwidth']).install(storage.connection.meta.client)
+        return storage
+
+    def benchmark_storage(self, options):
+        engine = get_extraction_engine()
+        engine.extract(CLAUSE, 'text/plain') # Start the worker pool before anything is timed
+        with ExitStack() as stack:
+            local = FileSystemStorage(location=stack.enter_context(tempfile.TemporaryDirectory()))
+            bucket = self.open_bucket(stack, options)
+
+            self.stdout.write(f"{'size':>8}  {'storage':<8}{'sniff':>9}{'read':>12}{'extract':>12}")
+            for size_mb in options['sizes']:
+                content = CLAUSE * max(1, int(size_mb * MB) // len(CLAUSE))
+                for label, storage in (('local', local), ('s3', bucket)):
+                    name = storage.save('agreement.txt', ContentFile(content))
+                    try:
+                        start = time.perf_counter()
+                        sniff_stored_mime_type(storage, name)
+                        sniffed = time.perf_counter() - start
+
+                        start = time.perf_counter()
+                        for _ in iter_range(storage, name, 0, len(content) - 1):
+                            pass
+                        read = time.perf_counter() - start
+
+                        start = time.perf_counter()
+                        with extraction_source(storage, name, size=len(content)) as source:
+                            result = engine.extract(source, 'text/plain')
+                        extracted = time.perf_counter() - start
+                    finally:
+                        storage.delete(name)
+                    if result.error:
+                        raise CommandError(f"Extraction failed on {label} storage: {result.error}")
+                    self.stdout.write(
+                        f"{len(content) / MB:6.1f}MB  {label:<8}{sniffed * 1000:7.0f}ms"
+                        f"{len(content) / MB / read:8.0f}MB/s{len(content) / MB / extracted:8.0f}MB/s"
+                    )
+
+    def benchmark_upload(self, options):
+        from boto3.s3.transfer import TransferConfig
+
+        size = int(options['upload_size'] * MB)
+        with ExitStack() as stack:
+            scan = stack.enter_context(tempfile.NamedTemporaryFile())
+            for _ in range(0, size, MB):
+                scan.write(os.urandom(min(MB, size - scan.tell())))
+            scan.flush()
+
+            local = FileSystemStorage(location=stack.enter_context(tempfile.TemporaryDirectory()))
+            targets = [('local disk', local)]
+            for concurrency in options['concurrency']:
+                # The DOCUMENT_S3_MULTIPART_* defaults, with this many parts in flight
+                transfer_config = TransferConfig(
+                    multipart_threshold=getattr(settings, 'DOCUMENT_S3_MULTIPART_THRESHOLD', 16 * MB),
+                    multipart_chunksize=getattr(settings, 'DOCUMENT_S3_MULTIPART_CHUNK_SIZE', 16 * MB),
+                    max_concurrency=concurrency,
+                )
+                targets.append((f's3, {concurrency:2} part(s) in flight', self.open_bucket(stack, options, transfer_config=transfer_config)))
+
+            self.stdout.write(f"Uploading {size / MB:.0f} MB:")
+            for label, storage in targets:
+                scan.seek(0)
+                start = time.perf_counter()
+                name = storage.save('scan.pdf', File(scan))
+                elapsed = time.perf_counter() - start
+                storage.delete(name)
+                self.stdout.write(f"  {label:<28}{elapsed:7.2f}s{size / MB / elapsed:8.0f}MB/s")
+
+    def benchmark_pdf(self, options):
+        self.stdout.write("Merging 4 PDFs; peak RSS above the process's baseline:")
+        self.stdout.write(f"{'input':>9}{'pages':>7}  {'merge_pdfs':>20}  {'pypdf PdfWriter':>20}")
+        for pages in options['pages']:
+            with tempfile.TemporaryDirectory() as directory:
+                paths = []
+                for index in range(4):
+                    path = os.path.join(directory, f'input{index}.pdf')
+                    write_sample_pdf(path, pages // 4, options['image_kb'], label=f'File {index + 1} page')
+                    paths.append(path)
+                size = sum(os.path.getsize(path) for path in paths)
+
+                results = []
+                for func in (merge_pdfs, merge_pdfs_with_pypdf):
+                    output_path = os.path.join(directory, 'merged.pdf')
+                    written, elapsed, baseline, peak = measure(func, paths, output_path)
+                    os.remove(output_path)
+                    results.append(f"{peak - baseline:+8.1f}MB {elapsed:5.1f}s")
+                self.stdout.write(f"{size / MB:7.0f}MB{written:7}  {results[0]:>20}  {results[1]:>20}")
+
+    def benchmark_docx(self, options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'contract.docx')
+            write_sample_contract(path, options['contract_pages'])
+            self.stdout.write(
+                f"Extracting a {options['contract_pages']}-page contract ({os.path.getsize(path) / MB:.1f} MB DOCX); "
+                "peak RSS above the process's baseline:"
+            )
+            for label, func in (('extract_docx (streaming)', extract_docx), ('python-docx paragraphs', docx_text_with_python_docx)):
+                result, elapsed, baseline, peak = measure(func, path)
+                text = result if isinstance(result, str) else result.text
+                self.stdout.write(
+                    f"  {label:<26}{elapsed:6.2f}s{peak - baseline:+8.1f}MB{len(text):>11,} chars"
+                    f"{text.count('Schedule item value'):>7,} table cells"
+                )
@@ -0,0 +1,146 @@
+# apps/documents/management/commands/collect_orphaned_files.py
+# Finds files under MEDIA_ROOT that no database row references (left behind by
+# failed saves, replaced uploads or cascade deletes) and optionally deletes them.
+# The media tree is walked with os.scandir and checked against every FileField
+# in batches, so neither the file list nor any table is held in memory.
+# Usage: python manage.py collect_orphaned_files [--delete] [--min-age HOURS] [--prefix DIR ...]
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.template.defaultfilters import filesizeformat
+import os
+import time
+
+
+def iter_media_files(root, prefixes=None):
+    """
+    Yields (name, size, mtime) for every file below `root`, where `name` is the
+    storage name ('documents/2024/01/02/deed.pdf'). Directories are read one
+    at a time; symlinks are not followed.
+    """
+    pending = [os.path.join(root, prefix) for prefix in prefixes] if prefixes else [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue # Missing prefix or unreadable directory
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                    yield name, stat.st_size, stat.st_mtime
+
+
+def file_fields():
+    """(model, field name) of every FileField (ImageField included) in the project."""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        if isinstance(field, models.FileField)
+    ]
+
+
+def referenced_names(names, fields):
+    """The subset of storage `names` that some FileField row points at."""
+    found = set()
+    for model, field_name in fields:
+        found.update(
+            model._default_manager.filter(**{f'{field_name}__in': names}).values_list(field_name, flat=True)
+        )
+    return found
+
+
+class Command(BaseCommand):
+    help = "Reports (and with --delete removes) media files that no database row references."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete', action='store_true',
+            help="Delete the orphaned files instead of only reporting them.",
+        )
+        parser.add_argument(
+            '--min-age', type=float, default=24,
+            help="Ignore files modified within this many hours, e.g. uploads still being saved (default 24).",
+        )
+        parser.add_argument(
+            '--prefix', action='append', dest='prefixes',
+            help="Only walk this directory under MEDIA_ROOT (e.g. documents, compliance_files). Can be repeated.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="File names checked against the database per query (default 500).",
+        )
+        parser.add_argument(
+            '--list', action='store_true',
+            help="Print the name of every orphaned file.",
+        )
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, FileSystemStorage):
+            raise CommandError("Orphaned file collection only supports local (FileSystemStorage) media.")
+        root = os.path.abspath(settings.MEDIA_ROOT)
+        fields = file_fields()
+        cutoff = time.time() - options['min_age'] * 3600
+        batch_size = max(options['batch_size'], 1)
+
+        # prefix -> [files, bytes, orphaned files, orphaned bytes]
+        totals = {}
+        deleted = failed = reclaimed = 0
+
+        def check(batch):
+            nonlocal deleted, failed, reclaimed
+            referenced = referenced_names([name for name, size in batch], fields)
+            for name, size in batch:
+                if name in referenced:
+                    continue
+                stats = totals[name.split('/', 1)[0] if '/' in name else '.']
+                stats[2] += 1
+                stats[3] += size
+                if options['list']:
+                    self.stdout.write(name)
+                if options['delete']:
+                    try:
+                        os.remove(os.path.join(root, name))
+                        deleted += 1
+                        reclaimed += size
+                    except OSError as e:
+                        self.stderr.write(f"Could not delete {name}: {e}")
+                        failed += 1
+
+        batch = []
+        for name, size, mtime in iter_media_files(root, options['prefixes']):
+            stats = totals.setdefault(name.split('/', 1)[0] if '/' in name else '.', [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += size
+            if mtime > cutoff:
+                continue
+            batch.append((name, size))
+            if len(batch) >= batch_size:
+                check(batch)
+                batch = []
+        if batch:
+            check(batch)
+
+        if not totals:
+            self.stdout.write(f"No files found under {root}.")
+            return
+
+        self.stdout.write(f"{'Prefix':<24} {'Files':>9} {'Size':>10} {'Orphaned':>9} {'Reclaimable':>12}")
+        for prefix, (files, size, orphans, orphan_size) in sorted(totals.items()):
+            self.stdout.write(
+                f"{prefix:<24} {files:>9} {filesizeformat(size):>10} {orphans:>9} {filesizeformat(orphan_size):>12}"
+            )
+        orphans = sum(stats[2] for stats in totals.values())
+        orphan_size = sum(stats[3] for stats in totals.values())
+        if options['delete']:
+            self.stdout.write(f"Deleted {deleted} orphaned file(s), {failed} failed; {filesizeformat(reclaimed)} reclaimed.")
+        else:
+            self.stdout.write(f"{orphans} orphaned file(s), {filesizeformat(orphan_size)} reclaimable. Run with --delete to remove them.")
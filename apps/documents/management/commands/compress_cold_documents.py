@@ -0,0 +1,117 @@
+# apps/documents/management/commands/compress_cold_documents.py
+# Moves document files nobody has read for a while to the compressed cold tier
+# (see apps/documents/cold_storage.py) and reports the disk space reclaimed.
+# Each run also deletes the files earlier runs replaced, once their grace
+# period (DOCUMENT_COLD_DELETE_GRACE_HOURS) is over.
+# Usage: python manage.py compress_cold_documents [--days N] [--codec gzip|zstd]
+#        [--min-saving F] [--limit N] [--dry-run] [--restore]
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from apps.documents.cold_storage import (
+    CODECS, ColdStorageError, check_codec, cold_candidates, cold_tier_totals, compress_blob, delete_replaced_files,
+    restore_blob,
+)
+from apps.documents.models import DocumentBlob
+
+
+class Command(BaseCommand):
+    help = "Compresses document files that haven't been read for a while and reports the space reclaimed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Compress files not read for this many days (default: DOCUMENT_COLD_AFTER_DAYS).",
+        )
+        parser.add_argument(
+            '--codec', choices=CODECS, default=None,
+            help="Compression codec (default: DOCUMENT_COLD_CODEC).",
+        )
+        parser.add_argument(
+            '--min-saving', type=float, default=None,
+            help="Skip files whose sample shrinks by less than this fraction (default: DOCUMENT_COLD_MIN_SAVING).",
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help="Process at most this many files.",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many files are cold.",
+        )
+        parser.add_argument(
+            '--restore', action='store_true',
+            help="Decompress every file in the cold tier instead.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            deleted = delete_replaced_files()
+            if deleted:
+                self.stdout.write(f"Deleted {deleted} replaced file(s) whose grace period is over.")
+        if options['restore']:
+            return self.restore(options)
+
+        codec = options['codec'] or getattr(settings, 'DOCUMENT_COLD_CODEC', 'gzip')
+        try:
+            check_codec(codec)
+        except ColdStorageError as e:
+            raise CommandError(str(e))
+
+        candidates = cold_candidates(options['days'])
+        if options['limit']:
+            candidates = candidates[:options['limit']]
+        if options['dry_run']:
+            self.stdout.write(f"{candidates.count()} cold file(s) would be checked for compression.")
+            return
+
+        compressed = skipped = failed = 0
+        reclaimed = 0
+        for blob in candidates.iterator(chunk_size=100):
+            try:
+                saved = compress_blob(blob, codec, options['min_saving'])
+            except Exception as e:
+                self.stderr.write(f"Blob {blob.pk} ({blob.file.name}): {e}")
+                failed += 1
+                continue
+            if saved:
+                compressed += 1
+                reclaimed += saved
+            else:
+                skipped += 1 # Already compressed formats, or changed meanwhile
+
+        self.stdout.write(
+            f"Compressed {compressed} file(s) with {codec}, reclaiming {filesizeformat(reclaimed)}; "
+            f"{skipped} skipped as poorly compressible, {failed} failed."
+        )
+        self.report_totals()
+
+    def restore(self, options):
+        cold = DocumentBlob.objects.exclude(compression='').order_by('pk')
+        if options['limit']:
+            cold = cold[:options['limit']]
+        if options['dry_run']:
+            self.stdout.write(f"{cold.count()} compressed file(s) would be restored.")
+            return
+
+        restored = failed = 0
+        grown = 0
+        for blob in cold.iterator(chunk_size=100):
+            try:
+                grown += restore_blob(blob)
+                restored += 1
+            except Exception as e:
+                self.stderr.write(f"Blob {blob.pk} ({blob.file.name}): {e}")
+                failed += 1
+        self.stdout.write(f"Restored {restored} file(s), using {filesizeformat(grown)} more disk; {failed} failed.")
+        self.report_totals()
+
+    def report_totals(self):
+        blobs, size, stored_size = cold_tier_totals()
+        if blobs:
+            self.stdout.write(
+                f"Cold tier: {blobs} file(s), {filesizeformat(size)} stored in {filesizeformat(stored_size)} "
+                f"({filesizeformat(size - stored_size)} reclaimed in total)."
+            )
@@ -0,0 +1,46 @@
+# apps/documents/management/commands/dedupe_documents.py
+# Moves documents stored before content-addressed blobs existed onto shared blobs.
+# Usage: python manage.py dedupe_documents [--recount] [--dry-run]
+
+from django.core.management.base import BaseCommand
+
+from apps.documents.blobs import move_document_to_blob, recount_blob_references
+from apps.documents.models import Document
+
+
+class Command(BaseCommand):
+    help = "Moves legacy document files onto deduplicated, content-addressed blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recount', action='store_true',
+            help="Also reset blob reference counts from the documents that use them.",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many documents would be moved.",
+        )
+
+    def handle(self, *args, **options):
+        legacy = Document.objects.filter(blob__isnull=True).exclude(file='').only('pk', 'file', 'original_filename')
+        if options['dry_run']:
+            self.stdout.write(f"{legacy.count()} document(s) would be moved to blobs.")
+            return
+
+        moved = failed = 0
+        for document in legacy.iterator(chunk_size=500):
+            if not document.file.storage.exists(document.file.name):
+                self.stderr.write(f"Document {document.pk}: file {document.file.name} is missing, skipped.")
+                failed += 1
+                continue
+            try:
+                move_document_to_blob(document)
+                moved += 1
+            except Exception as e:
+                self.stderr.write(f"Document {document.pk}: {e}")
+                failed += 1
+        self.stdout.write(f"Moved {moved} document(s) to blobs, {failed} skipped.")
+
+        if options['recount']:
+            deleted = recount_blob_references()
+            self.stdout.write(f"Reference counts reset; {deleted} unused blob(s) deleted.")
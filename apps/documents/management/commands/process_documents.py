@@ -0,0 +1,168 @@
+# apps/documents/management/commands/process_documents.py
+# Worker that runs queued document AI jobs (see apps/documents/jobs.py).
+# Usage: python manage.py process_documents [--concurrency 4] [--rate-limit 60]
+#        [--peak-background-slots 1] [--once]
+# Interactive jobs are claimed before background ones. During DOCUMENT_PEAK_HOURS
+# at most --peak-background-slots background jobs run at once, so the other
+# slots are free the moment a user asks for a summary; off-peak all slots are used.
+# --rate-limit only applies to AI jobs (summarize, segment); while it holds them
+# back, index, convert, merge and split jobs keep running.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import signal
+import threading
+
+from apps.documents.jobs import (
+    AI_TASKS, PRIORITY_INTERACTIVE, RateLimiter, claim_next_job, execute_job, get_worker_id, in_peak_hours,
+    record_job_results, renew_leases,
+)
+
+
+class Command(BaseCommand):
+    help = "Runs queued document processing jobs (summarize, segment, convert, index)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int,
+            default=getattr(settings, 'DOCUMENT_WORKER_CONCURRENCY', 2),
+            help="Number of jobs to run at the same time.",
+        )
+        parser.add_argument(
+            '--rate-limit', type=int,
+            default=getattr(settings, 'DOCUMENT_AI_RATE_LIMIT', 0),
+            help="Maximum AI jobs (summarize, segment) started per minute by this worker (0 = unlimited).",
+        )
+        parser.add_argument(
+            '--peak-background-slots', type=int,
+            default=getattr(settings, 'DOCUMENT_PEAK_BACKGROUND_SLOTS', 1),
+            help="Background jobs run at the same time during DOCUMENT_PEAK_HOURS (0 = wait for off-peak).",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            '--lease-seconds', type=int,
+            default=getattr(settings, 'DOCUMENT_JOB_LEASE_SECONDS', 300),
+            help="How long a claimed job stays reserved without a heartbeat.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once the queue is empty instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        self.concurrency = max(options['concurrency'], 1)
+        self.peak_background_slots = max(options['peak_background_slots'], 0)
+        self.lease_seconds = options['lease_seconds']
+        self.rate_limiter = RateLimiter(options['rate_limit'])
+        self.worker_id = get_worker_id()
+        self.stopping = threading.Event() # Stop claiming new jobs
+        self.finished = threading.Event() # All running jobs are done
+        self.in_flight = {} # future -> job id; kept until the result is recorded
+        self.background = set() # futures of in-flight background jobs
+        self.in_flight_lock = threading.Lock()
+
+        # Finish running jobs on Ctrl+C / SIGTERM, but stop claiming new ones
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGTERM, self._request_stop)
+
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+
+        self.stdout.write(f"Worker {self.worker_id} started with concurrency {self.concurrency}.")
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not self.stopping.is_set():
+                claimed, rate_limited = self._fill_slots(executor)
+                with self.in_flight_lock:
+                    running = list(self.in_flight)
+                if running:
+                    # Record every job that finished during the wait in one go
+                    done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    self._record(done)
+                elif not claimed:
+                    if options['once'] and not rate_limited:
+                        break
+                    self.stopping.wait(options['poll_interval'])
+
+            # Let jobs that are still running finish and record them
+            with self.in_flight_lock:
+                running = list(self.in_flight)
+            done, _ = wait(running)
+            self._record(done)
+
+        self.finished.set()
+        self.stdout.write(f"Worker {self.worker_id} stopped.")
+
+    def _request_stop(self, signum, frame):
+        self.stdout.write("Stopping after running jobs finish...")
+        self.stopping.set()
+
+    def _fill_slots(self, executor):
+        # Claim jobs until every slot is busy or nothing is left that may run now.
+        # Returns (jobs claimed, whether the rate limit held back AI jobs).
+        claimed = 0
+        peak = in_peak_hours()
+        while not self.stopping.is_set():
+            with self.in_flight_lock:
+                if len(self.in_flight) >= self.concurrency:
+                    break
+                background_full = peak and len(self.background) >= self.peak_background_slots
+            # Without a token only jobs that make no AI call may be claimed
+            ai_allowed = self.rate_limiter.try_acquire()
+            job = claim_next_job(
+                self.worker_id, self.lease_seconds, max_priority=PRIORITY_INTERACTIVE if background_full else None,
+                exclude_tasks=None if ai_allowed else AI_TASKS,
+            )
+            if ai_allowed and (job is None or job.task not in AI_TASKS):
+                self.rate_limiter.refund()
+            if job is None:
+                return claimed, not ai_allowed
+            future = executor.submit(self._run, job)
+            with self.in_flight_lock:
+                self.in_flight[future] = job.pk
+                if job.priority > PRIORITY_INTERACTIVE:
+                    self.background.add(future)
+            claimed += 1
+        return claimed, False
+
+    def _run(self, job):
+        try:
+            return execute_job(job)
+        finally:
+            # Each pool thread has its own DB connection; don't leave it open between jobs
+            close_old_connections()
+            connection.close()
+
+    def _record(self, futures):
+        if not futures:
+            return
+        results = [future.result() for future in futures]
+        processed = record_job_results(results, self.worker_id)
+        with self.in_flight_lock:
+            for future in futures:
+                self.in_flight.pop(future, None)
+                self.background.discard(future)
+        for job, fields, error in results:
+            if error is None:
+                self.stdout.write(f"Job {job.pk}: {job.task} document {job.document_id} processed.")
+            else:
+                self.stderr.write(f"Job {job.pk}: {job.task} document {job.document_id} failed (attempt {job.attempts}).")
+        if len(results) > 1:
+            self.stdout.write(f"Recorded {processed} of {len(results)} finished jobs.")
+
+    def _heartbeat(self):
+        # Renew leases well before they expire so live jobs are never reclaimed.
+        # Keeps running after a stop request until the last job has finished.
+        interval = max(self.lease_seconds / 3, 1)
+        while not self.finished.wait(interval):
+            with self.in_flight_lock:
+                job_ids = list(self.in_flight.values())
+            if job_ids:
+                lost = renew_leases(job_ids, self.worker_id, self.lease_seconds)
+                for job_id in lost:
+                    self.stderr.write(f"Lost the lease on job {job_id}.")
+            connection.close()
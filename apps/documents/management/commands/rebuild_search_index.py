@@ -0,0 +1,34 @@
+# apps/documents/management/commands/rebuild_search_index.py
+# Queues every document whose text isn't in the full-text search index yet.
+# Usage: python manage.py rebuild_search_index [--force]
+
+from django.core.management.base import BaseCommand
+
+from apps.documents.jobs import PRIORITY_BACKGROUND, enqueue_document_job, enqueue_search_indexing
+from apps.documents.models import Document
+
+
+class Command(BaseCommand):
+    help = "Queues 'index' jobs so all documents become searchable (run process_documents to work through them)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Re-index documents that are already indexed.",
+        )
+
+    def handle(self, *args, **options):
+        queued = 0
+        seen_hashes = set()
+        for document in Document.objects.exclude(file='').only('pk', 'file', 'content_hash').iterator(chunk_size=500):
+            # Identical files share their index pages; one job per content is enough
+            if document.content_hash:
+                if document.content_hash in seen_hashes:
+                    continue
+                seen_hashes.add(document.content_hash)
+            if options['force']:
+                job = enqueue_document_job(document, 'index', options={'force': True}, priority=PRIORITY_BACKGROUND)
+            else:
+                job = enqueue_search_indexing(document)
+            queued += job is not None
+        self.stdout.write(f"Queued {queued} document(s) for indexing.")
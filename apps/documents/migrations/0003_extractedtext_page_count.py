@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_document_content_hash_extractedtext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractedtext',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
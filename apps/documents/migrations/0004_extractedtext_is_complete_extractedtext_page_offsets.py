@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_extractedtext_page_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractedtext',
+            name='is_complete',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='extractedtext',
+            name='page_offsets',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_processingjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('max_parallel', models.PositiveIntegerField(default=4)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Processing batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='documents.processingbatch'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_documentblob_document_original_filename_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processingjob',
+            name='task',
+            field=models.CharField(choices=[('summarize', 'Summarize'), ('segment', 'Segment'), ('index', 'Index for search')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='SearchPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('extractor_version', models.PositiveIntegerField()),
+                ('page', models.PositiveIntegerField(blank=True, null=True)),
+                ('body', models.TextField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['content_hash', 'extractor_version'], name='documents_s_content_417dc7_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Creates the database-specific full-text index over SearchPage.body:
+# - SQLite: an external-content FTS5 table kept in sync by triggers
+# - PostgreSQL: a generated tsvector column with a GIN index
+# Other databases (or SQLite builds without FTS5) get no index; search then
+# falls back to a slow LIKE scan (see apps/documents/search.py).
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE documents_searchpage_fts USING fts5(
+        body, content='documents_searchpage', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER documents_searchpage_ai AFTER INSERT ON documents_searchpage BEGIN
+        INSERT INTO documents_searchpage_fts(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER documents_searchpage_ad AFTER DELETE ON documents_searchpage BEGIN
+        INSERT INTO documents_searchpage_fts(documents_searchpage_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER documents_searchpage_au AFTER UPDATE ON documents_searchpage BEGIN
+        INSERT INTO documents_searchpage_fts(documents_searchpage_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO documents_searchpage_fts(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    # Index any rows that already exist
+    "INSERT INTO documents_searchpage_fts(documents_searchpage_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS documents_searchpage_au",
+    "DROP TRIGGER IF EXISTS documents_searchpage_ad",
+    "DROP TRIGGER IF EXISTS documents_searchpage_ai",
+    "DROP TABLE IF EXISTS documents_searchpage_fts",
+]
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE documents_searchpage ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', body)) STORED
+    """,
+    "CREATE INDEX documents_searchpage_search_vector_idx ON documents_searchpage USING GIN (search_vector)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS documents_searchpage_search_vector_idx",
+    "ALTER TABLE documents_searchpage DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def create_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        if not _sqlite_has_fts5(connection):
+            print("SQLite was built without FTS5; document search will use a slow fallback.")
+            return
+        statements = SQLITE_FORWARD
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_FORWARD
+    else:
+        return
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}.get(vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_alter_processingjob_task_searchpage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
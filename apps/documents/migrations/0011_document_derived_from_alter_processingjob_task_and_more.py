@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_searchpage_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='derived_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='derivatives', to='documents.document'),
+        ),
+        migrations.AlterField(
+            model_name='processingjob',
+            name='task',
+            field=models.CharField(choices=[('summarize', 'Summarize'), ('segment', 'Segment'), ('convert', 'Convert to PDF'), ('index', 'Index for search')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ConvertedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('converter_version', models.PositiveIntegerField()),
+                ('page_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversions', to='documents.documentblob')),
+            ],
+            options={
+                'unique_together': {('content_hash', 'converter_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0001_initial'),
+        ('documents', '0011_document_derived_from_alter_processingjob_task_and_more'),
+        ('workflows', '0002_alter_matter_options_alter_workflow_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['-upload_date', '-id'], name='document_upload_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['uploaded_by', '-upload_date', '-id'], name='document_uploader_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['matter', '-upload_date', '-id'], name='document_matter_date_idx'),
+        ),
+    ]
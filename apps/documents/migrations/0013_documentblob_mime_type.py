@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_document_document_upload_date_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentblob',
+            name='mime_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
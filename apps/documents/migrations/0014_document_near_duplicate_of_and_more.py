@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_documentblob_mime_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='near_duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='documents.document'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='near_duplicate_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TextSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('extractor_version', models.PositiveIntegerField()),
+                ('signature', models.BinaryField()),
+                ('shingle_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'extractor_version')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SignatureBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('signature', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='documents.textsignature')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='documents_s_band_6cd91e_idx')],
+            },
+        ),
+    ]
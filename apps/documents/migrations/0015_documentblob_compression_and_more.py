@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:12
+
+import apps.documents.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_document_near_duplicate_of_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentblob',
+            name='compression',
+            field=models.CharField(blank=True, choices=[('', 'None'), ('gzip', 'gzip'), ('zstd', 'Zstandard')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='documentblob',
+            name='last_accessed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentblob',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=apps.documents.models.DocumentFileField(upload_to='documents/%Y/%m/%d/'),
+        ),
+    ]
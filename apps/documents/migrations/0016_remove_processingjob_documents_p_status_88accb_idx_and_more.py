@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_documentblob_compression_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='processingjob',
+            name='documents_p_status_88accb_idx',
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Interactive'), (10, 'Background')], default=0),
+        ),
+        migrations.AddIndex(
+            model_name='processingjob',
+            index=models.Index(fields=['status', 'priority', 'run_after'], name='documents_p_status_adfcea_idx'),
+        ),
+    ]
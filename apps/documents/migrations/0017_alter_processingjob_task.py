@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0016_remove_processingjob_documents_p_status_88accb_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processingjob',
+            name='task',
+            field=models.CharField(choices=[('summarize', 'Summarize'), ('segment', 'Segment'), ('convert', 'Convert to PDF'), ('index', 'Index for search'), ('merge', 'Merge PDFs'), ('split', 'Split PDF')], max_length=20),
+        ),
+    ]
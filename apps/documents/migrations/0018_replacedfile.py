@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0017_alter_processingjob_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplacedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(max_length=255, upload_to='')),
+                ('delete_after', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,8 +1,12 @@
 # apps/documents/models.py
 
 from django.db import models
+from django.db.models.fields.files import FieldFile
 from django.conf import settings # To link to the custom user model
+from django.core.files import File
+from django.utils import timezone
 import os # To handle file paths
+import uuid
 
 # Import models from other apps (will be created later)
 # Use strings for ForeignKey relationships if the models are in other apps
@@ -10,6 +14,95 @@ import os # To handle file paths
 # from apps.clients.models import Client # Example
 # from apps.workflows.models import Matter # Example
 
+class DocumentBlob(models.Model):
+    """
+    A stored file, named by the SHA-256 of its content (see apps/documents/blobs.py).
+    Documents with identical content share one blob; `ref_count` is the number of
+    Documents pointing at it and the file is deleted when the last one goes.
+    Blobs nobody has read for a while can be moved to the compressed cold tier
+    (see apps/documents/cold_storage.py).
+    """
+    COMPRESSION_CHOICES = (
+        ('', 'None'),
+        ('gzip', 'gzip'),
+        ('zstd', 'Zstandard'),
+    )
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255) # blobs/ab/cd/<sha256><ext>; name is set explicitly
+    size = models.BigIntegerField() # Size of the content, also when stored compressed
+    # Type sniffed from the content (see extractors.py); filled on first use
+    mime_type = models.CharField(max_length=100, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Cold tier: how the file is compressed on storage and its size there
+    compression = models.CharField(max_length=10, choices=COMPRESSION_CHOICES, blank=True, default='')
+    stored_size = models.BigIntegerField(null=True, blank=True)
+    # Last download/export/extraction, at day resolution (see blobs.touch_blob)
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
+
+class ReplacedFile(models.Model):
+    """
+    A blob file replaced by a new copy when its blob moved to or from the cold tier.
+    Downloads that opened the old name may still be reading it, so it is only
+    deleted after `delete_after` (see cold_storage.delete_replaced_files).
+    """
+    file = models.FileField(max_length=255)
+    delete_after = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.file.name} (delete after {self.delete_after:%Y-%m-%d %H:%M})"
+
+
+class DocumentFieldFile(FieldFile):
+    """
+    FieldFile that reads cold-tier (compressed) files decompressed, so
+    document.file.open()/read()/chunks() and .size always see the original content.
+    """
+
+    @property
+    def compression(self):
+        """How the file is compressed on storage ('' if it isn't)."""
+        blob = self.instance.blob if self.instance.blob_id else None
+        return blob.compression if blob is not None and blob.file.name == self.name else ''
+
+    def _get_file(self):
+        self._require_file()
+        if getattr(self, '_file', None) is None:
+            compression = self.compression
+            if compression:
+                from .storage_io import open_stored
+                self._file = File(open_stored(self.storage, self.name, compression), name=self.name)
+            else:
+                self._file = self.storage.open(self.name, 'rb')
+        return self._file
+
+    file = property(_get_file, FieldFile._set_file, FieldFile._del_file)
+
+    def open(self, mode='rb'):
+        if 'r' in mode and self.compression:
+            self.close()
+            self._file = None
+            self._get_file()
+            return self
+        return super().open(mode)
+
+    @property
+    def size(self):
+        if self.compression:
+            return self.instance.blob.size
+        return super().size
+
+
+class DocumentFileField(models.FileField):
+    attr_class = DocumentFieldFile
+
+
 class Document(models.Model):
     """
     Model to represent a document uploaded by a user.
@@ -19,7 +112,7 @@ class Document(models.Model):
 
     # The actual document file
     # upload_to specifies a subdirectory within MEDIA_ROOT
-    file = models.FileField(upload_to='documents/%Y/%m/%d/')
+    file = DocumentFileField(upload_to='documents/%Y/%m/%d/')
     related_name='documents'
 
     # Document metadata
@@ -47,6 +140,23 @@ class Document(models.Model):
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploaded')
 
+    # SHA-256 of the file content, filled lazily by utils.get_document_hash().
+    # Cleared in save() whenever the file is replaced so cached text is not reused.
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+
+    # Shared content-addressed file; `file` holds the same storage name.
+    # Legacy documents uploaded before blobs existed have no blob until
+    # `manage.py dedupe_documents` moves them over.
+    blob = models.ForeignKey(DocumentBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='documents')
+    original_filename = models.CharField(max_length=255, blank=True) # Name of the file as uploaded, used for downloads
+
+    # Set on documents generated from another one (PDF conversion, split parts)
+    derived_from = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='derivatives')
+
+    # Most similar earlier document of the same uploader, set when the text is indexed (see similarity.py)
+    near_duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='near_duplicates')
+    near_duplicate_score = models.FloatField(blank=True, null=True) # Estimated Jaccard similarity, 0..1
+
     # Fields for document editing/QES (can be added later)
     # e.g., edited_file = models.FileField(upload_to='edited_documents/', blank=True, null=True)
     # qes_status = models.CharField(max_length=20, blank=True, null=True)
@@ -56,7 +166,38 @@ class Document(models.Model):
         # String representation of the document
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which file was loaded so save() can tell when it gets replaced
+        loaded = dict(zip(field_names, values))
+        instance._loaded_file_name = loaded.get('file')
+        instance._loaded_blob_id = loaded.get('blob_id')
+        return instance
+
     def save(self, *args, **kwargs):
+        from .blobs import attach_blob, release_blob
+
+        # If an existing document gets a new file, the old content hash no longer applies
+        if self.pk and hasattr(self, '_loaded_file_name') and self.file.name != self._loaded_file_name:
+            self.content_hash = None
+
+        # A newly assigned file is stored as (or matched to) a content-addressed blob
+        # instead of staying under upload_to; this sets blob, file and content_hash.
+        file_changed = bool(self.file) and (
+            not self.file._committed or self.file.name != getattr(self, '_loaded_file_name', None)
+        )
+        new_blob = file_changed and not (self.blob_id and self.file.name == self.blob.file.name)
+        if new_blob:
+            attach_blob(self)
+        elif self.pk and self.blob_id and self.file and not file_changed:
+            # The blob's file may have been renamed since this was loaded (moved
+            # to or from the cold tier); don't write the old name back
+            current_name = DocumentBlob.objects.filter(pk=self.blob_id).values_list('file', flat=True).first()
+            if current_name and current_name != self.file.name:
+                self.file = current_name
+                self._loaded_file_name = current_name
+
         # Automatically set file_size and file_type on save if not set
         if not self.file_size and self.file:
             self.file_size = self.file.size
@@ -68,16 +209,255 @@ class Document(models.Model):
         if not self.name and self.file:
              self.name = os.path.basename(self.file.name)
 
-        super().save(*args, **kwargs)
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            if new_blob:
+                release_blob(self.blob_id) # Undo the reference taken by attach_blob()
+            raise
+
+        # Drop the reference to the blob this document pointed at before
+        previous_blob_id = getattr(self, '_loaded_blob_id', None)
+        if previous_blob_id and previous_blob_id != self.blob_id:
+            release_blob(previous_blob_id)
+        self._loaded_file_name = self.file.name
+        self._loaded_blob_id = self.blob_id
 
     def delete(self, *args, **kwargs):
-        # Delete the actual file when the Document object is deleted
-        if self.file:
-            if os.path.isfile(self.file.path):
-                os.remove(self.file.path)
-        super().delete(*args, **kwargs)
+        from .blobs import release_blob
+
+        blob_id, file_name = self.blob_id, self.file.name
+        result = super().delete(*args, **kwargs)
+        if blob_id:
+            # The blob (and its file) is only deleted once no document uses it
+            release_blob(blob_id)
+        elif file_name and not Document.objects.filter(file=file_name).exists():
+            # Legacy per-document file
+            self.file.storage.delete(file_name)
+        return result
 
     class Meta:
         # Order documents by upload date by default
         ordering = ['-upload_date']
+        # Keyset pagination of the document list (see pagination.py) for
+        # admins, per uploader and per matter
+        indexes = [
+            models.Index(fields=['-upload_date', '-id'], name='document_upload_date_idx'),
+            models.Index(fields=['uploaded_by', '-upload_date', '-id'], name='document_uploader_date_idx'),
+            models.Index(fields=['matter', '-upload_date', '-id'], name='document_matter_date_idx'),
+        ]
+
+
+class ExtractedText(models.Model):
+    """
+    Plain text extracted from a document file, stored so the file is only parsed once.
+    Keyed by content hash and extractor version: identical files share one row,
+    and bumping utils.EXTRACTOR_VERSION makes every stored extraction stale.
+    """
+    content_hash = models.CharField(max_length=64)
+    extractor_version = models.PositiveIntegerField()
+    text = models.TextField()
+    page_count = models.PositiveIntegerField(blank=True, null=True) # Only known for paged formats (PDF)
+    # page_offsets[n] is where page n + 1 starts in `text`, so single pages can be read without re-parsing
+    page_offsets = models.JSONField(default=list, blank=True)
+    # False when extraction stopped at a character/page budget; `text` is then only a prefix
+    is_complete = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} (v{self.extractor_version})"
 
+    class Meta:
+        unique_together = ('content_hash', 'extractor_version')
+
+
+
+class ConvertedFile(models.Model):
+    """
+    Cache of PDF conversions (see apps/documents/conversion.py): the blob holding
+    the PDF made from content `content_hash` by converter version `converter_version`.
+    Converting the same content again reuses the blob instead of converting.
+    The entry goes away with its blob, i.e. once no converted document uses it.
+    """
+    content_hash = models.CharField(max_length=64)
+    converter_version = models.PositiveIntegerField()
+    blob = models.ForeignKey(DocumentBlob, on_delete=models.CASCADE, related_name='conversions')
+    page_count = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} (v{self.converter_version}) -> {self.blob.sha256[:12]}"
+
+    class Meta:
+        unique_together = ('content_hash', 'converter_version')
+
+
+class SearchPage(models.Model):
+    """
+    One page (or, for unpaged formats, one chunk) of extracted text in the
+    full-text search index (see apps/documents/search.py). Keyed by content hash,
+    like ExtractedText, so duplicate files are indexed once. The database-specific
+    index over `body` (SQLite FTS5 table or Postgres tsvector/GIN) is created by migration 0010.
+    """
+    content_hash = models.CharField(max_length=64)
+    extractor_version = models.PositiveIntegerField()
+    page = models.PositiveIntegerField(blank=True, null=True) # None for unpaged text chunks
+    body = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_hash', 'extractor_version']),
+        ]
+
+
+class TextSignature(models.Model):
+    """
+    MinHash signature of extracted text, used to find near-duplicate documents
+    (see apps/documents/similarity.py). Keyed by content hash like ExtractedText.
+    """
+    content_hash = models.CharField(max_length=64)
+    extractor_version = models.PositiveIntegerField()
+    signature = models.BinaryField() # similarity.SIGNATURE_SIZE unsigned 64-bit values
+    shingle_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} (v{self.extractor_version})"
+
+    class Meta:
+        unique_together = ('content_hash', 'extractor_version')
+
+
+class SignatureBand(models.Model):
+    """
+    LSH index entry: the bucket one band of a TextSignature hashes to.
+    Signatures that share a bucket in any band are near-duplicate candidates.
+    """
+    signature = models.ForeignKey(TextSignature, on_delete=models.CASCADE, related_name='bands')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket']),
+        ]
+
+
+class ProcessingBatch(models.Model):
+    """
+    A group of ProcessingJobs submitted together, e.g. from a DocumentAdmin bulk action.
+    At most `max_parallel` of its jobs run at the same time across all workers.
+    """
+    task = models.CharField(max_length=20)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    total = models.PositiveIntegerField(default=0) # Number of jobs created for the batch
+    max_parallel = models.PositiveIntegerField(default=4)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Batch {self.pk}: {self.task} ({self.total} documents)"
+
+    def get_progress(self):
+        """
+        Returns job counts for this batch keyed by job status, plus 'total' and
+        'done', and 'removed': jobs deleted with their documents since the batch was queued.
+        """
+        counts = dict.fromkeys(('queued', 'processing', 'processed', 'error'), 0)
+        for row in self.jobs.values('status').annotate(count=models.Count('pk')):
+            counts[row['status']] = row['count']
+        counts['total'] = sum(counts.values())
+        counts['done'] = counts['processed'] + counts['error']
+        counts['removed'] = max(self.total - counts['total'], 0)
+        return counts
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = "Processing batches"
+
+
+class ProcessingJob(models.Model):
+    """
+    A queued AI task for a Document, run by the `manage.py process_documents` worker.
+    Jobs use the same processing/processed/error states as Document.status,
+    plus 'queued' while they wait for a worker.
+    """
+    TASK_CHOICES = (
+        ('summarize', 'Summarize'),
+        ('segment', 'Segment'),
+        ('convert', 'Convert to PDF'),
+        ('index', 'Index for search'),
+        ('merge', 'Merge PDFs'),
+        ('split', 'Split PDF'),
+    )
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('error', 'Error'),
+    )
+    # Lower runs first: background work (e.g. extraction on upload) waits for jobs a user is waiting on
+    PRIORITY_CHOICES = (
+        (0, 'Interactive'),
+        (10, 'Background'),
+    )
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='jobs')
+    task = models.CharField(max_length=20, choices=TASK_CHOICES)
+    options = models.JSONField(default=dict, blank=True) # Keyword arguments for the task, e.g. bypass_cache
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    batch = models.ForeignKey(ProcessingBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now) # Pushed back between retries
+    last_error = models.TextField(blank=True, null=True)
+
+    # Lease held by the worker running the job; renewed by its heartbeat.
+    # A 'processing' job whose lease has expired belonged to a crashed worker and is picked up again.
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.get_task_display()} {self.document} ({self.status})"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'run_after']),
+        ]
+
+
+class UploadSession(models.Model):
+    """
+    A chunked, resumable upload in progress (see apps/documents/uploads.py).
+    Chunks are appended to a staging file in order; `received_bytes` is where
+    the next chunk must start, so a client can resume after a disconnect.
+    Completing the session streams the staged file to storage and creates the Document.
+    """
+    STATUS_CHOICES = (
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+        ('aborted', 'Aborted'),
+    )
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    matter = models.ForeignKey('workflows.Matter', on_delete=models.SET_NULL, null=True, blank=True)
+    filename = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, blank=True)
+    file_type = models.CharField(max_length=100, blank=True)
+    total_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField() # Chosen by the client, capped by DOCUMENT_UPLOAD_MAX_CHUNK_SIZE
+    received_bytes = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received_bytes}/{self.total_size})"
@@ -0,0 +1,161 @@
+# apps/documents/packing.py
+# Picks the document text that is sent to the AI helpers.
+# Text longer than the prompt budget is split into paragraph chunks, each chunk
+# is scored with cheap local signals (headings, defined terms, dates, amounts,
+# legal keywords) and the densest chunks are packed into the budget, kept in
+# document order. Closing clauses and signature blocks at the end of a long
+# contract are no longer cut off. Packing is deterministic, so identical
+# documents still produce identical prompts (and AI cache hits).
+
+from dataclasses import dataclass
+import re
+
+# Rough size of a Gemini token in characters of English/legal text
+CHARS_PER_TOKEN = 4
+
+# Chunks are built from whole paragraphs up to about this many characters
+CHUNK_CHARS = 800
+
+# Placed between chunks that aren't adjacent in the document
+GAP_MARKER = '\n[...]\n'
+
+MONTHS = r'(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)'
+
+HEADING_RE = re.compile(
+    r'^\s*(?:(?:article|section|clause|schedule|part|annex|appendix)\s+[\dIVXLC]+\b'
+    r'|\d+(?:\.\d+)*[.)]?\s+[A-Z]'
+    r'|(?-i:[A-Z][A-Z0-9 ,&\'-]{3,70})$)',
+    re.IGNORECASE | re.MULTILINE,
+)
+DEFINED_TERM_RE = re.compile(
+    r'["“][A-Z][^"”\n]{1,60}["”]\s*(?:means|shall mean|refers to|has the meaning)'
+    r'|\((?:the\s+|each\s+a\s+)?["“][A-Z][^"”\n]{1,60}["”]\)'
+)
+DATE_RE = re.compile(
+    r'\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b|\b\d{4}-\d{2}-\d{2}\b'
+    rf'|\b\d{{1,2}}(?:st|nd|rd|th)?\s+(?:day\s+of\s+)?{MONTHS},?\s+\d{{4}}\b'
+    rf'|\b{MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b',
+    re.IGNORECASE,
+)
+AMOUNT_RE = re.compile(
+    r'(?:[$€£¥]|\b(?:USD|EUR|GBP|KES|KSH|ZAR|NGN|UGX|TZS)\b)\s?\d[\d,]*(?:\.\d+)?'
+    r'|\b\d[\d,]*(?:\.\d+)?\s?(?:%|percent\b|dollars\b|euros\b|pounds\b|shillings\b)',
+    re.IGNORECASE,
+)
+KEYWORD_RE = re.compile(
+    r'\b(?:shall|must|terminat\w*|indemni\w*|liabilit\w*|governing law|jurisdiction|warrant\w*|'
+    r'payment|penalt\w*|confidential\w*|breach|dispute|arbitration|effective date|'
+    r'signed|witness\w*|notari\w*|executed|in witness whereof|whereas|now therefore)\b',
+    re.IGNORECASE,
+)
+
+# Points per match, and the most matches of a kind counted per chunk
+SIGNAL_WEIGHTS = (
+    (HEADING_RE, 3.0, 3),
+    (DEFINED_TERM_RE, 3.0, 4),
+    (DATE_RE, 2.0, 4),
+    (AMOUNT_RE, 2.0, 4),
+    (KEYWORD_RE, 0.5, 10),
+)
+
+# Extra points for the closing chunk (signatures, execution date)
+LAST_CHUNK_BONUS = 3.0
+
+
+@dataclass
+class Chunk:
+    """A run of whole paragraphs: its position in the document, text and score."""
+    index: int
+    text: str
+    score: float = 0.0
+
+
+def split_long_paragraph(paragraph, limit):
+    """Yields pieces of at most `limit` chars, cut at sentence (or, failing that, word) ends."""
+    while len(paragraph) > limit:
+        cut = max(paragraph.rfind('. ', 0, limit), paragraph.rfind('\n', 0, limit))
+        if cut < limit // 2:
+            cut = paragraph.rfind(' ', 0, limit)
+        if cut < limit // 2:
+            cut = limit - 1
+        yield paragraph[:cut + 1]
+        paragraph = paragraph[cut + 1:]
+    if paragraph:
+        yield paragraph
+
+
+def split_chunks(text, chunk_chars=CHUNK_CHARS):
+    """
+    Splits text into Chunks of whole paragraphs of up to about chunk_chars.
+    A heading always starts a new chunk so it stays with the clause it introduces.
+    Repeated paragraphs (page headers and footers, disclaimers) are kept only once.
+    """
+    chunks = []
+    current = []
+    size = 0
+    seen = set()
+    for paragraph in re.split(r'\n\s*\n|\x0c', text):
+        paragraph = paragraph.strip()
+        fingerprint = re.sub(r'\W+|\d+', '', paragraph.lower())
+        if not fingerprint or (fingerprint in seen and not HEADING_RE.match(paragraph)):
+            continue
+        seen.add(fingerprint)
+        for piece in split_long_paragraph(paragraph, chunk_chars * 2):
+            starts_section = HEADING_RE.match(piece) is not None
+            if current and (size + len(piece) > chunk_chars or starts_section):
+                chunks.append(Chunk(len(chunks), '\n\n'.join(current)))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 2
+    if current:
+        chunks.append(Chunk(len(chunks), '\n\n'.join(current)))
+    return chunks
+
+
+def score_chunk(text):
+    """Information score of a chunk, per 1000 characters so long chunks aren't favoured for their size."""
+    points = 0.0
+    for pattern, weight, cap in SIGNAL_WEIGHTS:
+        matches = 0
+        for _ in pattern.finditer(text):
+            matches += 1
+            if matches == cap:
+                break
+        points += weight * matches
+    return points * 1000 / max(len(text), 200)
+
+
+def pack_text(text, budget_chars):
+    """
+    Returns at most budget_chars of `text`: all of it when it fits, otherwise
+    the opening chunk plus the highest-scoring chunks that fit, in document
+    order with GAP_MARKER where text was left out.
+    """
+    if not text or len(text) <= budget_chars:
+        return text
+
+    chunks = split_chunks(text)
+    if not chunks:
+        return text[:budget_chars]
+    for chunk in chunks:
+        chunk.score = score_chunk(chunk.text)
+    chunks[-1].score += LAST_CHUNK_BONUS
+
+    # The opening chunk names the document and the parties; the rest go best first
+    candidates = chunks[:1] + sorted(chunks[1:], key=lambda c: (-c.score, c.index))
+    selected = []
+    used = 0
+    for chunk in candidates:
+        cost = len(chunk.text) + len(GAP_MARKER)
+        if used + cost <= budget_chars:
+            selected.append(chunk)
+            used += cost
+    if not selected:
+        return text[:budget_chars]
+
+    selected.sort(key=lambda c: c.index)
+    parts = [selected[0].text]
+    for previous, chunk in zip(selected, selected[1:]):
+        parts.append('\n\n' if chunk.index == previous.index + 1 else GAP_MARKER)
+        parts.append(chunk.text)
+    return ''.join(parts)
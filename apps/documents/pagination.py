@@ -0,0 +1,85 @@
+# apps/documents/pagination.py
+# Keyset (cursor) pagination for document lists.
+# Pages are fetched with "rows after this (upload_date, id)" instead of
+# OFFSET, so page 1000 costs the same as page 1: the database walks the
+# (…, upload_date, id) index from the cursor and stops after one page.
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+import base64
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class KeysetPage:
+    """One page of documents plus the cursors of the pages around it (None at either end)."""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_other_pages(self):
+        return bool(self.next_cursor or self.previous_cursor)
+
+
+def encode_cursor(document):
+    """Opaque cursor for a document's position in (-upload_date, -id) order."""
+    raw = f"{document.upload_date.isoformat()}|{document.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (upload_date, id) for a cursor, or None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, pk = raw.rsplit('|', 1)
+        upload_date = parse_datetime(timestamp)
+        return (upload_date, int(pk)) if upload_date else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def paginate_documents(documents, after=None, before=None, per_page=DEFAULT_PAGE_SIZE):
+    """
+    Returns the KeysetPage of a Document queryset, newest first, following
+    the `after` cursor (next page) or the `before` cursor (previous page).
+    An invalid cursor gives the first page.
+    """
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+
+    if before:
+        upload_date, pk = before
+        # Walk backwards from the cursor, then put the rows back in display order
+        rows = list(documents.filter(upload_date__gte=upload_date).filter(
+            Q(upload_date__gt=upload_date) | Q(pk__gt=pk)
+        ).order_by('upload_date', 'pk')[:per_page + 1])
+        has_previous = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_next = True
+    else:
+        if after:
+            upload_date, pk = after
+            # (upload_date, id) < cursor. The plain upload_date bound lets the
+            # database seek into the index instead of filtering row by row.
+            documents = documents.filter(upload_date__lte=upload_date).filter(
+                Q(upload_date__lt=upload_date) | Q(pk__lt=pk)
+            )
+        rows = list(documents.order_by('-upload_date', '-pk')[:per_page + 1])
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_previous = bool(after)
+
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if has_next and items else None,
+        previous_cursor=encode_cursor(items[0]) if has_previous and items else None,
+    )
@@ -0,0 +1,309 @@
+# apps/documents/pdf_tools.py
+# Streaming merge, split and annotation of PDF files.
+# Pages are copied one at a time: each page's objects (content streams, fonts,
+# images) are read lazily from the input, written to the output straight away
+# and dropped from the reader's cache, so memory stays flat however many pages
+# go through. Streams are copied still encoded; nothing is decompressed.
+# Like extraction.py, this module doesn't import Django.
+
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, FloatObject, IndirectObject, NameObject,
+    NullObject, NumberObject, StreamObject, TextStringObject,
+)
+import os
+
+# Size of a text annotation when no rect is given, in points
+DEFAULT_NOTE_SIZE = (200, 50)
+
+
+class PdfToolError(Exception):
+    """An input PDF can't be read (damaged, encrypted, ...) or a request is invalid."""
+    pass
+
+
+def open_pdf(path):
+    """Opens a PDF for lazy, page-by-page reading. Encrypted PDFs are only accepted without a password."""
+    # Given a path, PdfReader reads the whole file into memory; given an open
+    # file it seeks and reads only the objects it needs
+    stream = open(path, 'rb')
+    try:
+        reader = PdfReader(stream)
+        if reader.is_encrypted and not reader.decrypt(''):
+            raise PdfToolError(f"{os.path.basename(path)} is password protected.")
+        len(reader.pages) # Parses the page tree so damaged files fail here
+    except Exception as e:
+        stream.close()
+        if isinstance(e, PdfToolError):
+            raise
+        raise PdfToolError(f"Could not read {os.path.basename(path)}: {e}")
+    return reader
+
+
+class StreamingPdfWriter:
+    """
+    Writes a PDF incrementally: every object goes to the output file as soon as
+    it is copied and only its byte offset is kept for the xref table.
+    Use add_pages() for each input, then close().
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.offsets = [None] # Byte offset of each object number; 0 is unused
+        self.page_numbers = []
+        self.output.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        self.pages_root = self._allocate()
+
+    def _allocate(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write_object(self, number, obj):
+        self.offsets[number] = self.output.tell()
+        self.output.write(f'{number} 0 obj\n'.encode())
+        obj.write_to_stream(self.output)
+        self.output.write(b'\nendobj\n')
+
+    def _copy(self, value, mapping, pending, page_refs):
+        # Returns `value` ready for the output; references to objects not yet copied
+        # get a new object number and are queued in `pending`
+        if isinstance(value, IndirectObject):
+            key = (value.idnum, value.generation)
+            if key not in mapping:
+                if key in page_refs:
+                    return NullObject() # A page that isn't part of this output (split)
+                mapping[key] = self._allocate()
+                pending.append(value)
+            return IndirectObject(mapping[key], 0, None)
+        if isinstance(value, StreamObject):
+            copied = StreamObject()
+            copied._data = value._data # Still encoded
+            for key, item in value.items():
+                if key != '/Length':
+                    copied[NameObject(key)] = self._copy(item, mapping, pending, page_refs)
+            return copied
+        if isinstance(value, DictionaryObject):
+            copied = DictionaryObject()
+            for key, item in value.items():
+                copied[NameObject(key)] = self._copy(item, mapping, pending, page_refs)
+            return copied
+        if isinstance(value, ArrayObject):
+            return ArrayObject(self._copy(item, mapping, pending, page_refs) for item in value)
+        return value
+
+    def _flush(self, reader, mapping, pending, page_refs):
+        # Writes queued objects (and whatever they reference) until none are left
+        while pending:
+            ref = pending.pop()
+            number = mapping[(ref.idnum, ref.generation)]
+            obj = reader.get_object(ref)
+            if obj is None:
+                obj = NullObject()
+            self._write_object(number, self._copy(obj, mapping, pending, page_refs))
+
+    def add_pages(self, reader, page_indexes=None, annotations=None):
+        """
+        Copies pages of an open PdfReader (all of them, or the 0-based
+        `page_indexes`) to the output. `annotations` maps a page index to a list
+        of annotation dictionaries to add to that page.
+        Objects shared between pages, such as fonts, are written once per input.
+        """
+        pages = reader.pages
+        if page_indexes is None:
+            page_indexes = range(len(pages))
+        page_refs = {(p.indirect_reference.idnum, p.indirect_reference.generation) for p in pages}
+
+        # Number the pages first so links and annotations pointing at other
+        # copied pages resolve to them
+        mapping = {}
+        for index in page_indexes:
+            ref = pages[index].indirect_reference
+            mapping[(ref.idnum, ref.generation)] = self._allocate()
+
+        for index in page_indexes:
+            page = pages[index]
+            ref = page.indirect_reference
+            number = mapping[(ref.idnum, ref.generation)]
+            notes = (annotations or {}).get(index, [])
+            pending = []
+            copied = DictionaryObject()
+            # reader.pages already carries attributes inherited from the page tree
+            # (Resources, MediaBox, Rotate, ...), so the page stands alone under
+            # the new Pages root
+            for key, value in page.items():
+                if key == '/Parent':
+                    continue
+                if key == '/Annots' and notes:
+                    value = ArrayObject(page[key]) # Resolved so the page gets its own array to extend
+                copied[NameObject(key)] = self._copy(value, mapping, pending, page_refs)
+            copied[NameObject('/Parent')] = IndirectObject(self.pages_root, 0, None)
+
+            if notes:
+                annots = copied.get('/Annots') or ArrayObject()
+                for note in notes:
+                    note[NameObject('/P')] = IndirectObject(number, 0, None)
+                    note_number = self._allocate()
+                    self._write_object(note_number, note)
+                    annots.append(IndirectObject(note_number, 0, None))
+                copied[NameObject('/Annots')] = annots
+
+            self._write_object(number, copied)
+            self._flush(reader, mapping, pending, page_refs)
+            self.page_numbers.append(number)
+            # Forget the parsed objects of this page; already copied objects are
+            # found through `mapping` and never parsed again. resolved_objects is
+            # pypdf's (private) object cache; without it pages are still copied
+            # correctly, only without the memory ceiling
+            if hasattr(reader, 'resolved_objects'):
+                reader.resolved_objects.clear()
+
+    def add_object(self, obj):
+        """Writes a new object (e.g. a font shared by generated pages) and returns a reference to it."""
+        number = self._allocate()
+        self._write_object(number, obj)
+        return IndirectObject(number, 0, None)
+
+    def add_page(self, content, resources, media_box):
+        """
+        Writes a generated page: `content` is the page's content stream (bytes),
+        `resources` its resource dictionary (or a reference to one) and
+        `media_box` the (x1, y1, x2, y2) page size in points.
+        """
+        stream = StreamObject()
+        stream._data = content
+        page = DictionaryObject({
+            NameObject('/Type'): NameObject('/Page'),
+            NameObject('/Parent'): IndirectObject(self.pages_root, 0, None),
+            NameObject('/MediaBox'): ArrayObject(FloatObject(v) for v in media_box),
+            NameObject('/Resources'): resources,
+            NameObject('/Contents'): self.add_object(stream),
+        })
+        number = self._allocate()
+        self._write_object(number, page)
+        self.page_numbers.append(number)
+
+    def close(self):
+        """Writes the page tree, catalog, xref table and trailer. Returns the page count."""
+        self.offsets[self.pages_root] = self.output.tell()
+        self.output.write(f'{self.pages_root} 0 obj\n<< /Type /Pages /Count {len(self.page_numbers)} /Kids ['.encode())
+        for number in self.page_numbers:
+            self.output.write(f' {number} 0 R'.encode())
+        self.output.write(b' ] >>\nendobj\n')
+
+        catalog = self._allocate()
+        self.offsets[catalog] = self.output.tell()
+        self.output.write(f'{catalog} 0 obj\n<< /Type /Catalog /Pages {self.pages_root} 0 R >>\nendobj\n'.encode())
+
+        xref = self.output.tell()
+        self.output.write(f'xref\n0 {len(self.offsets)}\n0000000000 65535 f \n'.encode())
+        for offset in self.offsets[1:]:
+            if offset is None:
+                self.output.write(b'0000000000 65535 f \n') # Allocated but never written
+            else:
+                self.output.write(f'{offset:010d} 00000 n \n'.encode())
+        self.output.write(f'trailer\n<< /Size {len(self.offsets)} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+        return len(self.page_numbers)
+
+
+def merge_pdfs(pdf_paths, output_path):
+    """
+    Writes the pages of every PDF in `pdf_paths`, in order, to `output_path`.
+    Returns the number of pages written.
+    """
+    if not pdf_paths:
+        raise PdfToolError("No PDF files to merge.")
+    try:
+        with open(output_path, 'wb') as output:
+            writer = StreamingPdfWriter(output)
+            for path in pdf_paths:
+                reader = open_pdf(path)
+                try:
+                    writer.add_pages(reader)
+                finally:
+                    reader.stream.close()
+            return writer.close()
+    except Exception:
+        os.remove(output_path) # Don't leave a truncated PDF behind
+        raise
+
+
+def split_pdf(pdf_path, output_dir, pages_per_file=1):
+    """
+    Splits a PDF into files of `pages_per_file` pages each, named
+    <name>_p<first>-<last>.pdf in `output_dir`. Returns the written paths in order.
+    """
+    if pages_per_file < 1:
+        raise PdfToolError("pages_per_file must be at least 1.")
+    reader = open_pdf(pdf_path)
+    try:
+        total = len(reader.pages)
+        base = os.path.splitext(os.path.basename(pdf_path))[0]
+        os.makedirs(output_dir, exist_ok=True)
+
+        paths = []
+        for first in range(0, total, pages_per_file):
+            last = min(first + pages_per_file, total)
+            path = os.path.join(output_dir, f"{base}_p{first + 1}-{last}.pdf")
+            with open(path, 'wb') as output:
+                writer = StreamingPdfWriter(output)
+                writer.add_pages(reader, range(first, last))
+                writer.close()
+            paths.append(path)
+        return paths
+    finally:
+        reader.stream.close()
+
+
+def make_note_annotation(page, text, rect=None):
+    """
+    Builds a FreeText annotation (a visible note) for `page` of a PdfReader.
+    Without a rect the note is placed in the page's top-left corner.
+    """
+    if rect is None:
+        box = page.mediabox
+        width, height = DEFAULT_NOTE_SIZE
+        rect = (float(box.left) + 20, float(box.top) - 20 - height, float(box.left) + 20 + width, float(box.top) - 20)
+    return DictionaryObject({
+        NameObject('/Type'): NameObject('/Annot'),
+        NameObject('/Subtype'): NameObject('/FreeText'),
+        NameObject('/Rect'): ArrayObject(FloatObject(v) for v in rect),
+        NameObject('/Contents'): TextStringObject(text),
+        NameObject('/DA'): TextStringObject('0 0 0 rg /Helv 10 Tf'),
+        NameObject('/F'): NumberObject(4), # Print
+    })
+
+
+def annotate_pdf(pdf_path, annotations, output_path=None):
+    """
+    Adds text notes to a PDF. `annotations` is a list of dicts with 'page'
+    (1-based), 'text' and optionally 'rect' ([x1, y1, x2, y2] in points).
+    Writes to `output_path`, or replaces `pdf_path` when it's None.
+    Returns the number of annotations added.
+    """
+    reader = open_pdf(pdf_path)
+    try:
+        total = len(reader.pages)
+        by_page = {}
+        for annotation in annotations:
+            page = int(annotation.get('page', 1))
+            if not 1 <= page <= total:
+                raise PdfToolError(f"Page {page} does not exist; the document has {total} pages.")
+            note = make_note_annotation(reader.pages[page - 1], str(annotation.get('text', '')), annotation.get('rect'))
+            by_page.setdefault(page - 1, []).append(note)
+
+        target = output_path or pdf_path + '.annotating'
+        try:
+            with open(target, 'wb') as output:
+                writer = StreamingPdfWriter(output)
+                writer.add_pages(reader, annotations=by_page)
+                writer.close()
+            if output_path is None:
+                reader.stream.close() # Done reading; the input gets replaced
+                os.replace(target, pdf_path)
+        except Exception:
+            if output_path is None and os.path.exists(target):
+                os.remove(target)
+            raise
+    finally:
+        reader.stream.close()
+    return sum(len(notes) for notes in by_page.values())
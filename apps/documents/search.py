@@ -0,0 +1,214 @@
+# apps/documents/search.py
+# Full-text search over extracted document text.
+# Text is indexed per page in SearchPage rows (keyed by content hash, so
+# duplicate files are indexed once). Migration 0010 adds the database index:
+# an FTS5 table on SQLite, a tsvector column with a GIN index on PostgreSQL.
+# Queries rank with bm25 / ts_rank_cd and return highlighted snippets.
+
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+import re
+
+from .models import Document, SearchPage
+
+# Unpaged text (DOCX, TXT) is indexed in chunks of about this many characters
+CHUNK_CHARS = 4000
+
+# Rows per INSERT when indexing a long document
+INDEX_BATCH_SIZE = 500
+
+# Snippet highlight markers; replaced with <mark> after the snippet is HTML-escaped
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+FTS5_TABLE = 'documents_searchpage_fts'
+
+_search_backend = None
+
+
+def get_search_backend():
+    """
+    Returns 'fts5', 'postgres' or 'fallback' depending on which index migration 0010 created.
+    """
+    global _search_backend
+    if _search_backend is None:
+        if connection.vendor == 'sqlite' and FTS5_TABLE in connection.introspection.table_names():
+            _search_backend = 'fts5'
+        elif connection.vendor == 'postgresql':
+            _search_backend = 'postgres'
+        else:
+            _search_backend = 'fallback'
+    return _search_backend
+
+
+def split_pages(extracted):
+    """
+    Yields (page_number, text) for an ExtractedText row: its real pages when
+    a page offset index exists, otherwise CHUNK_CHARS chunks with page None.
+    """
+    text = extracted.text
+    offsets = extracted.page_offsets or []
+    if offsets:
+        bounds = offsets[1:] + [len(text)]
+        for number, (start, end) in enumerate(zip(offsets, bounds), start=1):
+            if text[start:end].strip():
+                yield number, text[start:end]
+        return
+
+    start = 0
+    while start < len(text):
+        end = min(start + CHUNK_CHARS, len(text))
+        if end < len(text):
+            # Break at whitespace so words aren't cut in two
+            space = text.rfind(' ', start + CHUNK_CHARS // 2, end)
+            if space != -1:
+                end = space + 1
+        if text[start:end].strip():
+            yield None, text[start:end]
+        start = end
+
+
+def is_indexed(content_hash, extractor_version):
+    return SearchPage.objects.filter(content_hash=content_hash, extractor_version=extractor_version).exists()
+
+
+def index_extracted_text(extracted, force=False):
+    """
+    Adds a complete ExtractedText row to the search index, replacing any pages
+    indexed for the same content before. Partial extractions are skipped.
+    Returns True if the text was (re)indexed.
+    """
+    if not extracted.is_complete:
+        return False
+    if not force and is_indexed(extracted.content_hash, extractor_version=extracted.extractor_version):
+        return False
+
+    pages = [
+        SearchPage(content_hash=extracted.content_hash, extractor_version=extracted.extractor_version, page=page, body=body)
+        for page, body in split_pages(extracted)
+    ]
+    # The pages are built before the transaction so the write lock is held only
+    # for the statements (SQLite has one writer; other workers wait for it)
+    with transaction.atomic():
+        SearchPage.objects.filter(content_hash=extracted.content_hash).delete()
+        SearchPage.objects.bulk_create(pages, batch_size=INDEX_BATCH_SIZE)
+    return True
+
+
+def remove_from_index(content_hash):
+    """Drops all indexed pages of a file content (e.g. once its last document is deleted)."""
+    with transaction.atomic(): # Takes the write lock up front on SQLite (see DATABASES in settings)
+        SearchPage.objects.filter(content_hash=content_hash).delete()
+
+
+def _fts5_query(query):
+    # Quote every term (and "quoted phrase") so user input can't use FTS5 syntax;
+    # terms are ANDed together.
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query):
+        term = (phrase or word).replace('"', '')
+        if term.strip():
+            terms.append(f'"{term}"')
+    return ' '.join(terms)
+
+
+def format_snippet(snippet):
+    """HTML-escapes a snippet and turns the highlight markers into <mark> tags."""
+    snippet = snippet.replace('\x0c', ' ').strip() # pdfminer ends each page with a form feed
+    html = escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+    return mark_safe(html)
+
+
+def _fallback_snippet(body, query, width=120):
+    # Python snippet for databases without a full-text index
+    words = [w for w in re.findall(r'\w+', query)]
+    match = re.search('|'.join(re.escape(w) for w in words), body, re.IGNORECASE) if words else None
+    start = max((match.start() if match else 0) - width // 2, 0)
+    snippet = body[start:start + width]
+    for word in words:
+        snippet = re.sub(f'({re.escape(word)})', f'{HIGHLIGHT_START}\\1{HIGHLIGHT_END}', snippet, flags=re.IGNORECASE)
+    return ('…' if start else '') + snippet + '…'
+
+
+def _visible_hashes_sql(user):
+    # Restricts hits to content the user can see; admins see everything
+    if user.is_superuser or getattr(user, 'role', None) == 'admin':
+        return '', []
+    return ' AND p.content_hash IN (SELECT content_hash FROM documents_document WHERE uploaded_by_id = %s)', [user.pk]
+
+
+def search_pages(query, user, extractor_version, limit=50):
+    """
+    Returns up to `limit` matching pages as (content_hash, page, snippet, score),
+    best match first. Snippets contain HIGHLIGHT_START/HIGHLIGHT_END markers.
+    """
+    backend = get_search_backend()
+    visible_sql, visible_params = _visible_hashes_sql(user)
+
+    if backend == 'fts5':
+        match = _fts5_query(query)
+        if not match:
+            return []
+        sql = f"""
+            SELECT p.content_hash, p.page,
+                   snippet({FTS5_TABLE}, 0, char(2), char(3), '…', 24),
+                   bm25({FTS5_TABLE}) AS score
+            FROM {FTS5_TABLE} JOIN documents_searchpage p ON p.id = {FTS5_TABLE}.rowid
+            WHERE {FTS5_TABLE} MATCH %s AND p.extractor_version = %s{visible_sql}
+            ORDER BY score LIMIT %s
+        """
+        params = [match, extractor_version] + visible_params + [limit]
+    elif backend == 'postgres':
+        # Rank first and only build headlines for the pages that are returned
+        sql = f"""
+            SELECT hits.content_hash, hits.page,
+                   ts_headline('english', hits.body, hits.q,
+                               concat('StartSel=', chr(2), ', StopSel=', chr(3), ', MaxFragments=2, MinWords=10, MaxWords=30')),
+                   hits.score
+            FROM (
+                SELECT p.content_hash, p.page, p.body, q, ts_rank_cd(p.search_vector, q) AS score
+                FROM documents_searchpage p, websearch_to_tsquery('english', %s) q
+                WHERE p.search_vector @@ q AND p.extractor_version = %s{visible_sql}
+                ORDER BY score DESC LIMIT %s
+            ) hits
+            ORDER BY hits.score DESC
+        """
+        params = [query, extractor_version] + visible_params + [limit]
+    else:
+        pages = SearchPage.objects.filter(extractor_version=extractor_version)
+        for word in re.findall(r'\w+', query):
+            pages = pages.filter(body__icontains=word)
+        if visible_params:
+            pages = pages.filter(content_hash__in=Document.objects.filter(uploaded_by_id=user.pk).values('content_hash'))
+        return [
+            (row.content_hash, row.page, _fallback_snippet(row.body, query), 0)
+            for row in pages[:limit]
+        ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_documents(query, user, extractor_version, limit=50):
+    """
+    Runs a search and groups the hits by document, best document first.
+    Returns a list of {'document': Document, 'hits': [{'page', 'snippet'}]}.
+    """
+    rows = search_pages(query, user, extractor_version, limit=limit)
+    if not rows:
+        return []
+
+    hits_by_hash = {}
+    for content_hash, page, snippet, score in rows:
+        hits_by_hash.setdefault(content_hash, []).append({'page': page, 'snippet': format_snippet(snippet)})
+
+    documents = Document.objects.filter(content_hash__in=hits_by_hash).select_related('matter')
+    if not (user.is_superuser or getattr(user, 'role', None) == 'admin'):
+        documents = documents.filter(uploaded_by=user)
+    order = {content_hash: position for position, content_hash in enumerate(hits_by_hash)}
+    return [
+        {'document': document, 'hits': hits_by_hash[document.content_hash]}
+        for document in sorted(documents, key=lambda d: order[d.content_hash])
+    ]
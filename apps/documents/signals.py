@@ -0,0 +1,22 @@
+# apps/documents/signals.py
+# Extract-on-upload: every new Document is queued for text extraction (with
+# page offsets), search indexing and near-duplicate detection at background
+# priority (see jobs.py), so summaries, segmentation and search find its text
+# ready instead of the first user waiting for the parse. The content hash is
+# already set by Document.save() (see blobs.attach_blob).
+# Documents made with bulk_create (bulk_upload.py) send no signal and are queued there.
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Document
+
+
+@receiver(post_save, sender=Document, dispatch_uid='documents_extract_on_upload')
+def queue_extraction_on_create(sender, instance, created, raw=False, **kwargs):
+    if not created or raw or not instance.file:
+        return
+    from .jobs import enqueue_search_indexing
+    # After commit, so the worker never sees a job for a row that was rolled back
+    transaction.on_commit(lambda: enqueue_search_indexing(instance))
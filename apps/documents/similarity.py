@@ -0,0 +1,200 @@
+# apps/documents/similarity.py
+# Near-duplicate detection over extracted text (e.g. a deed re-uploaded with a
+# few edits under a new name).
+# Text is cut into overlapping word shingles and summarized as a MinHash
+# signature using one-permutation hashing: every shingle is hashed once into
+# one of SIGNATURE_SIZE bins and each bin keeps its smallest hash; empty bins
+# borrow from the next filled bin. The share of equal slots between two
+# signatures estimates the Jaccard similarity of their shingle sets.
+# Signatures are split into LSH_BANDS bands and each band's hash is stored in
+# SignatureBand, so finding candidates is one index probe per band instead of a
+# comparison with every stored document.
+
+from django.db import IntegrityError
+from django.db.models import Q
+import hashlib
+import re
+import struct
+
+from .models import Document, SignatureBand, TextSignature
+
+# Words per shingle
+SHINGLE_WORDS = 5
+
+# Slots per signature; 16 bands of 8 slots make pairs above ~0.7 similarity
+# very likely (and pairs below ~0.4 very unlikely) to share a bucket
+SIGNATURE_SIZE = 128
+LSH_BANDS = 16
+ROWS_PER_BAND = SIGNATURE_SIZE // LSH_BANDS
+
+# Each bin keeps the hash bits left after choosing the bin; a borrowed value is
+# offset by this per bin of distance so it can't equal a genuine value
+BIN_RANGE = 2 ** 64 // SIGNATURE_SIZE
+
+SIGNATURE_FORMAT = f'<{SIGNATURE_SIZE}Q'
+
+# Defaults for the similarity settings (see config/settings.py)
+DEFAULT_NEAR_DUPLICATE_SIMILARITY = 0.8
+DEFAULT_SUMMARY_REUSE_SIMILARITY = 0.9
+
+
+def iter_shingles(text):
+    """Yields the overlapping SHINGLE_WORDS-word shingles of text (the whole text if it is shorter)."""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        if words:
+            yield ' '.join(words)
+        return
+    for start in range(len(words) - SHINGLE_WORDS + 1):
+        yield ' '.join(words[start:start + SHINGLE_WORDS])
+
+
+def minhash_signature(text):
+    """Returns (signature, shingle count) for text; the signature is None if the text has no words."""
+    bins = [None] * SIGNATURE_SIZE
+    count = 0
+    for shingle in iter_shingles(text):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        index, value = value % SIGNATURE_SIZE, value // SIGNATURE_SIZE
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+        count += 1
+    if not count:
+        return None, 0
+
+    signature = list(bins)
+    for index, value in enumerate(bins):
+        if value is None:
+            distance = 1
+            while bins[(index + distance) % SIGNATURE_SIZE] is None:
+                distance += 1
+            signature[index] = bins[(index + distance) % SIGNATURE_SIZE] + distance * BIN_RANGE
+    return signature, count
+
+
+def estimate_similarity(signature, other):
+    """Estimated Jaccard similarity (0..1) of the texts behind two signatures."""
+    return sum(a == b for a, b in zip(signature, other)) / SIGNATURE_SIZE
+
+
+def band_buckets(signature):
+    """The LSH bucket of each band of a signature, as signed 64-bit ints for a BigIntegerField."""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f'<{ROWS_PER_BAND}Q', *rows), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))
+    return buckets
+
+
+def unpack_signature(row):
+    return list(struct.unpack(SIGNATURE_FORMAT, bytes(row.signature)))
+
+
+def index_signature(extracted):
+    """
+    Stores the signature and LSH buckets of a complete ExtractedText row.
+    Returns its TextSignature, or None for partial or empty text.
+    """
+    if not extracted.is_complete:
+        return None
+    existing = TextSignature.objects.filter(
+        content_hash=extracted.content_hash, extractor_version=extracted.extractor_version
+    ).first()
+    if existing:
+        return existing
+
+    signature, count = minhash_signature(extracted.text)
+    if signature is None:
+        return None
+    # Single-statement writes rather than get_or_create's transaction, so
+    # concurrent workers on SQLite wait for the lock instead of failing
+    try:
+        row = TextSignature.objects.create(
+            content_hash=extracted.content_hash,
+            extractor_version=extracted.extractor_version,
+            signature=struct.pack(SIGNATURE_FORMAT, *signature),
+            shingle_count=count,
+        )
+    except IntegrityError:
+        # Another worker indexed the same content meanwhile
+        return TextSignature.objects.get(content_hash=extracted.content_hash, extractor_version=extracted.extractor_version)
+    try:
+        SignatureBand.objects.bulk_create([
+            SignatureBand(signature=row, band=band, bucket=bucket)
+            for band, bucket in enumerate(band_buckets(signature))
+        ])
+    except Exception:
+        row.delete() # Without its bands the signature can't be found; let a retry index it again
+        raise
+    return row
+
+
+def find_similar_contents(content_hash, extractor_version, threshold):
+    """
+    Returns [(content_hash, similarity)] of other indexed contents estimated
+    at least `threshold` similar to `content_hash`, most similar first.
+    """
+    row = TextSignature.objects.filter(content_hash=content_hash, extractor_version=extractor_version).first()
+    if row is None:
+        return []
+    signature = unpack_signature(row)
+
+    bands = Q()
+    for band, bucket in enumerate(band_buckets(signature)):
+        bands |= Q(band=band, bucket=bucket)
+    candidates = SignatureBand.objects.filter(bands).exclude(signature=row).values('signature_id')
+
+    matches = []
+    for candidate in TextSignature.objects.filter(pk__in=candidates, extractor_version=extractor_version).only('content_hash', 'signature'):
+        similarity = estimate_similarity(signature, unpack_signature(candidate))
+        if similarity >= threshold:
+            matches.append((candidate.content_hash, similarity))
+    matches.sort(key=lambda match: -match[1])
+    return matches
+
+
+def find_near_duplicates(document, extractor_version, threshold=DEFAULT_NEAR_DUPLICATE_SIMILARITY, user=None):
+    """
+    Returns [(Document, similarity)] of documents whose text is near-identical
+    to `document`'s, most similar first. Identical files count as 1.0.
+    Only documents `user` may see are returned (without a user: the same
+    uploader's); documents converted from or into this one are left out.
+    """
+    if not document.content_hash:
+        return []
+    scores = {document.content_hash: 1.0}
+    scores.update(find_similar_contents(document.content_hash, extractor_version, threshold))
+
+    documents = Document.objects.filter(content_hash__in=scores).exclude(pk=document.pk).exclude(derived_from=document)
+    if document.derived_from_id:
+        documents = documents.exclude(pk=document.derived_from_id)
+    if user is None:
+        documents = documents.filter(uploaded_by_id=document.uploaded_by_id)
+    elif not (user.is_superuser or getattr(user, 'role', None) == 'admin'):
+        documents = documents.filter(uploaded_by=user)
+    return sorted(
+        ((other, scores[other.content_hash]) for other in documents.select_related('uploaded_by')),
+        key=lambda match: (-match[1], -match[0].pk),
+    )
+
+
+def flag_near_duplicate(document, extractor_version, threshold=DEFAULT_NEAR_DUPLICATE_SIMILARITY):
+    """
+    Points document.near_duplicate_of at the most similar earlier document of
+    the same uploader (or clears it). Returns the flagged Document or None.
+    """
+    matches = [(other, score) for other, score in find_near_duplicates(document, extractor_version, threshold) if other.pk < document.pk]
+    other, score = matches[0] if matches else (None, None)
+    if (document.near_duplicate_of_id, document.near_duplicate_score) != (other and other.pk, score):
+        document.near_duplicate_of, document.near_duplicate_score = other, score
+        Document.objects.filter(pk=document.pk).update(near_duplicate_of=other, near_duplicate_score=score)
+    return other
+
+
+def find_reusable_summary(document, extractor_version, threshold=DEFAULT_SUMMARY_REUSE_SIMILARITY):
+    """A summarized near-duplicate (same uploader) at least `threshold` similar, or None."""
+    for other, score in find_near_duplicates(document, extractor_version, threshold):
+        if other.summary:
+            return other
+    return None
@@ -0,0 +1,64 @@
+# apps/documents/storage_backends.py
+# S3 storage for document files (DOCUMENT_STORAGE = 's3'). Works with AWS and
+# any S3-compatible service (MinIO, Ceph, ...) through AWS_S3_ENDPOINT_URL.
+# Builds on django-storages' S3Storage:
+# - large files are uploaded as multipart uploads whose parts are sent
+#   concurrently (DOCUMENT_S3_MULTIPART_* settings)
+# - read_range()/iter_range() fetch byte ranges with ranged GETs, so sniffing
+#   and HTTP Range downloads don't download whole objects (see storage_io.py)
+# - download_url() presigns a GET that makes the browser save the file under
+#   its original name, so downloads can bypass Django (DOCUMENT_DOWNLOAD_OFFLOAD = 'redirect')
+# Requires boto3.
+
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from django.utils.http import content_disposition_header
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+
+MB = 1024 * 1024
+
+
+class DocumentS3Storage(S3Storage):
+    """S3Storage with concurrent multipart uploads, ranged reads and presigned downloads."""
+
+    def get_default_settings(self):
+        defaults = super().get_default_settings()
+        if defaults['transfer_config'] is None: # AWS_S3_TRANSFER_CONFIG wins when set
+            defaults['transfer_config'] = TransferConfig(
+                multipart_threshold=getattr(settings, 'DOCUMENT_S3_MULTIPART_THRESHOLD', 16 * MB),
+                multipart_chunksize=getattr(settings, 'DOCUMENT_S3_MULTIPART_CHUNK_SIZE', 16 * MB),
+                max_concurrency=getattr(settings, 'DOCUMENT_S3_MULTIPART_CONCURRENCY', 8),
+                use_threads=True,
+            )
+        return defaults
+
+    def _object(self, name):
+        return self.bucket.Object(self._normalize_name(clean_name(name)))
+
+    def read_range(self, name, start, length):
+        """Up to `length` bytes from offset `start`, fetched with one ranged GET."""
+        if length <= 0:
+            return b''
+        body = self._object(name).get(Range=f'bytes={start}-{start + length - 1}')['Body']
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def iter_range(self, name, start, end, chunk_size):
+        """Yields bytes start..end (inclusive) from one streamed ranged GET."""
+        body = self._object(name).get(Range=f'bytes={start}-{end}')['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def download_url(self, name, filename, content_type=None, expire=None):
+        """A presigned GET URL that downloads the file as `filename`."""
+        parameters = {'ResponseContentDisposition': content_disposition_header(True, filename)}
+        if content_type:
+            parameters['ResponseContentType'] = content_type
+        if expire is None:
+            expire = getattr(settings, 'DOCUMENT_DOWNLOAD_URL_EXPIRE', 300)
+        return self.url(name, parameters=parameters, expire=expire)
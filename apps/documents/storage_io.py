@@ -0,0 +1,242 @@
+# apps/documents/storage_io.py
+# Reading stored document files without assuming they are on the local disk.
+# FileSystemStorage hands out real paths, which are used as before. Other
+# backends (S3 via django-storages, ...) have no path(): their files are read
+# as streams instead. Small files are buffered in memory and passed to the
+# extraction pool as bytes; larger ones are streamed into a temp file only
+# when a parser needs one. Type sniffing reads just the first bytes (and, for
+# ZIP-based formats, the central directory at the end) with ranged reads
+# instead of downloading the whole file.
+# A storage backend can implement read_range(name, start, length) and
+# iter_range(name, start, end, chunk_size) to serve ranges natively (e.g. an
+# HTTP Range GET, see storage_backends.py); otherwise the file is opened and seeked.
+# Files in the cold tier (see cold_storage.py) are stored gzip/zstd compressed;
+# every reader here takes the blob's `compression` and yields the original bytes.
+
+from contextlib import contextmanager
+from django.conf import settings
+import gzip
+import io
+import os
+import tempfile
+
+from .extractors import SNIFF_BYTES, detect_mime_type, prefer_hint, sniff_head_mime_type
+
+# Bytes copied per read when streaming a file out of storage
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Bytes fetched per ranged read by RangedFile (small reads are served from the last block)
+RANGE_BLOCK_SIZE = 64 * 1024
+
+# Name suffix of a compressed file, by codec
+COMPRESSED_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+class _DecompressedFile(io.RawIOBase):
+    # Read-only stream of the decompressed content of a stored file; closes the stored file too
+    def __init__(self, raw, compression):
+        self.raw = raw
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=raw, mode='rb')
+        elif compression == 'zstd':
+            import zstandard # Optional dependency, only needed for zstd-compressed files
+            self.stream = zstandard.ZstdDecompressor().stream_reader(raw, read_size=COPY_CHUNK_SIZE)
+        else:
+            raise ValueError(f"Unknown compression {compression!r}")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.stream.close()
+            finally:
+                self.raw.close()
+        super().close()
+
+
+def open_stored(storage, name, compression=''):
+    """Opens a stored file for reading, decompressing it if it is compressed."""
+    raw = storage.open(name, 'rb')
+    if not compression:
+        return raw
+    try:
+        return io.BufferedReader(_DecompressedFile(raw, compression), COPY_CHUNK_SIZE)
+    except Exception:
+        raw.close()
+        raise
+
+
+def _open_at(storage, name, start, compression):
+    # Opens a stored file positioned at `start`; compressed content can only be skipped through
+    f = open_stored(storage, name, compression)
+    if not compression:
+        f.seek(start)
+        return f
+    while start > 0:
+        skipped = len(f.read(min(COPY_CHUNK_SIZE, start)))
+        if not skipped:
+            break
+        start -= skipped
+    return f
+
+
+def content_name(name, compression=''):
+    """The name of a stored file without the suffix its compression added."""
+    suffix = COMPRESSED_SUFFIXES.get(compression, '')
+    return name[:-len(suffix)] if suffix and name.endswith(suffix) else name
+
+
+def local_path(storage, name):
+    """The local filesystem path of a stored file, or None if the storage has none."""
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def read_range(storage, name, start, length, compression=''):
+    """
+    Returns up to `length` bytes of a stored file from offset `start`.
+    For a compressed file the offset is in the decompressed content.
+    """
+    if hasattr(storage, 'read_range') and not compression:
+        return storage.read_range(name, start, length)
+    with _open_at(storage, name, start, compression) as f:
+        return f.read(length)
+
+
+def iter_range(storage, name, start, end, chunk_size=COPY_CHUNK_SIZE, compression=''):
+    """
+    Yields bytes start..end (inclusive) of a stored file in chunks.
+    A compressed file is decompressed from the start, skipping to `start`.
+    """
+    if hasattr(storage, 'iter_range') and not compression:
+        yield from storage.iter_range(name, start, end, chunk_size)
+        return
+    with _open_at(storage, name, start, compression) as f:
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class RangedFile(io.RawIOBase):
+    """
+    Seekable, read-only file over a stored file that fetches only the byte
+    ranges actually read. Lets zipfile read a remote archive's directory
+    without downloading its members.
+    """
+
+    def __init__(self, storage, name, size=None):
+        self.storage = storage
+        self.name = name
+        self.size = storage.size(name) if size is None else size
+        self.position = 0
+        self.block_start = 0
+        self.block = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise OSError("Negative seek position")
+        self.position = offset
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b''
+        offset = self.position - self.block_start
+        if not (0 <= offset and offset + size <= len(self.block)):
+            self.block_start = self.position
+            self.block = read_range(self.storage, self.name, self.position, max(size, RANGE_BLOCK_SIZE))
+            offset = 0
+        data = self.block[offset:offset + size]
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def sniff_stored_mime_type(storage, name, hint=None, compression=''):
+    """detect_mime_type() for a stored file, reading only the bytes it needs."""
+    if compression:
+        # zipfile needs random access to the content, which compression takes away
+        with local_copy(storage, name, compression) as path:
+            return detect_mime_type(path, hint)
+    path = local_path(storage, name)
+    if path is not None:
+        return detect_mime_type(path, hint)
+    size = storage.size(name)
+    head = read_range(storage, name, 0, min(SNIFF_BYTES, size))
+    zip_source = RangedFile(storage, name, size) if head.startswith(b'PK\x03\x04') else None
+    return prefer_hint(sniff_head_mime_type(head, zip_source), hint)
+
+
+@contextmanager
+def local_copy(storage, name, compression=''):
+    """
+    Yields a local path to a stored file: its real path on local storage,
+    otherwise a temp file the content is streamed into (deleted afterwards).
+    Compressed files are always decompressed into a temp file.
+    """
+    path = None if compression else local_path(storage, name)
+    if path is not None:
+        yield path
+        return
+    suffix = os.path.splitext(content_name(name, compression))[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, dir=settings.FILE_UPLOAD_TEMP_DIR) as copy:
+        if compression:
+            with open_stored(storage, name, compression) as f:
+                while chunk := f.read(COPY_CHUNK_SIZE):
+                    copy.write(chunk)
+        elif size := storage.size(name):
+            for chunk in iter_range(storage, name, 0, size - 1):
+                copy.write(chunk)
+        copy.flush()
+        yield copy.name
+
+
+@contextmanager
+def extraction_source(storage, name, compression='', size=None):
+    """
+    Yields what the extraction pool should read (see extraction.open_source()):
+    the local path, the bytes of a remote or compressed file up to
+    DOCUMENT_STORAGE_SPOOL_MAX_SIZE, or the path of a local (decompressed) copy
+    of a larger one. `size` is the content size, if known.
+    """
+    if compression or local_path(storage, name) is None:
+        if size is None and not compression: # The stored size of a compressed file says nothing
+            size = storage.size(name)
+        if size is not None and size <= getattr(settings, 'DOCUMENT_STORAGE_SPOOL_MAX_SIZE', 8 * 1024 * 1024):
+            yield read_range(storage, name, 0, size, compression)
+            return
+    with local_copy(storage, name, compression) as path:
+        yield path
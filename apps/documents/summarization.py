@@ -0,0 +1,126 @@
+# apps/documents/summarization.py
+# Map-reduce summarization for documents far bigger than one prompt.
+# The text is cut into prompt-sized parts at content-defined boundaries, every
+# part is summarized concurrently (map), and the part summaries are combined in
+# groups, level by level, until one summary is left (reduce). Each call goes
+# through the AI response cache, so after a small edit only the parts whose
+# text changed, and the groups above them, are sent to Gemini again.
+# Latency grows with the number of reduce levels, not with the page count.
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+import re
+import threading
+import zlib
+
+from apps.ai.utils import generate_content
+from .packing import split_long_paragraph
+
+MAP_PROMPT = (
+    "Summarize this part of a longer document. Keep the parties, dates, amounts, "
+    "obligations and defined terms it mentions.\n\nDocument Part:\n"
+)
+REDUCE_PROMPT = (
+    "Combine these summaries of consecutive parts of one document into a single "
+    "summary of those parts, keeping the key facts of each.\n\nPart Summaries:\n"
+)
+
+# A part ends after a paragraph whose checksum is divisible by this (once the part
+# is at least half the budget), so boundaries depend on the text, not on offsets:
+# an edit moves at most the boundaries next to it
+BOUNDARY_DIVISOR = 4
+
+_ai_slots = None
+_ai_slots_lock = threading.Lock()
+
+
+def get_ai_slots():
+    """Process-wide semaphore bounding concurrent Gemini calls (DOCUMENT_AI_CONCURRENCY)."""
+    global _ai_slots
+    with _ai_slots_lock:
+        if _ai_slots is None:
+            _ai_slots = threading.BoundedSemaphore(max(getattr(settings, 'DOCUMENT_AI_CONCURRENCY', 4), 1))
+        return _ai_slots
+
+
+def split_parts(text, budget_chars):
+    """Splits text into parts of at most budget_chars along paragraph boundaries chosen by content."""
+    parts = []
+    current = []
+    size = 0
+    for paragraph in re.split(r'\n\s*\n|\x0c', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        for piece in split_long_paragraph(paragraph, budget_chars):
+            if current and size + len(piece) > budget_chars:
+                parts.append('\n\n'.join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 2
+            if size >= budget_chars // 2 and zlib.crc32(piece.encode('utf-8')) % BOUNDARY_DIVISOR == 0:
+                parts.append('\n\n'.join(current))
+                current, size = [], 0
+    if current:
+        parts.append('\n\n'.join(current))
+    return parts
+
+
+def group_summaries(summaries, budget_chars):
+    """Groups consecutive summaries so each group fits budget_chars; a group holds at least two."""
+    groups = []
+    current = []
+    size = 0
+    for summary in summaries:
+        if len(current) >= 2 and size + len(summary) > budget_chars:
+            groups.append(current)
+            current, size = [], 0
+        current.append(summary)
+        size += len(summary) + 2
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+def _generate(prompt, content, bypass_cache):
+    # Runs in a pool thread: hold a slot for the API call and don't leave the
+    # thread's DB connection (used by the response cache) open afterwards
+    try:
+        with get_ai_slots():
+            return generate_content(prompt, content, bypass_cache=bypass_cache) or ''
+    finally:
+        connection.close()
+
+
+def summarize_long_text(text, prompt, budget_chars, bypass_cache=False):
+    """
+    Summarizes text of any length with map-reduce. `prompt` is used for the
+    final call, which sees either the whole text (if it fits budget_chars) or
+    the last level of combined summaries. Raises if any Gemini call fails.
+    """
+    parts = split_parts(text, budget_chars)
+    if len(parts) <= 1:
+        return generate_content(f"{prompt}\n\nDocument Content:\n", text[:budget_chars], bypass_cache=bypass_cache)
+
+    workers = max(getattr(settings, 'DOCUMENT_AI_CONCURRENCY', 4), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        summaries = list(executor.map(lambda part: _generate(MAP_PROMPT, part, bypass_cache), parts))
+        # Each level combines groups of summaries until they fit one final call
+        while sum(len(s) + 2 for s in summaries) > budget_chars:
+            groups = group_summaries(summaries, budget_chars)
+            if len(groups) == len(summaries):
+                break # Summaries too long to combine further; the final call truncates
+            summaries = list(executor.map(
+                lambda group: _generate(REDUCE_PROMPT, '\n\n'.join(group)[:budget_chars], bypass_cache), groups
+            ))
+
+    combined = '\n\n'.join(summaries)[:budget_chars]
+    return generate_content(
+        f"{prompt}\n\nThe document was summarized in consecutive parts; base the answer on these part summaries:\n\nPart Summaries:\n",
+        combined,
+        bypass_cache=bypass_cache,
+    )
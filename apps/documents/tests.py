@@ -1,3 +1,1636 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from pypdf import PdfReader
+
+from apps.accounts.models import CustomUser
+from apps.documents import utils
+from apps.documents.benchmarks import docx_text_with_python_docx, write_sample_contract, write_sample_pdf
+from apps.documents.blobs import acquire_blob, hash_file, release_blob
+from apps.documents.bulk_upload import BulkUploadError, import_zip
+from apps.documents.cold_storage import compress_blob, delete_replaced_files, restore_blob
+from apps.documents import blobs, extraction, jobs, search
+from apps.documents.extraction import ExtractionEngine
+from apps.documents.extractors import extract_docx
+from apps.documents.jobs import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, JobFailed, RateLimiter, claim_next_job, enqueue_document_batch,
+    enqueue_document_job, record_job_results, renew_leases,
+)
+from apps.documents.management.commands.collect_orphaned_files import iter_media_files
+from apps.documents.models import (
+    ConvertedFile, Document, DocumentBlob, ExtractedText, ProcessingJob, ReplacedFile, SearchPage,
+)
+from apps.documents.pdf_tools import PdfToolError, StreamingPdfWriter, annotate_pdf, merge_pdfs, open_pdf, split_pdf
+from apps.documents.storage_io import (
+    RangedFile, extraction_source, iter_range, local_copy, read_range, sniff_stored_mime_type,
+)
+from apps.documents.uploads import append_chunk, complete_upload, create_upload_session
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    from moto import mock_aws
+except ImportError: # boto3 and moto are only needed for the S3 tests
+    boto3 = ClientError = mock_aws = None
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+S3_SETTINGS = {
+    'STORAGES': {
+        'default': {'BACKEND': 'apps.documents.storage_backends.DocumentS3Storage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_STORAGE_BUCKET_NAME': 'documents',
+    'AWS_S3_REGION_NAME': 'us-east-1',
+    'AWS_S3_ENDPOINT_URL': None,
+    'AWS_S3_FILE_OVERWRITE': False,
+    'AWS_DEFAULT_ACL': None,
+}
+
+
+W_NAMESPACE = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+RELATIONSHIP_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+
+
+def make_docx(paragraphs, padding=0, body_xml='', parts=None):
+    """
+    A minimal DOCX. `body_xml` is appended to the body's paragraphs; `parts`
+    maps a related part's type ('header', 'footer', 'footnotes') to its XML.
+    `padding` bytes of incompressible data are stored alongside it.
+    """
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs) + body_xml
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        archive.writestr('word/document.xml', f'<w:document {W_NAMESPACE}><w:body>{body}</w:body></w:document>')
+        if parts:
+            relationships = ''.join(
+                f'<Relationship Id="rId{number}" Type="{RELATIONSHIP_TYPE}{kind}" Target="{kind}1.xml"/>'
+                for number, kind in enumerate(parts, 1)
+            )
+            archive.writestr(
+                'word/_rels/document.xml.rels',
+                f'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{relationships}</Relationships>',
+            )
+            for kind, xml in parts.items():
+                archive.writestr(f'word/{kind}1.xml', xml)
+        if padding:
+            archive.writestr('word/media/image1.bin', os.urandom(padding), zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+def create_document(user, name, content=None, filename=None, **fields):
+    """Saves a Document holding `content` (bytes, default the name) as a text file."""
+    content = name.encode() if content is None else content
+    filename = filename or f'{name}.txt'
+    document = Document(
+        uploaded_by=user, name=name, original_filename=filename, file=ContentFile(content, name=filename),
+        file_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream', file_size=len(content), **fields,
+    )
+    document.save()
+    return document
+
+
+class InlineExtractionMixin:
+    # Runs extraction jobs in the test process instead of the worker pool
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(utils, '_extraction_engine', ExtractionEngine(max_workers=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class LocalStorageTestCase(InlineExtractionMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = default_storage
+
+
+@skipUnless(mock_aws, "boto3 and moto are not installed")
+class S3TestCase(InlineExtractionMixin, TestCase):
+    """Runs against a moto-mocked bucket; self.requests records the S3 requests sent (operation, Range header)."""
+
+    def setUp(self):
+        super().setUp()
+        for name in ('boto3', 'botocore', 's3transfer', 'urllib3'):
+            logger = logging.getLogger(name)
+            self.addCleanup(logger.setLevel, logger.level)
+            logger.setLevel(logging.WARNING)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        settings_override = override_settings(**S3_SETTINGS)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='documents')
+
+        self.storage = default_storage
+        self.requests = []
+        self.record_requests(self.storage)
+
+    def record_requests(self, storage):
+        storage.connection.meta.client.meta.events.register('before-call.s3.*', self.record_request)
+
+    def record_request(self, model, params, **kwargs):
+        self.requests.append((model.name, params['headers'].get('Range')))
+
+    def operations(self, name):
+        return [request for request in self.requests if request[0] == name]
+
+
+class LocalStorageIOTests(LocalStorageTestCase):
+    def test_extraction_source_is_the_local_path(self):
+        name = self.storage.save('docs/note.txt', ContentFile(b'Clause one.'))
+        with extraction_source(self.storage, name) as source:
+            self.assertEqual(source, self.storage.path(name))
+        with local_copy(self.storage, name) as path:
+            self.assertEqual(path, self.storage.path(name))
+
+    def test_read_range_seeks_into_the_file(self):
+        name = self.storage.save('docs/data.bin', ContentFile(bytes(range(256)) * 4))
+        self.assertEqual(read_range(self.storage, name, 250, 10), bytes(range(250, 256)) + bytes(range(4)))
+        self.assertEqual(b''.join(iter_range(self.storage, name, 1020, 2000)), bytes(range(252, 256)))
+
+
+class S3StorageIOTests(S3TestCase):
+    def test_read_range_fetches_only_the_range(self):
+        data = os.urandom(300 * 1024)
+        name = self.storage.save('docs/scan.bin', ContentFile(data))
+        self.requests.clear()
+
+        self.assertEqual(read_range(self.storage, name, 1000, 10), data[1000:1010])
+        self.assertEqual(self.requests, [('GetObject', 'bytes=1000-1009')])
+
+    def test_iter_range_streams_one_ranged_get(self):
+        data = os.urandom(300 * 1024)
+        name = self.storage.save('docs/scan.bin', ContentFile(data))
+        self.requests.clear()
+
+        chunks = list(iter_range(self.storage, name, 5, 200000, chunk_size=64 * 1024))
+        self.assertEqual(b''.join(chunks), data[5:200001])
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(self.operations('GetObject'), [('GetObject', 'bytes=5-200000')])
+
+    def test_ranged_file_reads_blocks_on_demand(self):
+        data = os.urandom(1024 * 1024)
+        name = self.storage.save('docs/scan.bin', ContentFile(data))
+        self.requests.clear()
+
+        ranged = RangedFile(self.storage, name)
+        ranged.seek(-100, io.SEEK_END)
+        self.assertEqual(ranged.read(), data[-100:])
+        ranged.seek(4096)
+        self.assertEqual(ranged.read(16), data[4096:4112])
+        self.assertEqual(ranged.read(16), data[4112:4128]) # Served from the block already fetched
+        self.assertEqual(len(self.operations('GetObject')), 2)
+
+    def test_sniffing_a_docx_reads_only_its_directory(self):
+        data = make_docx(['Clause one.'], padding=2 * 1024 * 1024)
+        name = self.storage.save('docs/contract.bin', ContentFile(data))
+        self.requests.clear()
+
+        self.assertEqual(sniff_stored_mime_type(self.storage, name), DOCX_MIME_TYPE)
+        gets = self.operations('GetObject')
+        self.assertTrue(gets)
+        self.assertTrue(all(ranged for _, ranged in gets))
+        fetched = sum(int(end) - int(start) + 1 for start, end in (r[len('bytes='):].split('-') for _, r in gets))
+        self.assertLess(fetched, len(data) // 4)
+
+    @override_settings(DOCUMENT_STORAGE_SPOOL_MAX_SIZE=64 * 1024)
+    def test_small_files_are_spooled_in_memory(self):
+        data = b'Clause text.\n' * 1000
+        name = self.storage.save('docs/small.txt', ContentFile(data))
+        with extraction_source(self.storage, name) as source:
+            self.assertEqual(source, data)
+
+    @override_settings(DOCUMENT_STORAGE_SPOOL_MAX_SIZE=64 * 1024)
+    def test_large_files_are_copied_to_a_temp_file(self):
+        data = os.urandom(200 * 1024)
+        name = self.storage.save('docs/large.bin', ContentFile(data))
+        with extraction_source(self.storage, name) as source:
+            self.assertIsInstance(source, str)
+            with open(source, 'rb') as copy:
+                self.assertEqual(copy.read(), data)
+        self.assertFalse(os.path.exists(source))
+
+    @override_settings(DOCUMENT_STORAGE_SPOOL_MAX_SIZE=64 * 1024)
+    def test_extraction_reads_from_the_bucket(self):
+        small = self.storage.save('docs/note.txt', ContentFile(b'Short clause.'))
+        large = self.storage.save('docs/agreement.txt', ContentFile(b'Clause text for the agreement.\n' * 10000))
+
+        self.assertEqual(utils.extract_document_content(small).text.strip(), 'Short clause.')
+        result = utils.extract_document_content(large)
+        self.assertIsNone(result.error)
+        self.assertEqual(result.text.count('Clause text for the agreement.'), 10000)
+
+        docx = self.storage.save('docs/contract.docx', ContentFile(make_docx(['First clause.', 'Second clause.'])))
+        text = utils.extract_document_content(docx).text
+        self.assertLess(text.index('First clause.'), text.index('Second clause.'))
+
+
+class DocumentLinkTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        self.document = Document(
+            uploaded_by=self.user, name='Deed', original_filename='deed.txt',
+            file=ContentFile(b'Deed of sale.', name='deed.txt'), file_type='text/plain', file_size=13,
+        )
+        self.document.save()
+        self.client.force_login(self.user)
+
+    def test_pages_link_to_the_download_view(self):
+        download_url = reverse('documents:document_download', args=[self.document.pk])
+        for url in (reverse('documents:document_list'), reverse('documents:document_detail', args=[self.document.pk])):
+            response = self.client.get(url)
+            self.assertContains(response, f'href="{download_url}"')
+            self.assertNotContains(response, self.document.file.url)
+
+
+class DocumentUploadViewTests(LocalStorageTestCase):
+    @override_settings(DOCUMENT_LIST_PAGE_SIZE=2)
+    def test_invalid_upload_renders_the_first_page_of_the_list(self):
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        for number in range(3):
+            Document(
+                uploaded_by=user, name=f'Deed {number}', summary='x' * 1000,
+                file=ContentFile(f'Deed {number}'.encode(), name='deed.txt'), file_type='text/plain', file_size=6,
+            ).save()
+        self.client.force_login(user)
+
+        response = self.client.post(reverse('documents:document_upload'), {'name': 'No file'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        documents = list(response.context['documents'])
+        self.assertEqual([document.name for document in documents], ['Deed 2', 'Deed 1'])
+        self.assertIn('summary', documents[0].get_deferred_fields()) # Only the listed columns are loaded
+        self.assertTrue(response.context['next_page_url'].startswith(reverse('documents:document_list') + '?after='))
+
+    def test_upload_queues_indexing_below_interactive_work(self):
+        from apps.workflows.models import Matter
+
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='admin')
+        matter = Matter.objects.create(title='Sale of 12 High Street', start_date=datetime.date(2026, 1, 5))
+        self.client.force_login(user)
+        for url, filename in (
+            (reverse('documents:document_upload'), 'deed.txt'),
+            (reverse('documents:document_upload_for_matter', args=[matter.pk]), 'lease.txt'),
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(url, {'name': filename, 'file': SimpleUploadedFile(filename, filename.encode() * 10)})
+        jobs = ProcessingJob.objects.order_by('pk')
+        self.assertEqual(
+            [(job.document.original_filename, job.task, job.priority) for job in jobs],
+            [('deed.txt', 'index', PRIORITY_BACKGROUND), ('lease.txt', 'index', PRIORITY_BACKGROUND)],
+        )
+
+        # A summary asked for afterwards is worked on first
+        document = Document.objects.get(original_filename='lease.txt')
+        self.client.post(reverse('documents:document_summarize', args=[document.pk]))
+        job = claim_next_job('worker-1')
+        self.assertEqual((job.document, job.task, job.priority), (document, 'summarize', PRIORITY_INTERACTIVE))
+
+
+class PdfDocumentTests(LocalStorageTestCase):
+    def add_document(self, user, filename, data):
+        document = Document(
+            uploaded_by=user, name=filename, original_filename=filename,
+            file=ContentFile(data, name=filename), file_type='application/octet-stream', file_size=len(data),
+        )
+        document.save()
+        return document
+
+    def test_pdfs_are_recognised_by_content_not_extension(self):
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'scan.pdf')
+        write_sample_pdf(path, 3)
+        with open(path, 'rb') as f:
+            pdf = f.read()
+
+        scan = self.add_document(user, 'scan.bin', pdf)
+        parts = utils.split_document(scan, user, pages_per_file=2)
+        self.assertEqual([part.original_filename for part in parts], ['scan_p1-2.pdf', 'scan_p3-3.pdf'])
+        self.assertEqual([part.name for part in parts], ['scan.bin (pages 1-2)', 'scan.bin (page 3)'])
+        merged = utils.merge_documents([scan, parts[1]], user)
+        self.assertEqual(merged.file_size, merged.file.size)
+
+        fake = self.add_document(user, 'notes.pdf', b'Not a PDF at all.')
+        with self.assertRaisesMessage(PdfToolError, "'notes.pdf' is not a PDF file."):
+            utils.split_document(fake, user)
+        with self.assertRaisesMessage(PdfToolError, "'notes.pdf' is not a PDF file."):
+            utils.merge_documents([scan, fake], user)
+
+
+class AdminPdfJobTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = CustomUser.objects.create_superuser(username='admin', password='secret', email='admin@example.com')
+        self.notary = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        self.client.force_login(self.admin)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.pdfs = []
+        for pages in (2, 3):
+            path = os.path.join(directory, f'{pages}.pdf')
+            write_sample_pdf(path, pages, label=f'Deed {pages} page')
+            with open(path, 'rb') as f:
+                self.pdfs.append(create_document(self.notary, f'Deed {pages}', f.read(), filename=f'deed{pages}.pdf'))
+
+    def run_action(self, action, documents):
+        return self.client.post(reverse('admin:documents_document_changelist'), {
+            'action': action, '_selected_action': [document.pk for document in documents],
+        })
+
+    def run_jobs(self):
+        while job := claim_next_job('worker-1'):
+            record_job_results([jobs.execute_job(job)], 'worker-1')
+
+    def page_texts(self, document):
+        with document.file.open('rb') as f:
+            return [page.extract_text() for page in PdfReader(f).pages]
+
+    def test_merge_is_queued_and_run_by_the_worker(self):
+        lease = create_document(self.notary, 'Lease')
+        response = self.run_action('merge_selected_documents', [self.pdfs[1], self.pdfs[0]])
+        job = ProcessingJob.objects.get()
+        self.assertRedirects(response, reverse('admin:documents_processingjob_change', args=[job.pk]))
+        self.assertEqual((job.document, job.task, job.priority), (self.pdfs[0], 'merge', PRIORITY_INTERACTIVE))
+        self.assertEqual(Document.objects.count(), 3) # Nothing merged in the request
+
+        # Another selection starting with the same document is a separate merge
+        self.run_action('merge_selected_documents', [self.pdfs[0], lease])
+        self.run_action('merge_selected_documents', [self.pdfs[0], self.pdfs[1]])
+        self.assertEqual(ProcessingJob.objects.count(), 2)
+
+        self.run_jobs()
+        merged = Document.objects.get(name='Merged: Deed 2, Deed 3')
+        self.assertEqual(merged.uploaded_by, self.admin)
+        self.assertEqual(len(self.page_texts(merged)), 5)
+        self.assertIn('Deed 3 page 1', self.page_texts(merged)[2])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'processed')
+        failed = ProcessingJob.objects.exclude(pk=job.pk).get()
+        self.assertEqual((failed.status, failed.last_error), ('queued', "'Lease' is not a PDF file."))
+        self.pdfs[0].refresh_from_db()
+        self.assertEqual(self.pdfs[0].status, 'uploaded') # Merging leaves the inputs alone
+
+    def test_merge_needs_two_documents(self):
+        response = self.run_action('merge_selected_documents', [self.pdfs[0]])
+        self.assertRedirects(response, reverse('admin:documents_document_changelist'))
+        self.assertFalse(ProcessingJob.objects.exists())
+
+    def test_split_is_queued_as_a_batch(self):
+        response = self.run_action('split_selected_documents', self.pdfs)
+        batch = ProcessingJob.objects.first().batch
+        self.assertRedirects(response, reverse('admin:documents_processingbatch_progress', args=[batch.pk]))
+        self.assertEqual(batch.total, 2)
+        self.assertFalse(Document.objects.filter(derived_from__isnull=False).exists())
+
+        self.run_jobs()
+        parts = Document.objects.filter(derived_from=self.pdfs[1]).order_by('pk')
+        self.assertEqual([part.name for part in parts], ['Deed 3 (page 1)', 'Deed 3 (page 2)', 'Deed 3 (page 3)'])
+        self.assertEqual({part.uploaded_by for part in parts}, {self.admin})
+        self.assertEqual(batch.get_progress()['processed'], 2)
+
+
+class PartialExtractionTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'deed.pdf')
+        write_sample_pdf(self.path, 8)
+
+    def test_page_offsets_map_back_to_their_pages(self):
+        result = extraction.extract_pdf(self.path)
+        self.assertEqual((result.pages, result.complete), (8, True))
+        bounds = result.page_offsets[1:] + [len(result.text)]
+        for number, (start, end) in enumerate(zip(result.page_offsets, bounds), start=1):
+            self.assertEqual(result.text[start:end].strip(), f'Page {number}')
+
+    def test_max_pages_and_max_chars_stop_after_a_whole_page(self):
+        result = extraction.extract_pdf(self.path, max_pages=3)
+        self.assertEqual((result.pages, result.complete), (3, False))
+        self.assertIn('Page 3', result.text)
+        self.assertNotIn('Page 4', result.text)
+        self.assertEqual(result.text, extraction.extract_pdf(self.path).text[:len(result.text)])
+
+        page_length = result.page_offsets[1]
+        result = extraction.extract_pdf(self.path, max_chars=page_length + 1) # One character into page 2
+        self.assertEqual((result.pages, result.complete), (2, False))
+        self.assertTrue(result.text.strip().endswith('Page 2'))
+
+        text = extraction.extract_file('Sale of 12 High Street.'.encode(), 'text/plain', max_chars=7)
+        self.assertEqual((text.text, text.complete), ('Sale of', False))
+
+    def test_page_text_parses_only_the_pages_needed(self):
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        with open(self.path, 'rb') as f:
+            document = create_document(user, 'Deed', f.read(), filename='deed.pdf')
+
+        self.assertEqual(utils.get_document_page_text(document, 3).strip(), 'Page 3')
+        extracted = ExtractedText.objects.get(content_hash=document.content_hash)
+        self.assertEqual((len(extracted.page_offsets), extracted.is_complete), (3, False))
+        self.assertEqual(utils.get_document_page_text(document, 2).strip(), 'Page 2') # From the stored pages
+
+        self.assertEqual(utils.get_document_page_text(document, 8).strip(), 'Page 8')
+        self.assertIsNone(utils.get_document_page_text(document, 9))
+        self.assertIsNone(utils.get_document_page_text(document, 0))
+        extracted.refresh_from_db()
+        self.assertEqual((len(extracted.page_offsets), extracted.is_complete), (8, True))
+
+
+class ExtractedTextReuseTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        patcher = mock.patch.object(utils, 'extract_document_content', wraps=utils.extract_document_content)
+        self.extract = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_content_is_extracted_once(self):
+        first = create_document(self.user, 'Deed', b'Sale of 12 High Street.')
+        second = create_document(self.user, 'Copy', b'Sale of 12 High Street.')
+
+        self.assertEqual(utils.get_document_text(first), 'Sale of 12 High Street.')
+        self.assertEqual(utils.get_document_text(second), 'Sale of 12 High Street.')
+        self.assertEqual(utils.get_document_text(first), 'Sale of 12 High Street.')
+        self.assertEqual(self.extract.call_count, 1)
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(ExtractedText.objects.count(), 1)
+
+    def test_replacing_the_file_invalidates_the_extraction(self):
+        document = create_document(self.user, 'Deed', b'Sale of 12 High Street.')
+        old_hash = utils.get_document_hash(document)
+        self.assertEqual(utils.get_document_text(document), 'Sale of 12 High Street.')
+
+        document = Document.objects.get(pk=document.pk)
+        document.file = ContentFile(b'Sale of 14 High Street.', name='Deed.txt')
+        document.save()
+
+        self.assertEqual(utils.get_document_text(document), 'Sale of 14 High Street.')
+        self.assertEqual(self.extract.call_count, 2)
+        self.assertNotEqual(document.content_hash, old_hash)
+        # The old row stays for any other document with that content
+        self.assertEqual(ExtractedText.objects.count(), 2)
+
+    def test_new_extractor_version_extracts_again(self):
+        document = create_document(self.user, 'Deed', b'Sale of 12 High Street.')
+        utils.get_document_text(document)
+        with mock.patch.object(utils, 'EXTRACTOR_VERSION', utils.EXTRACTOR_VERSION + 1):
+            self.assertEqual(utils.get_document_text(document), 'Sale of 12 High Street.')
+        self.assertEqual(self.extract.call_count, 2)
+
+
+class ConversionCacheTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        patcher = mock.patch.object(utils, 'convert_to_pdf', wraps=utils.convert_to_pdf)
+        self.convert = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_content_shares_the_converted_blob(self):
+        first = create_document(self.user, 'Deed', b'Sale of 12 High Street.')
+        second = create_document(self.user, 'Copy', b'Sale of 12 High Street.')
+
+        converted = utils.convert_document(first)
+        self.assertIsNone(utils.convert_document(create_document(self.user, 'Will'), cached_only=True))
+        shared = utils.convert_document(second)
+
+        self.assertEqual(self.convert.call_count, 1)
+        self.assertEqual(shared.blob_id, converted.blob_id)
+        self.assertEqual((shared.derived_from, shared.original_filename), (second, 'Copy.pdf'))
+        self.assertEqual(DocumentBlob.objects.get(pk=converted.blob_id).ref_count, 2)
+        self.assertEqual(ConvertedFile.objects.count(), 1)
+        # Converting a document again returns its existing PDF
+        self.assertEqual(utils.convert_document(second), shared)
+
+    def test_blob_deleted_before_it_is_shared_converts_again(self):
+        first = create_document(self.user, 'Deed', b'Sale of 12 High Street.')
+        second = create_document(self.user, 'Copy', b'Sale of 12 High Street.')
+        converted = utils.convert_document(first)
+        old_blob_id = converted.blob_id
+
+        add_reference = blobs._add_reference
+
+        def delete_then_add_reference(sha256):
+            # The only PDF using the cached blob is deleted between lookup and share_blob()
+            if converted.pk:
+                converted.delete()
+            return add_reference(sha256)
+
+        with mock.patch.object(blobs, '_add_reference', delete_then_add_reference):
+            derivative = utils.convert_document(second)
+
+        self.assertEqual(self.convert.call_count, 2)
+        self.assertFalse(DocumentBlob.objects.filter(pk=old_blob_id).exists())
+        derivative.refresh_from_db()
+        self.assertEqual((derivative.derived_from, derivative.blob.ref_count), (second, 1))
+        with derivative.file.open('rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+        self.assertEqual(ConvertedFile.objects.get().blob, derivative.blob)
+
+
+class CollectOrphanedFilesTests(LocalStorageTestCase):
+    def save_file(self, name, hours_old):
+        name = self.storage.save(name, ContentFile(name.encode()))
+        mtime = time.time() - hours_old * 3600
+        os.utime(self.storage.path(name), (mtime, mtime))
+        return name
+
+    def test_only_old_unreferenced_files_are_deleted(self):
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        document = create_document(user, 'Deed', b'Sale of 12 High Street.')
+        unused_blob = acquire_blob(ContentFile(b'Sale of 14 High Street.'), 'lease.txt') # No Document yet
+        legacy = self.save_file('documents/2020/01/02/will.txt', hours_old=48)
+        Document.objects.filter(pk=create_document(user, 'Will').pk).update(file=legacy) # Pre-blob upload
+        orphan = self.save_file('documents/2020/01/02/deleted.txt', hours_old=48)
+        pending = self.save_file('documents/2020/01/03/uploading.txt', hours_old=1) # Row not committed yet
+        for name in (document.file.name, unused_blob.file.name):
+            os.utime(self.storage.path(name), (time.time() - 48 * 3600,) * 2)
+
+        out = io.StringIO()
+        call_command('collect_orphaned_files', '--list', stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[0], orphan)
+        self.assertTrue(self.storage.exists(orphan)) # Only reported
+
+        call_command('collect_orphaned_files', '--delete', stdout=io.StringIO())
+        self.assertFalse(self.storage.exists(orphan))
+        for name in (document.file.name, unused_blob.file.name, legacy, pending):
+            self.assertTrue(self.storage.exists(name), name)
+
+        call_command('collect_orphaned_files', '--delete', '--min-age', '0', stdout=io.StringIO())
+        self.assertFalse(self.storage.exists(pending))
+        # Everything left is referenced
+        self.assertEqual(
+            {name for name, size, mtime in iter_media_files(self.storage.location)},
+            set(Document.objects.values_list('file', flat=True)) | set(DocumentBlob.objects.values_list('file', flat=True)),
+        )
+
+
+class ColdStorageTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        self.content = b'The vendor sells 12 High Street to the purchaser. ' * 2000
+        self.document = create_document(user, 'Deed', self.content)
+        self.blob = self.document.blob
+
+    def read(self):
+        with Document.objects.get(pk=self.document.pk).file.open('rb') as f:
+            return f.read()
+
+    def expire_grace_period(self):
+        ReplacedFile.objects.update(delete_after=timezone.now() - datetime.timedelta(seconds=1))
+
+    def test_moved_file_is_kept_for_downloads_until_its_grace_period_is_over(self):
+        old_name = self.blob.file.name
+        download = self.storage.open(old_name, 'rb') # A download already streaming the file
+        self.addCleanup(download.close)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertGreater(compress_blob(self.blob, 'gzip', 0.1), 0)
+
+        self.assertEqual(self.blob.file.name, old_name + '.gz')
+        self.assertEqual(self.read(), self.content)
+        self.assertEqual(download.read(), self.content)
+        self.assertEqual(delete_replaced_files(), 0)
+        self.assertTrue(self.storage.exists(old_name))
+
+        # Still referenced for collect_orphaned_files, however old the file is
+        os.utime(self.storage.path(old_name), (time.time() - 48 * 3600,) * 2)
+        call_command('collect_orphaned_files', '--delete', stdout=io.StringIO())
+        self.assertTrue(self.storage.exists(old_name))
+
+        self.expire_grace_period()
+        call_command('compress_cold_documents', '--days', '0', stdout=io.StringIO())
+        self.assertFalse(self.storage.exists(old_name))
+        self.assertFalse(ReplacedFile.objects.exists())
+        self.assertEqual(self.read(), self.content)
+
+    def test_restored_blob_keeps_its_compressed_file_until_the_grace_period_is_over(self):
+        compress_blob(self.blob, 'gzip', 0.1)
+        self.expire_grace_period()
+        delete_replaced_files()
+        compressed_name = self.blob.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            restore_blob(self.blob)
+        self.assertTrue(self.storage.exists(compressed_name))
+        self.assertEqual(self.read(), self.content)
+
+        self.expire_grace_period()
+        self.assertEqual(delete_replaced_files(), 1)
+        self.assertFalse(self.storage.exists(compressed_name))
+        self.assertEqual(self.read(), self.content)
+
+    def test_replaced_name_stored_again_is_not_deleted(self):
+        # A storage that overwrites on save can hand the old name to the restored copy
+        ReplacedFile.objects.create(file=self.blob.file.name, delete_after=timezone.now())
+        self.assertEqual(delete_replaced_files(), 1)
+        self.assertEqual(self.read(), self.content)
+
+
+class ChunkedUploadTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging_dir, ignore_errors=True)
+        settings_override = override_settings(DOCUMENT_UPLOAD_STAGING_DIR=staging_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+
+    def upload(self, data, filename='scan.pdf'):
+        session = create_upload_session(self.user, filename, len(data), 64 * 1024)
+        for offset in range(0, len(data), session.chunk_size):
+            chunk = data[offset:offset + session.chunk_size]
+            append_chunk(session, offset, io.BytesIO(chunk), len(chunk))
+        return complete_upload(session)
+
+    def test_completion_hashes_once_and_stores_new_content_once(self):
+        data = os.urandom(200 * 1024)
+        with mock.patch('apps.documents.uploads.hash_file', wraps=hash_file) as hashed, \
+                mock.patch.object(type(self.storage._wrapped), 'save', autospec=True, side_effect=type(self.storage._wrapped).save) as saved:
+            document = self.upload(data)
+            self.assertEqual(hashed.call_count, 1)
+            self.assertEqual(saved.call_count, 1)
+
+            duplicate = self.upload(data, 'copy of scan.pdf')
+            self.assertEqual(hashed.call_count, 2)
+            self.assertEqual(saved.call_count, 1) # Already stored; nothing written
+
+        self.assertEqual(document.content_hash, hashlib.sha256(data).hexdigest())
+        self.assertEqual((document.name, document.original_filename, document.file_size), ('scan.pdf', 'scan.pdf', len(data)))
+        self.assertEqual(duplicate.blob_id, document.blob_id)
+        self.assertEqual(duplicate.blob.ref_count, 2)
+        with document.file.open() as f:
+            self.assertEqual(f.read(), data)
+
+
+class DocumentBlobTests(LocalStorageTestCase):
+    def test_content_uploaded_again_before_a_released_file_is_deleted_survives_the_deletion(self):
+        data = b'Deed of assignment'
+        blob = acquire_blob(ContentFile(data, name='deed.txt'), 'deed.txt')
+        with self.captureOnCommitCallbacks() as pending:
+            release_blob(blob.pk)
+        self.assertTrue(self.storage.exists(blob.file.name)) # Deleted on commit, still there
+
+        again = acquire_blob(ContentFile(data, name='deed.txt'), 'deed.txt')
+        for callback in pending:
+            callback()
+        self.assertFalse(self.storage.exists(blob.file.name))
+        with again.file.open() as f:
+            self.assertEqual(f.read(), data)
+
+    def test_released_file_is_kept_when_a_new_blob_took_its_name(self):
+        data = b'Deed of assignment'
+        blob = acquire_blob(ContentFile(data, name='deed.txt'), 'deed.txt')
+        with self.captureOnCommitCallbacks() as pending:
+            release_blob(blob.pk)
+        self.storage.delete(blob.file.name) # As if deleted by hand, so the name is free again
+
+        again = acquire_blob(ContentFile(data, name='deed.txt'), 'deed.txt')
+        self.assertEqual(again.file.name, blob.file.name)
+        for callback in pending:
+            callback()
+        self.assertTrue(self.storage.exists(again.file.name))
+
+
+class BulkUploadTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+
+    def make_zip(self, files):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, data in files.items():
+                zf.writestr(name, data)
+        archive.seek(0)
+        return archive
+
+    def test_archive_within_the_total_limit_is_imported(self):
+        archive = self.make_zip({'deed.txt': b'a' * 1000, 'lease.txt': b'b' * 1000})
+        with override_settings(DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES=2000):
+            result = import_zip(archive, self.user)
+        self.assertEqual(sorted(document.name for document in result.documents), ['deed', 'lease'])
+
+    def test_archive_over_the_total_limit_is_rejected_before_anything_is_stored(self):
+        archive = self.make_zip({'deed.txt': b'a' * 1000, 'lease.txt': b'b' * 1000})
+        with override_settings(DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES=1999), \
+                mock.patch('apps.documents.bulk_upload._scan_member') as scanned:
+            with self.assertRaisesMessage(BulkUploadError, 'add up to more than'):
+                import_zip(archive, self.user)
+        scanned.assert_not_called()
+        self.assertFalse(Document.objects.exists())
+
+    def test_bytes_read_count_towards_the_total_even_from_skipped_files(self):
+        archive = self.make_zip({'scan.pdf': b'a' * 3000, 'deed.txt': b'b' * 1000, 'lease.txt': b'c' * 1000})
+        with override_settings(DOCUMENT_UPLOAD_MAX_SIZE=2000, DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES=4000), \
+                mock.patch('apps.documents.bulk_upload.READ_BLOCK_SIZE', 500), \
+                mock.patch('apps.documents.bulk_upload._ReadBudget.check_declared'):
+            # As if the archive's directory understated its sizes
+            with self.assertRaisesMessage(BulkUploadError, 'add up to more than'):
+                import_zip(archive, self.user)
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(DocumentBlob.objects.exists())
+
+    def test_imported_documents_are_indexed_by_one_background_batch(self):
+        archive = self.make_zip({'deed.txt': b'Deed', 'copy.txt': b'Deed', 'lease.txt': b'Lease'})
+        with self.captureOnCommitCallbacks(execute=True):
+            import_zip(archive, self.user)
+
+        # One job per content; the copy is flagged by the job for its content
+        jobs = ProcessingJob.objects.all()
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual({(job.task, job.priority) for job in jobs}, {('index', PRIORITY_BACKGROUND)})
+        self.assertEqual(len({job.batch_id for job in jobs}), 1)
+        self.assertIsNotNone(jobs[0].batch_id)
+        self.assertEqual(Document.objects.filter(status='processing').count(), 0) # Indexing runs in the background
+
+
+class JobQueueTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        self.document = create_document(self.user, 'Deed')
+
+    def expire_lease(self, job):
+        ProcessingJob.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+    def test_interactive_jobs_are_claimed_before_older_background_jobs(self):
+        background = enqueue_document_job(self.document, 'index', priority=PRIORITY_BACKGROUND)
+        interactive = enqueue_document_job(create_document(self.user, 'Lease'), 'summarize')
+
+        self.assertIsNone(claim_next_job('worker-1', max_priority=-1))
+        self.assertEqual(claim_next_job('worker-1').pk, interactive.pk)
+        self.assertIsNone(claim_next_job('worker-1', max_priority=PRIORITY_INTERACTIVE))
+        self.assertEqual(claim_next_job('worker-1').pk, background.pk)
+        self.assertIsNone(claim_next_job('worker-1'))
+
+    def test_job_is_reclaimed_once_its_lease_expires(self):
+        enqueue_document_job(self.document, 'summarize')
+        job = claim_next_job('worker-1')
+        self.assertIsNone(claim_next_job('worker-2')) # Still leased
+
+        self.expire_lease(job)
+        reclaimed = claim_next_job('worker-2')
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual((reclaimed.locked_by, reclaimed.attempts), ('worker-2', 2))
+
+    def test_result_of_a_job_whose_lease_was_lost_is_discarded(self):
+        enqueue_document_job(self.document, 'summarize')
+        job = claim_next_job('worker-1')
+        self.expire_lease(job)
+        claim_next_job('worker-2')
+
+        self.assertEqual(renew_leases([job.pk], 'worker-1'), [job.pk])
+        job.document.summary = 'Stale summary'
+        self.assertEqual(record_job_results([(job, ['summary'], None)], 'worker-1'), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('processing', 'worker-2'))
+        self.document.refresh_from_db()
+        self.assertIsNone(self.document.summary)
+
+        # The worker holding the lease records its result
+        job.document.summary = 'Summary'
+        self.assertEqual(record_job_results([(job, ['summary'], None)], 'worker-2'), 1)
+        self.document.refresh_from_db()
+        self.assertEqual((self.document.summary, self.document.status), ('Summary', 'processed'))
+
+    @override_settings(DOCUMENT_JOB_RETRY_BACKOFF=30)
+    def test_failed_job_is_retried_with_exponential_backoff(self):
+        enqueue_document_job(self.document, 'summarize')
+        for attempt, delay in ((1, 30), (2, 60)):
+            job = claim_next_job('worker-1')
+            self.assertEqual(job.attempts, attempt)
+            before = timezone.now()
+            record_job_results([(job, None, JobFailed("No summary"))], 'worker-1')
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.last_error), ('queued', "No summary"))
+            self.assertGreaterEqual(job.run_after, before + datetime.timedelta(seconds=delay))
+            self.assertLessEqual(job.run_after, timezone.now() + datetime.timedelta(seconds=delay))
+            self.assertIsNone(claim_next_job('worker-1')) # Not due yet
+            ProcessingJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+    def test_job_is_marked_as_error_after_max_attempts(self):
+        queued = enqueue_document_job(self.document, 'summarize')
+        ProcessingJob.objects.filter(pk=queued.pk).update(max_attempts=2, attempts=1)
+        job = claim_next_job('worker-1')
+        record_job_results([(job, None, JobFailed("No summary"))], 'worker-1')
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('error', 2, "No summary"))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(claim_next_job('worker-1'))
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, 'error')
+
+
+class DocumentWorkerTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+
+    def make_worker(self, rate_limit):
+        from apps.documents.management.commands.process_documents import Command
+
+        worker = Command()
+        worker.concurrency = 10
+        worker.peak_background_slots = 10
+        worker.lease_seconds = 300
+        worker.rate_limiter = RateLimiter(rate_limit)
+        worker.worker_id = 'worker-1'
+        worker.stopping = threading.Event()
+        worker.in_flight = {}
+        worker.background = set()
+        worker.in_flight_lock = threading.Lock()
+        return worker
+
+    def fill_slots(self, worker):
+        # Claims as the worker would, without running anything
+        executor = mock.Mock(submit=lambda func, job: job)
+        claimed, rate_limited = worker._fill_slots(executor)
+        return sorted(job.task for job in worker.in_flight), rate_limited
+
+    def test_rate_limit_holds_back_only_ai_jobs(self):
+        for name, task in (('Deed', 'summarize'), ('Lease', 'segment'), ('Will', 'index'), ('Memo', 'convert')):
+            enqueue_document_job(create_document(self.user, name), task)
+        worker = self.make_worker(rate_limit=1)
+
+        self.assertEqual(self.fill_slots(worker), (['convert', 'index', 'summarize'], True))
+        self.assertEqual(ProcessingJob.objects.get(status='queued').task, 'segment')
+
+    def test_jobs_without_ai_calls_use_no_rate_limit_tokens(self):
+        for name in ('Deed', 'Lease', 'Will'):
+            enqueue_document_job(create_document(self.user, name), 'index', priority=PRIORITY_BACKGROUND)
+        worker = self.make_worker(rate_limit=1)
+
+        self.assertEqual(self.fill_slots(worker), (['index', 'index', 'index'], False))
+        self.assertTrue(worker.rate_limiter.try_acquire())
+
+    def test_batch_progress_stops_refreshing_when_documents_were_deleted(self):
+        admin = CustomUser.objects.create_superuser(username='admin', password='secret', email='admin@example.com')
+        deed, lease = create_document(self.user, 'Deed'), create_document(self.user, 'Lease')
+        batch = enqueue_document_batch(Document.objects.filter(pk__in=[deed.pk, lease.pk]), 'summarize')
+        progress_url = reverse('admin:documents_processingbatch_progress', args=[batch.pk])
+        self.client.force_login(admin)
+        self.assertContains(self.client.get(progress_url), 'http-equiv="refresh"')
+
+        lease.delete()
+        job = claim_next_job('worker-1')
+        job.document.summary = 'Summary'
+        record_job_results([(job, ['summary'], None)], 'worker-1')
+
+        progress = batch.get_progress()
+        self.assertEqual((progress['done'], progress['total'], progress['removed']), (1, 1, 1))
+        response = self.client.get(progress_url)
+        self.assertNotContains(response, 'http-equiv="refresh"')
+        self.assertContains(response, '1 of 1 document(s) finished')
+
+
+class DocumentDownloadTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        self.data = bytes(range(256)) * 40
+        self.document = create_document(self.user, 'Deed', self.data, filename='deed.bin')
+        self.url = reverse('documents:document_download', args=[self.document.pk])
+        self.client.force_login(self.user)
+
+    def download(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_parse_range_header(self):
+        from apps.documents.downloads import RangeNotSatisfiable, parse_range_header
+
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), (0, 999))
+        for ignored in (None, '', 'bytes=-', 'bytes=10-5', 'bytes=0-1,5-6', 'items=0-1'):
+            self.assertIsNone(parse_range_header(ignored, 1000))
+        for unsatisfiable in ('bytes=1000-', 'bytes=-0'):
+            with self.assertRaises(RangeNotSatisfiable):
+                parse_range_header(unsatisfiable, 1000)
+
+    def test_single_range_is_served_as_partial_content(self):
+        response, body = self.download(HTTP_RANGE='bytes=100-299')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-299/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '200')
+        self.assertEqual(body, self.data[100:300])
+
+        response, body = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(body, self.data)
+
+    def test_range_past_the_end_is_not_satisfiable(self):
+        response, body = self.download(HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+        self.assertEqual(body, b'')
+
+    def test_current_copy_is_answered_with_not_modified(self):
+        response, _ = self.download()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(etag, f'"{self.document.content_hash}"')
+
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+        self.assertEqual(self.download(HTTP_IF_MODIFIED_SINCE=last_modified)[0].status_code, 304)
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH='"stale"')[0].status_code, 200)
+
+    def test_range_with_a_stale_if_range_validator_sends_the_whole_file(self):
+        etag = self.download()[0]['ETag']
+
+        response, body = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        response, body = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual((response.status_code, len(body)), (200, len(self.data)))
+
+        response, body = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[:10])
+
+    def test_transfer_is_offloaded_to_the_web_server(self):
+        with override_settings(DOCUMENT_DOWNLOAD_OFFLOAD='nginx', DOCUMENT_DOWNLOAD_ACCEL_PREFIX='/protected-media/'):
+            response, body = self.download(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200) # nginx answers the Range itself
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.document.file.name}')
+        self.assertEqual(body, b'')
+        self.assertIn('deed.bin', response['Content-Disposition'])
+
+        with override_settings(DOCUMENT_DOWNLOAD_OFFLOAD='sendfile'):
+            response, body = self.download()
+        self.assertEqual(response['X-Sendfile'], self.document.file.path)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(body, b'')
+
+
+class SearchTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        self.colleague = CustomUser.objects.create_user(username='colleague', password='secret', role='notary')
+        self.admin = CustomUser.objects.create_user(username='admin', password='secret', role='admin')
+
+    def add_document(self, user, name, pages):
+        # A document whose extracted text (one string per page) is in the search index
+        document = create_document(user, name)
+        offsets, text = [], ''
+        for page in pages:
+            offsets.append(len(text))
+            text += page
+        search.index_extracted_text(ExtractedText.objects.create(
+            content_hash=document.content_hash, extractor_version=utils.EXTRACTOR_VERSION,
+            text=text, page_offsets=offsets,
+        ))
+        return document
+
+    def search(self, query, user=None):
+        return [
+            (result['document'].name, [hit['page'] for hit in result['hits']])
+            for result in search.search_documents(query, user or self.user, utils.EXTRACTOR_VERSION)
+        ]
+
+    def add_documents(self):
+        self.add_document(self.user, 'Lease', [
+            'The tenant shall pay rent monthly. ' * 20,
+            'Service charges are payable quarterly. ' * 40 + 'Indemnity is capped at one year of rent.',
+        ])
+        self.add_document(self.user, 'Supply agreement', [
+            'The supplier shall indemnify the customer. Indemnity covers all losses; the indemnity survives termination.',
+        ])
+        self.add_document(self.colleague, 'Guarantee', ['The guarantor gives an indemnity.'])
+
+    def test_fts5_ranks_the_best_matching_page_first(self):
+        if search.get_search_backend() != 'fts5':
+            self.skipTest("SQLite was built without FTS5")
+        self.add_documents()
+
+        self.assertEqual(self.search('indemnity'), [('Supply agreement', [1]), ('Lease', [2])])
+        self.assertEqual(self.search('indemnities'), [('Supply agreement', [1]), ('Lease', [2])]) # Porter stemming
+        self.assertEqual(self.search('"one year" rent'), [('Lease', [2])])
+        self.assertEqual(self.search('indemnity NOT'), []) # FTS5 syntax is matched as plain words
+        snippet = search.search_documents('supplier', self.user, utils.EXTRACTOR_VERSION)[0]['hits'][0]['snippet']
+        self.assertIn('<mark>supplier</mark>', snippet)
+
+    def test_fallback_scans_pages_without_a_full_text_index(self):
+        self.add_documents()
+        with mock.patch.object(search, '_search_backend', 'fallback'):
+            self.assertEqual(sorted(self.search('indemnity')), [('Lease', [2]), ('Supply agreement', [1])])
+            self.assertEqual(self.search('tenant monthly'), [('Lease', [1])])
+            self.assertEqual(self.search('arbitration'), [])
+            snippet = search.search_documents('supplier', self.user, utils.EXTRACTOR_VERSION)[0]['hits'][0]['snippet']
+        self.assertIn('<mark>supplier</mark>', snippet)
+
+    def test_results_only_hold_documents_the_user_may_see(self):
+        self.add_documents()
+        for backend in ('fts5', 'fallback'):
+            if backend == 'fts5' and search.get_search_backend() != 'fts5':
+                continue
+            with self.subTest(backend=backend), mock.patch.object(search, '_search_backend', backend):
+                self.assertEqual(self.search('guarantor'), [])
+                self.assertEqual(self.search('guarantor', self.colleague), [('Guarantee', [1])])
+                self.assertEqual(
+                    sorted(name for name, pages in self.search('indemnity', self.admin)),
+                    ['Guarantee', 'Lease', 'Supply agreement'],
+                )
+
+    def test_index_follows_page_updates_and_deletes(self):
+        if search.get_search_backend() != 'fts5':
+            self.skipTest("SQLite was built without FTS5")
+        lease = self.add_document(self.user, 'Lease', ['The tenant shall pay rent monthly.'])
+        page = SearchPage.objects.get(content_hash=lease.content_hash)
+
+        page.body = 'The tenant shall pay rent quarterly.'
+        page.save()
+        self.assertEqual(self.search('monthly'), [])
+        self.assertEqual(self.search('quarterly'), [('Lease', [1])])
+
+        search.remove_from_index(lease.content_hash)
+        self.assertEqual(self.search('quarterly'), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {search.FTS5_TABLE} WHERE {search.FTS5_TABLE} MATCH 'tenant'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+def sample_text(words, seed, edits=()):
+    """`words` pseudo-random words; `edits` are positions replaced with another word."""
+    rng = random.Random(seed)
+    vocabulary = ['party', 'deed', 'lease', 'term', 'rent', 'notice', 'clause', 'property', 'buyer', 'seller',
+                  'agree', 'shall', 'within', 'days', 'consent', 'assign', 'title', 'charge', 'survey', 'fee']
+    text = [rng.choice(vocabulary) + str(rng.randrange(50)) for _ in range(words)]
+    for position in edits:
+        text[position] = 'amended'
+    return ' '.join(text)
+
+
+class SimilarityTests(LocalStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+
+    def add_document(self, name, text, user=None):
+        document = create_document(user or self.user, name, text.encode())
+        jobs._index(document) # Extracts, indexes the signature and flags near-duplicates
+        document.refresh_from_db()
+        return document
+
+    def test_signature_estimates_the_jaccard_similarity_of_shingles(self):
+        from apps.documents.similarity import SIGNATURE_SIZE, estimate_similarity, iter_shingles, minhash_signature
+
+        self.assertEqual(minhash_signature(''), (None, 0))
+        self.assertEqual(list(iter_shingles('Sale of land')), ['sale of land'])
+        original = sample_text(600, seed=1)
+        signature, count = minhash_signature(original)
+        self.assertEqual((len(signature), count), (SIGNATURE_SIZE, 596))
+        self.assertEqual(minhash_signature(original.upper())[0], signature) # Case and punctuation don't count
+
+        for edits in (range(0, 600, 60), range(0, 600, 15), range(0, 600, 5)):
+            edited = sample_text(600, seed=1, edits=edits)
+            shingles, edited_shingles = set(iter_shingles(original)), set(iter_shingles(edited))
+            jaccard = len(shingles & edited_shingles) / len(shingles | edited_shingles)
+            with self.subTest(jaccard=jaccard):
+                self.assertAlmostEqual(estimate_similarity(signature, minhash_signature(edited)[0]), jaccard, delta=0.12)
+
+    def test_lightly_edited_document_is_flagged_as_a_near_duplicate(self):
+        from apps.documents.similarity import LSH_BANDS, find_near_duplicates
+        from apps.documents.models import SignatureBand
+
+        deed = self.add_document('Deed', sample_text(600, seed=1))
+        edited = self.add_document('Deed v2', sample_text(600, seed=1, edits=[100, 400]))
+        unrelated = self.add_document('Lease', sample_text(600, seed=2))
+
+        self.assertEqual(SignatureBand.objects.filter(signature__content_hash=deed.content_hash).count(), LSH_BANDS)
+        self.assertIsNone(deed.near_duplicate_of)
+        self.assertEqual(edited.near_duplicate_of, deed)
+        self.assertGreater(edited.near_duplicate_score, 0.9)
+        self.assertIsNone(unrelated.near_duplicate_of)
+        self.assertEqual([other for other, score in find_near_duplicates(deed, utils.EXTRACTOR_VERSION)], [edited])
+
+        # Another uploader's copy is not flagged against this one
+        colleague = CustomUser.objects.create_user(username='colleague', password='secret', role='notary')
+        self.assertIsNone(self.add_document('Deed copy', sample_text(600, seed=1, edits=[300]), colleague).near_duplicate_of)
+
+    def test_summary_of_a_near_duplicate_is_reused(self):
+        deed = self.add_document('Deed', sample_text(600, seed=1))
+        Document.objects.filter(pk=deed.pk).update(summary='Sale of the property.')
+        edited = self.add_document('Deed v2', sample_text(600, seed=1, edits=[100]))
+        unrelated = self.add_document('Lease', sample_text(600, seed=2))
+
+        with mock.patch.object(jobs, 'summarize_document', return_value='New summary.') as summarized:
+            self.assertEqual(jobs._summarize(edited), ['summary'])
+            self.assertEqual(edited.summary, 'Sale of the property.')
+            summarized.assert_not_called()
+
+            jobs._summarize(unrelated)
+            self.assertEqual(unrelated.summary, 'New summary.')
+            jobs._summarize(edited, bypass_cache=True) # Asked for a fresh summary
+            self.assertEqual(edited.summary, 'New summary.')
+            self.assertEqual(summarized.call_count, 2)
+
+
+def sample_contract(clauses):
+    """A contract of `clauses` numbered clauses between an opening and a signature block."""
+    paragraphs = ['LEASE AGREEMENT', 'This Lease is made between Acme Ltd ("Landlord") and Jane Doe ("Tenant").']
+    for number in range(1, clauses + 1):
+        paragraphs.append(f'{number}. Clause {number}')
+        paragraphs.append(f'The Tenant shall {sample_text(50, seed=number)}.')
+    paragraphs.append('IN WITNESS WHEREOF the parties have signed this Lease on 1 March 2026.')
+    return '\n\n'.join(paragraphs)
+
+
+class PromptPackingTests(TestCase):
+    def test_text_within_the_budget_is_sent_whole(self):
+        from apps.documents.packing import pack_text
+
+        text = sample_contract(2)
+        self.assertEqual(pack_text(text, len(text)), text)
+        self.assertEqual(pack_text('', 10), '')
+
+    def test_packed_prompt_stays_within_the_token_budget(self):
+        from apps.documents.packing import CHARS_PER_TOKEN, pack_text
+
+        text = sample_contract(200)
+        for tokens in (100, 500, 2000):
+            with self.subTest(tokens=tokens), override_settings(DOCUMENT_AI_PROMPT_CHARS=100000, DOCUMENT_AI_PROMPT_TOKENS=tokens):
+                budget = utils.get_prompt_budget()
+                self.assertEqual(budget, tokens * CHARS_PER_TOKEN)
+                packed = pack_text(text, budget)
+                self.assertLessEqual(len(packed), budget)
+                self.assertTrue(packed.startswith('LEASE AGREEMENT'))
+
+    def test_packed_chunks_keep_document_order(self):
+        from apps.documents.packing import GAP_MARKER, pack_text
+
+        text = sample_contract(200)
+        packed = pack_text(text, 5000)
+        chunks = [chunk for part in packed.split(GAP_MARKER) for chunk in part.split('\n\n')]
+        positions = [text.index(chunk) for chunk in chunks]
+        self.assertEqual(positions, sorted(positions))
+        self.assertTrue(packed.startswith('LEASE AGREEMENT'))
+        self.assertTrue(packed.endswith('on 1 March 2026.')) # The signature block is kept
+        self.assertIn(GAP_MARKER, packed)
+
+    def test_chunk_larger_than_the_budget_is_cut_to_the_budget(self):
+        from apps.documents.packing import pack_text
+
+        paragraph = 'The Tenant shall keep the premises in good repair and condition ' * 100 # One paragraph
+        packed = pack_text(paragraph, 500)
+        self.assertEqual(packed, paragraph[:500])
+
+        # An oversized chunk is left out when others fit
+        text = 'Short opening.\n\n' + paragraph + '\n\nIN WITNESS WHEREOF signed on 1 March 2026.'
+        packed = pack_text(text, 500)
+        self.assertLessEqual(len(packed), 500)
+        self.assertTrue(packed.startswith('Short opening.'))
+        self.assertTrue(packed.endswith('signed on 1 March 2026.'))
+
+
+@override_settings(DOCUMENT_AI_PROMPT_CHARS=2000, DOCUMENT_AI_PROMPT_TOKENS=0, DOCUMENT_AI_MAP_REDUCE_CHARS=5000)
+class MapReduceSummaryTests(TransactionTestCase):
+    # A TransactionTestCase: the map and reduce calls run in pool threads with their own DB connections
+    def setUp(self):
+        super().setUp()
+        import apps.ai.utils
+        from apps.documents import summarization
+
+        # A stub Gemini client; every summary is 150 characters naming a checksum of its prompt
+        self.prompts = []
+
+        def generate(prompt):
+            self.prompts.append(prompt)
+            return mock.Mock(text=f'Summary {zlib.crc32(prompt.encode()):010d} '.ljust(150, '.'))
+
+        client = mock.Mock(GenerativeModel=mock.Mock(return_value=mock.Mock(generate_content=generate)))
+        for patcher in (
+            mock.patch.object(apps.ai.utils, 'genai', client),
+            mock.patch.object(utils, 'genai', client),
+            mock.patch.object(summarization, '_ai_slots', threading.BoundedSemaphore(1)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.paragraphs = [f'Clause {number}: {sample_text(40, seed=number)}.' for number in range(100)]
+
+    def summarize(self, paragraphs):
+        self.prompts.clear()
+        with override_settings(DOCUMENT_AI_CONCURRENCY=1):
+            summary = utils.summarize_document_content('\n\n'.join(paragraphs))
+        self.assertTrue(summary.startswith('Summary '))
+        return list(self.prompts)
+
+    def calls(self, prompts, prompt):
+        return [text for text in prompts if text.startswith(prompt)]
+
+    def test_short_document_is_summarized_in_one_call(self):
+        prompts = self.summarize(self.paragraphs[:10])
+        self.assertEqual(len(prompts), 1)
+        self.assertIn('Document Content:', prompts[0])
+        self.assertIn(self.paragraphs[9], prompts[0])
+
+    def test_long_document_is_summarized_part_by_part_and_combined(self):
+        from apps.documents.summarization import MAP_PROMPT, REDUCE_PROMPT, split_parts
+
+        text = '\n\n'.join(self.paragraphs)
+        parts = split_parts(text, 2000)
+        self.assertTrue(all(len(part) <= 2000 for part in parts))
+        self.assertEqual('\n\n'.join(parts), text)
+
+        prompts = self.summarize(self.paragraphs)
+        self.assertEqual(sorted(self.calls(prompts, MAP_PROMPT)), sorted(MAP_PROMPT + part for part in parts))
+        # 150-character summaries of all parts don't fit one call, so they are combined in groups first
+        reduces = self.calls(prompts, REDUCE_PROMPT)
+        self.assertGreater(len(reduces), 1)
+        self.assertLess(len(reduces), len(parts))
+        self.assertTrue(all(len(call) - len(REDUCE_PROMPT) <= 2000 for call in reduces))
+        self.assertIn('Part Summaries:', prompts[-1])
+        self.assertEqual(len(prompts), len(parts) + len(reduces) + 1)
+
+    def test_summaries_are_grouped_to_fit_the_budget(self):
+        from apps.documents.summarization import group_summaries
+
+        summaries = ['x' * 150] * 25
+        groups = group_summaries(summaries, 1000)
+        self.assertEqual(sum(groups, []), summaries)
+        self.assertTrue(all(len(group) >= 2 for group in groups))
+        self.assertTrue(all(sum(len(s) + 2 for s in group[:-1]) <= 1000 for group in groups))
+        self.assertEqual([len(group) for group in group_summaries(['x' * 900] * 3, 1000)], [3]) # No group of one
+
+    def test_only_changed_parts_are_summarized_again(self):
+        from apps.documents.summarization import MAP_PROMPT
+
+        first = self.summarize(self.paragraphs)
+        self.assertEqual(self.summarize(self.paragraphs), []) # All answered from the AI response cache
+
+        edited = list(self.paragraphs)
+        edited[50] = edited[50].replace('Clause 50:', 'Clause 50 (amended):')
+        again = self.summarize(edited)
+        self.assertLessEqual(len(self.calls(again, MAP_PROMPT)), 2)
+        self.assertLess(len(again), len(first) // 2)
+
+
+class DocumentExportTests(LocalStorageTestCase):
+    def add_document(self, user, matter, name):
+        document = Document(
+            uploaded_by=user, matter=matter, name=name, original_filename=f'{name}.txt',
+            file=ContentFile(name.encode(), name=f'{name}.txt'), file_type='text/plain', file_size=len(name),
+        )
+        document.save()
+        return document
+
+    def test_matter_export_holds_only_downloadable_documents(self):
+        from apps.workflows.models import Matter
+
+        notary = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        colleague = CustomUser.objects.create_user(username='colleague', password='secret', role='notary')
+        admin = CustomUser.objects.create_user(username='admin', password='secret', role='admin')
+        matter = Matter.objects.create(title='Sale of 12 High Street', start_date=datetime.date(2026, 1, 5))
+        matter.assigned_users.add(notary, colleague)
+        own = self.add_document(notary, matter, 'Deed')
+        other = self.add_document(colleague, matter, 'Mortgage')
+        export_url = reverse('documents:matter_documents_export', args=[matter.pk])
+
+        def exported_names(user):
+            self.client.force_login(user)
+            response = self.client.get(export_url)
+            self.assertEqual(response.status_code, 200)
+            with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+                return sorted(archive.namelist())
+
+        self.assertEqual(exported_names(notary), ['Deed.txt'])
+        self.assertEqual(exported_names(admin), ['Deed.txt', 'Mortgage.txt'])
+
+        # The same rule as the download view
+        self.client.force_login(notary)
+        self.assertEqual(self.client.get(reverse('documents:document_download', args=[own.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('documents:document_download', args=[other.pk])).status_code, 302)
+
+
+class S3StorageModeTests(S3TestCase):
+    def test_export_lists_a_missing_object_instead_of_breaking_the_archive(self):
+        from apps.documents.exports import MISSING_FILES_NAME, iter_zip_export
+
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        deed = create_document(user, 'Deed')
+        lease = create_document(user, 'Lease')
+        will = create_document(user, 'Will')
+        self.storage.delete(lease.file.name)
+
+        def deny_will(params, **kwargs):
+            if params['Key'].endswith(will.file.name):
+                raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'GetObject')
+
+        self.storage.connection.meta.client.meta.events.register('provide-client-params.s3.GetObject', deny_will)
+        with zipfile.ZipFile(io.BytesIO(b''.join(iter_zip_export([lease, deed, will])))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['Deed.txt', MISSING_FILES_NAME])
+            self.assertEqual(archive.read('Deed.txt'), b'Deed')
+            self.assertEqual(archive.read(MISSING_FILES_NAME).decode().splitlines()[1:], ['Lease.txt', 'Will.txt'])
+
+    def test_large_files_upload_as_concurrent_multipart_parts(self):
+        from apps.documents.storage_backends import DocumentS3Storage
+
+        with self.settings(
+            DOCUMENT_S3_MULTIPART_THRESHOLD=5 * 1024 * 1024,
+            DOCUMENT_S3_MULTIPART_CHUNK_SIZE=5 * 1024 * 1024, # S3's minimum part size
+            DOCUMENT_S3_MULTIPART_CONCURRENCY=3,
+        ):
+            storage = DocumentS3Storage()
+        self.assertEqual(storage.transfer_config.max_concurrency, 3)
+        self.assertTrue(storage.transfer_config.use_threads)
+
+        # Hold each part a moment and count how many are in flight at once
+        lock = threading.Lock()
+        in_flight = [0, 0] # current, highest
+
+        def part_started(model, **kwargs):
+            if model.name == 'UploadPart':
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                time.sleep(0.2)
+
+        def part_finished(model, **kwargs):
+            if model.name == 'UploadPart':
+                with lock:
+                    in_flight[0] -= 1
+
+        self.record_requests(storage)
+        events = storage.connection.meta.client.meta.events
+        events.register('before-call.s3.*', part_started)
+        events.register('after-call.s3.*', part_finished)
+
+        data = os.urandom(12 * 1024 * 1024)
+        name = storage.save('docs/scan.pdf', ContentFile(data))
+        self.assertEqual(len(self.operations('CreateMultipartUpload')), 1)
+        self.assertEqual(len(self.operations('UploadPart')), 3)
+        self.assertEqual(len(self.operations('CompleteMultipartUpload')), 1)
+        self.assertGreater(in_flight[1], 1)
+        self.assertEqual(read_range(storage, name, 0, len(data)), data)
+
+        self.requests.clear()
+        storage.save('docs/note.txt', ContentFile(b'Small file.'))
+        self.assertEqual(len(self.operations('PutObject')), 1)
+        self.assertEqual(self.operations('CreateMultipartUpload'), [])
+
+    def upload(self, data, filename):
+        user = CustomUser.objects.create_user(username='notary', password='secret', role='notary')
+        document = Document(
+            uploaded_by=user, name=filename, original_filename=filename,
+            file=ContentFile(data, name=filename), file_type='application/pdf', file_size=len(data),
+        )
+        document.save()
+        self.client.force_login(user)
+        return document
+
+    @override_settings(DOCUMENT_DOWNLOAD_OFFLOAD='redirect', DOCUMENT_DOWNLOAD_URL_EXPIRE=120)
+    def test_download_redirects_to_a_presigned_url(self):
+        import requests
+
+        data = b'%PDF-1.4 signed deed'
+        document = self.upload(data, 'Deed of Sale.pdf')
+        self.requests.clear()
+
+        response = self.client.get(reverse('documents:document_download', args=[document.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+        self.assertEqual(self.operations('GetObject'), []) # No bytes went through Django
+
+        url = urlsplit(response['Location'])
+        query = parse_qs(url.query)
+        self.assertEqual(url.path, '/' + document.file.name)
+        self.assertIn('Signature', query)
+        self.assertAlmostEqual(int(query['Expires'][0]), time.time() + 120, delta=10)
+        self.assertEqual(query['response-content-disposition'], ['attachment; filename="Deed of Sale.pdf"'])
+        self.assertEqual(query['response-content-type'], ['application/pdf'])
+
+        presigned = requests.get(response['Location'])
+        self.assertEqual(presigned.status_code, 200)
+        self.assertEqual(presigned.content, data)
+        self.assertEqual(presigned.headers['Content-Disposition'], 'attachment; filename="Deed of Sale.pdf"')
+
+    def test_range_download_uses_a_ranged_get(self):
+        data = os.urandom(256 * 1024)
+        document = self.upload(data, 'scan.pdf')
+        self.requests.clear()
+
+        response = self.client.get(reverse('documents:document_download', args=[document.pk]), HTTP_RANGE='bytes=1000-1999')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1999/{len(data)}')
+        self.assertEqual(b''.join(response.streaming_content), data[1000:2000])
+        self.assertEqual(self.operations('GetObject'), [('GetObject', 'bytes=1000-1999')])
+
+
+class PdfToolsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def sample(self, filename, pages, label):
+        path = os.path.join(self.directory, filename)
+        write_sample_pdf(path, pages, image_kb=4, label=label)
+        return path
+
+    def page_texts(self, path):
+        with open(path, 'rb') as stream:
+            return [page.extract_text().strip() for page in PdfReader(stream).pages]
+
+    def test_merge_copies_every_page_in_order(self):
+        first = self.sample('first.pdf', 3, 'First')
+        second = self.sample('second.pdf', 2, 'Second')
+        output = os.path.join(self.directory, 'merged.pdf')
+
+        self.assertEqual(merge_pdfs([first, second], output), 5)
+        self.assertEqual(self.page_texts(output), ['First 1', 'First 2', 'First 3', 'Second 1', 'Second 2'])
+
+    def test_pages_are_copied_one_at_a_time(self):
+        # The reader's object cache is dropped after every page, so memory doesn't grow with the page count
+        class RecordingCache(dict):
+            sizes = []
+
+            def clear(self):
+                self.sizes.append(len(self))
+                super().clear()
+
+        reader = open_pdf(self.sample('input.pdf', 30, 'Page'))
+        self.addCleanup(reader.stream.close)
+        reader.resolved_objects = RecordingCache(reader.resolved_objects)
+        with open(os.path.join(self.directory, 'copy.pdf'), 'wb') as output:
+            writer = StreamingPdfWriter(output)
+            writer.add_pages(reader)
+            self.assertEqual(writer.close(), 30)
+
+        self.assertEqual(len(RecordingCache.sizes), 30)
+        self.assertLess(max(RecordingCache.sizes[1:]), 10) # The first page also parsed the page tree
+
+    def test_merge_writes_shared_objects_once_per_input(self):
+        path = self.sample('input.pdf', 10, 'Page')
+        output = os.path.join(self.directory, 'merged.pdf')
+        merge_pdfs([path, path], output)
+        with open(output, 'rb') as merged:
+            self.assertEqual(merged.read().count(b'/BaseFont /Helvetica'), 2)
+
+    def test_merge_removes_a_partial_output(self):
+        damaged = os.path.join(self.directory, 'damaged.pdf')
+        with open(damaged, 'wb') as f:
+            f.write(b'%PDF-1.4 not really')
+        output = os.path.join(self.directory, 'merged.pdf')
+        with self.assertRaises(Exception):
+            merge_pdfs([self.sample('input.pdf', 2, 'Page'), damaged], output)
+        self.assertFalse(os.path.exists(output))
+
+    def test_split_writes_page_ranges(self):
+        path = self.sample('deed.pdf', 5, 'Page')
+        parts = split_pdf(path, os.path.join(self.directory, 'parts'), pages_per_file=2)
+        self.assertEqual([os.path.basename(part) for part in parts], ['deed_p1-2.pdf', 'deed_p3-4.pdf', 'deed_p5-5.pdf'])
+        self.assertEqual([self.page_texts(part) for part in parts], [['Page 1', 'Page 2'], ['Page 3', 'Page 4'], ['Page 5']])
+
+    def test_input_files_are_closed(self):
+        path = self.sample('deed.pdf', 3, 'Page')
+        readers = []
+
+        def recording_open_pdf(pdf_path):
+            readers.append(open_pdf(pdf_path))
+            return readers[-1]
+
+        with mock.patch('apps.documents.pdf_tools.open_pdf', recording_open_pdf):
+            split_pdf(path, os.path.join(self.directory, 'parts'))
+            annotate_pdf(path, [{'page': 1, 'text': 'Witnessed'}], os.path.join(self.directory, 'annotated.pdf'))
+            annotate_pdf(path, [{'page': 1, 'text': 'Witnessed'}])
+            with self.assertRaises(PdfToolError):
+                annotate_pdf(path, [{'page': 9, 'text': 'No such page'}])
+        self.assertEqual(len(readers), 4)
+        self.assertTrue(all(reader.stream.closed for reader in readers))
+
+    def test_annotate_adds_notes_to_the_given_pages(self):
+        path = self.sample('deed.pdf', 3, 'Page')
+        output = os.path.join(self.directory, 'annotated.pdf')
+        added = annotate_pdf(path, [{'page': 2, 'text': 'Witnessed'}, {'page': 2, 'text': 'Stamped'}], output)
+        self.assertEqual(added, 2)
+        with open(output, 'rb') as stream:
+            pages = PdfReader(stream).pages
+            self.assertNotIn('/Annots', pages[0])
+            self.assertEqual([note.get_object()['/Contents'] for note in pages[1]['/Annots']], ['Witnessed', 'Stamped'])
+        self.assertEqual(self.page_texts(output), ['Page 1', 'Page 2', 'Page 3'])
+
+
+class ExtractionEngineTests(TestCase):
+    def test_job_waiting_for_a_busy_pool_is_not_timed_out(self):
+        engine = ExtractionEngine(max_workers=1, timeout=1)
+        self.addCleanup(engine.shutdown)
+        engine.submit(time.sleep, 0) # Start the worker before anything is timed
+        outcomes = []
+
+        def run_job():
+            try:
+                outcomes.append(engine.submit(time.sleep, 1.2))
+            except Exception as e:
+                outcomes.append(e)
+
+        # Each job fits in the 2s the parent waits; two in a row would not
+        with mock.patch.object(extraction, 'TIMEOUT_GRACE_SECONDS', 1):
+            threads = [threading.Thread(target=run_job) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(outcomes, [None, None])
+
+
+class DocxExtractionTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, data):
+        path = os.path.join(self.directory, 'contract.docx')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_text_comes_out_in_reading_order(self):
+        table = (
+            '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Item</w:t></w:r></w:p></w:tc>'
+            '<w:tc><w:p><w:r><w:t>Fee</w:t></w:r></w:p></w:tc></w:tr>'
+            '<w:tr><w:tc><w:p><w:r><w:t>Deed</w:t></w:r></w:p></w:tc>'
+            '<w:tc><w:p><w:r><w:t>120</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+            '<w:p><w:r><w:t>Signed</w:t><w:tab/><w:t>Witnessed</w:t></w:r>'
+            '<w:r><w:footnoteReference w:id="1"/></w:r></w:p>'
+        )
+        parts = {
+            'header': f'<w:hdr {W_NAMESPACE}><w:p><w:r><w:t>Confidential</w:t></w:r></w:p></w:hdr>',
+            'footnotes': (
+                f'<w:footnotes {W_NAMESPACE}>'
+                '<w:footnote w:type="separator" w:id="0"><w:p><w:r><w:t>-----</w:t></w:r></w:p></w:footnote>'
+                '<w:footnote w:id="1"><w:p><w:r><w:t>Before a notary public.</w:t></w:r></w:p></w:footnote>'
+                '</w:footnotes>'
+            ),
+            'footer': f'<w:ftr {W_NAMESPACE}><w:p><w:r><w:t>Page footer</w:t></w:r></w:p></w:ftr>',
+        }
+        path = self.write(make_docx(['Deed of Sale'], body_xml=table, parts=parts))
+
+        self.assertEqual(extract_docx(path).text.split('\n'), [
+            'Confidential',
+            'Deed of Sale',
+            'Item | Fee',
+            'Deed | 120',
+            'Signed\tWitnessed[1]',
+            '[1] Before a notary public.',
+            'Page footer',
+        ])
+
+    def test_max_chars_stops_early(self):
+        path = self.write(make_docx([f'Clause {number}.' for number in range(1000)]))
+        result = extract_docx(path, max_chars=100)
+        self.assertFalse(result.complete)
+        self.assertTrue(result.text.startswith('Clause 0.\nClause 1.'))
+        self.assertLess(len(result.text), 200)
+
+    def test_long_contract_keeps_what_python_docx_drops(self):
+        path = os.path.join(self.directory, 'contract.docx')
+        write_sample_contract(path, 20)
+        text = extract_docx(path).text
+        reference = docx_text_with_python_docx(path)
+
+        self.assertTrue(text.startswith('Master Services Agreement - Confidential\nClause 1\n'))
+        self.assertTrue(text.endswith('Initials of the parties: ______'))
+        self.assertEqual(text.count('Schedule item value | Schedule item value | Schedule item value'), 4 * 15)
+        self.assertNotIn('Schedule item value', reference)
+        self.assertEqual(text.count('The Supplier shall indemnify'), reference.count('The Supplier shall indemnify'))
@@ -0,0 +1,186 @@
+# apps/documents/uploads.py
+# Chunked, resumable uploads for large documents.
+# The client creates an UploadSession, PUTs the file in chunks at increasing
+# offsets (asking for the session's received_bytes to resume after a
+# disconnect), then completes the session. Chunks are written to a staging file
+# on local disk; completion hashes it once and stores it as a content-addressed
+# blob (see blobs.py), so re-uploading a file that is already stored writes nothing.
+# The blob is named by the hash, so hashing is a pass of its own over the local
+# staging file before the copy to storage; the two can't share one read.
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from datetime import timedelta
+import mimetypes
+import os
+
+from .blobs import acquire_blob, hash_file, release_blob
+from .models import Document, UploadSession
+
+# Bytes copied per read/write when moving chunk data around
+COPY_BLOCK_SIZE = 64 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """
+    A request the upload protocol can't accept. `status` is the HTTP status to
+    answer with; `received_bytes` tells the client where to resume, when relevant.
+    """
+    def __init__(self, message, status=400, received_bytes=None):
+        super().__init__(message)
+        self.status = status
+        self.received_bytes = received_bytes
+
+
+def get_staging_path(session):
+    staging_dir = getattr(settings, 'DOCUMENT_UPLOAD_STAGING_DIR', None) or os.path.join(settings.BASE_DIR, 'upload_staging')
+    return os.path.join(str(staging_dir), f"{session.upload_id}.part")
+
+
+def _remove_staging_file(session):
+    try:
+        os.remove(get_staging_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def create_upload_session(user, filename, total_size, chunk_size, name='', file_type='', matter=None):
+    """
+    Starts a chunked upload. `chunk_size` is the client's choice, clamped to
+    the allowed range; the session's chunk_size is the value to use.
+    """
+    max_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+    max_chunk_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_CHUNK_SIZE', 32 * 1024 * 1024)
+    filename = os.path.basename(filename or '').strip()
+    if not filename:
+        raise UploadError("A filename is required.")
+    if total_size <= 0:
+        raise UploadError("The file is empty.")
+    if total_size > max_size:
+        raise UploadError(f"File size cannot exceed {max_size // (1024 * 1024)} MB.", status=413)
+
+    prune_stale_upload_sessions()
+
+    session = UploadSession.objects.create(
+        user=user,
+        matter=matter,
+        filename=filename,
+        name=name or '',
+        file_type=file_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        total_size=total_size,
+        chunk_size=min(max(chunk_size or max_chunk_size, MIN_CHUNK_SIZE), max_chunk_size),
+    )
+    path = get_staging_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return session
+
+
+def append_chunk(session, offset, stream, length):
+    """
+    Writes `length` bytes read from `stream` (e.g. the request) at `offset`.
+    The offset must equal session.received_bytes; anything else is answered with
+    409 and the offset to resume from. Returns the new received_bytes.
+    """
+    if session.status != 'uploading':
+        raise UploadError("This upload is no longer accepting data.", status=409, received_bytes=session.received_bytes)
+    if offset != session.received_bytes:
+        raise UploadError("Chunk offset does not match the data received so far.", status=409, received_bytes=session.received_bytes)
+    if length <= 0 or length > session.chunk_size:
+        raise UploadError(f"Chunks must be between 1 and {session.chunk_size} bytes.", received_bytes=session.received_bytes)
+    if offset + length > session.total_size:
+        raise UploadError("Chunk runs past the declared file size.", received_bytes=session.received_bytes)
+
+    # Copy the request body straight to disk; the chunk is never held in memory whole
+    written = 0
+    with open(get_staging_path(session), 'r+b') as staging:
+        staging.seek(offset)
+        while written < length:
+            block = stream.read(min(COPY_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            staging.write(block)
+            written += len(block)
+    if written != length:
+        # Client went away mid-chunk; the partial data is overwritten when it resends
+        raise UploadError("Incomplete chunk received.", received_bytes=session.received_bytes)
+
+    # Compare-and-set so two concurrent requests can't both claim the same offset
+    advanced = UploadSession.objects.filter(
+        pk=session.pk, status='uploading', received_bytes=offset
+    ).update(received_bytes=offset + length, updated_at=timezone.now())
+    if not advanced:
+        session.refresh_from_db(fields=['received_bytes', 'status'])
+        raise UploadError("Another request wrote this chunk first.", status=409, received_bytes=session.received_bytes)
+    session.received_bytes = offset + length
+    return session.received_bytes
+
+
+def complete_upload(session):
+    """
+    Stores the staged file (deduplicated by SHA-256) and creates the Document,
+    linked to the session's matter.
+    Returns the Document; completing an already completed session returns it again.
+    """
+    if session.status == 'complete' and session.document_id:
+        return session.document
+    if session.received_bytes != session.total_size:
+        raise UploadError("The upload is not finished yet.", status=409, received_bytes=session.received_bytes)
+
+    # Claim completion so a repeated request doesn't create a second Document
+    if not UploadSession.objects.filter(pk=session.pk, status='uploading').update(status='complete'):
+        raise UploadError("This upload is already being completed.", status=409, received_bytes=session.received_bytes)
+
+    path = get_staging_path(session)
+    try:
+        with open(path, 'rb') as staging:
+            content = File(staging, name=session.filename)
+            # Only content that isn't stored yet is copied to storage
+            blob = acquire_blob(content, session.filename, sha256=hash_file(content))
+        # Already on its blob, so Document.save() doesn't hash the file again
+        document = Document(
+            uploaded_by=session.user,
+            matter=session.matter,
+            name=session.name or session.filename,
+            blob=blob,
+            file=blob.file.name,
+            content_hash=blob.sha256,
+            original_filename=session.filename,
+            file_type=session.file_type,
+            file_size=session.total_size,
+        )
+        try:
+            document.save()
+        except Exception:
+            release_blob(blob.pk) # Undo the reference taken by acquire_blob()
+            raise
+    except Exception:
+        UploadSession.objects.filter(pk=session.pk).update(status='uploading')
+        raise
+
+    session.status = 'complete'
+    session.document = document
+    session.save(update_fields=['status', 'document', 'updated_at'])
+    _remove_staging_file(session)
+    return document
+
+
+def abort_upload(session):
+    """Discards an unfinished upload and its staged data."""
+    if session.status == 'uploading':
+        UploadSession.objects.filter(pk=session.pk, status='uploading').update(status='aborted')
+        session.status = 'aborted'
+        _remove_staging_file(session)
+
+
+def prune_stale_upload_sessions():
+    """
+    Aborts uploads that have received no data for DOCUMENT_UPLOAD_SESSION_TTL
+    seconds and deletes their staging files.
+    """
+    ttl = getattr(settings, 'DOCUMENT_UPLOAD_SESSION_TTL', 24 * 3600)
+    stale = UploadSession.objects.filter(status='uploading', updated_at__lt=timezone.now() - timedelta(seconds=ttl))
+    for session in stale:
+        abort_upload(session)
@@ -18,6 +18,21 @@ urlpatterns = [
     # Note: The path is relative to the app's root, so '/documents/matters/...'
     path('matters/<int:matter_pk>/upload/', views.document_upload_for_matter_view, name='document_upload_for_matter'), # <-- Corrected URL pattern
 
+    # Download all documents of a matter or client as one streamed ZIP archive
+    path('matters/<int:matter_pk>/export/', views.matter_documents_export_view, name='matter_documents_export'),
+    path('clients/<int:client_pk>/export/', views.client_documents_export_view, name='client_documents_export'),
+
+    # Upload a ZIP archive of documents at once
+    path('bulk-upload/', views.document_bulk_upload_view, name='document_bulk_upload'),
+
+    # Full-text search inside documents
+    path('search/', views.document_search_view, name='document_search'),
+
+    # Chunked, resumable uploads for large files (used by static/js/chunked_upload.js)
+    path('uploads/', views.upload_session_create_view, name='upload_session_create'),
+    path('uploads/<uuid:upload_id>/', views.upload_session_view, name='upload_session'),
+    path('uploads/<uuid:upload_id>/complete/', views.upload_session_complete_view, name='upload_session_complete'),
+
     # URL pattern for viewing a specific document's details (using its primary key)
     path('<int:pk>/', views.document_detail_view, name='document_detail'),
 
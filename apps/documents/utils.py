@@ -5,7 +5,32 @@ import google.generativeai as genai
 from django.conf import settings
 import os
 import mimetypes
+import hashlib
+from django.core.files import File
 from django.core.files.storage import default_storage
+import tempfile
+from contextlib import ExitStack
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from apps.ai.utils import generate_content
+from .models import ConvertedFile, Document, DocumentBlob, ExtractedText
+from .extraction import ExtractionEngine, ExtractionResult
+from .conversion import CONVERTER_VERSION, ConversionError, ConversionResult, can_convert, run_conversion
+from . import pdf_tools
+from .packing import CHARS_PER_TOKEN, pack_text
+from .summarization import summarize_long_text
+from .search import index_extracted_text
+from .similarity import index_signature
+from .storage_io import content_name, extraction_source, local_copy, sniff_stored_mime_type
+from .blobs import touch_blob
+
+# Bump this whenever get_document_content() changes the text it produces,
+# so previously stored ExtractedText rows are ignored and re-extracted.
+EXTRACTOR_VERSION = 3
+
+# Default for how much document text the AI helpers send to Gemini
+AI_CONTENT_MAX_CHARS = 10000
 
 # Configure Gemini AI with the API key from settings
 # Ensure settings.GEMINI_API_KEY is set in your .env and settings.py
@@ -15,64 +40,199 @@ else:
     print("WARNING: GEMINI_API_KEY not found in settings. Gemini AI features will not be available.")
     genai = None  # Set genai to None if API key is missing
 
+_extraction_engine = None
+
+def get_extraction_engine():
+    """
+    Returns the process-wide ExtractionEngine, configured from settings on first use.
+    """
+    global _extraction_engine
+    if _extraction_engine is None:
+        _extraction_engine = ExtractionEngine(
+            max_workers=getattr(settings, 'EXTRACTION_WORKERS', 2),
+            timeout=getattr(settings, 'EXTRACTION_TIMEOUT', 120),
+            max_memory_mb=getattr(settings, 'EXTRACTION_MAX_MEMORY_MB', 1024),
+            max_jobs_per_worker=getattr(settings, 'EXTRACTION_MAX_JOBS_PER_WORKER', 50),
+        )
+    return _extraction_engine
+
+def extract_document_content(document_path, max_chars=None, max_pages=None, mime_type=None, compression='', size=None):
+    """
+    Extracts the text of a stored document file in the extraction process pool.
+    The extractor is chosen by `mime_type`, or by the type sniffed from the file's content.
+    PDFs are read page by page and extraction stops once max_chars/max_pages is reached.
+    Files on remote storage are passed to the pool as bytes or a local copy (see storage_io.py);
+    compressed (cold) files, given their `compression` and content `size`, are decompressed first.
+    Returns an ExtractionResult (text, pages, page_offsets, complete, error).
+    """
+    if not default_storage.exists(document_path):
+        return ExtractionResult(error=f"Document file not found at {document_path}")
+
+    try:
+        with extraction_source(default_storage, document_path, compression, size) as source:
+            return get_extraction_engine().extract(source, mime_type, max_chars=max_chars, max_pages=max_pages)
+    except OSError as e:
+        return ExtractionResult(error=f"Could not read {document_path}: {e}")
+
+def get_document_mime_type(document):
+    """
+    Returns the MIME type of a Document's file as detected from its content
+    (magic bytes), so a PDF named .bin is still a PDF. The file name only
+    decides between plain-text types. Cached per content hash on the document's blob.
+    """
+    if not document.file:
+        return None
+    if document.blob_id and document.blob.mime_type:
+        return document.blob.mime_type
+    hint = mimetypes.guess_type(document.original_filename or document.file.name)[0]
+    if not default_storage.exists(document.file.name):
+        return hint
+    try:
+        mime_type = sniff_stored_mime_type(default_storage, document.file.name, hint, document.file.compression)
+    except OSError as e:
+        print(f"Error reading document file {document.file.name}: {e}")
+        return hint
+    if mime_type and document.blob_id:
+        DocumentBlob.objects.filter(pk=document.blob_id).update(mime_type=mime_type)
+        document.blob.mime_type = mime_type
+    return mime_type
+
 def get_document_content(document_path):
     """
     Reads the content of a document file.
-    Handles basic text files, PDFs, and DOCX.
     Returns content as a string or None if unsupported/error.
     """
-    if not default_storage.exists(document_path):
-        print(f"Error: Document file not found at {document_path}")
+    result = extract_document_content(document_path)
+    if not result.ok:
+        print(f"Error extracting text from {document_path}: {result.error}")
         return None
+    return result.text
 
-    try:
-        mime_type, _ = mimetypes.guess_type(document_path)
-        if mime_type is None:
-            print(f"Warning: Could not determine MIME type for {document_path}")
-            try:
-                with default_storage.open(document_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception:
-                print(f"Could not read {document_path} as text.")
-                return None
+def compute_file_hash(file_field):
+    """
+    Returns the SHA-256 hex digest of a stored file, reading it in chunks.
+    """
+    sha256 = hashlib.sha256()
+    with file_field.open('rb') as f:
+        for chunk in f.chunks():
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
-        if mime_type == 'application/pdf':
-            from pdfminer.high_level import extract_text
-            try:
-                return extract_text(default_storage.path(document_path))
-            except Exception as e:
-                print(f"Error extracting text from PDF {document_path}: {e}")
-                return None
-        elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            from docx import Document as DocxDocument
-            try:
-                doc = DocxDocument(default_storage.path(document_path))
-                text = []
-                for paragraph in doc.paragraphs:
-                    text.append(paragraph.text)
-                return '\n'.join(text)
-            except Exception as e:
-                print(f"Error extracting text from DOCX {document_path}: {e}")
-                return None
-        elif mime_type.startswith('text/'):
-            try:
-                with default_storage.open(document_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception as e:
-                print(f"Error reading text file {document_path}: {e}")
-                return None
-        else:
-            print(f"Warning: Unsupported file type for text extraction: {mime_type}")
-            return None
+def get_document_hash(document):
+    """
+    Returns the content hash of a document's file, computing and storing it on first use.
+    """
+    if not document.content_hash and document.file:
+        document.content_hash = compute_file_hash(document.file)
+        # Use update() so we don't trigger Document.save() side effects
+        Document.objects.filter(pk=document.pk).update(content_hash=document.content_hash)
+    return document.content_hash
 
+def get_extracted_text(document, max_chars=None, max_pages=None):
+    """
+    Returns the ExtractedText row for a Document, parsing the file only when no
+    stored extraction covers the request. With max_chars/max_pages a partial
+    extraction (prefix of the document) is enough; without them the whole file is needed.
+    Returns None if no text could be extracted.
+    """
+    if not document.file:
+        return None
+
+    try:
+        content_hash = get_document_hash(document)
     except Exception as e:
-        print(f"An unexpected error occurred while reading document {document_path}: {e}")
+        print(f"Error hashing document file {document.file.name}: {e}")
         return None
 
-def summarize_document_content(document_content, prompt="Summarize the key points of this document:"):
+    extracted = ExtractedText.objects.filter(
+        content_hash=content_hash, extractor_version=EXTRACTOR_VERSION
+    ).first()
+    if extracted and (
+        extracted.is_complete
+        or (max_chars and len(extracted.text) >= max_chars)
+        or (max_pages and len(extracted.page_offsets) >= max_pages)
+    ):
+        return extracted
+
+    result = extract_document_content(
+        document.file.name, max_chars=max_chars, max_pages=max_pages, mime_type=get_document_mime_type(document),
+        compression=document.file.compression, size=document.blob.size if document.blob_id else None,
+    )
+    if document.blob_id:
+        touch_blob(document.blob)
+    if not result.ok:
+        print(f"Error extracting text from document {document.pk}: {result.error}")
+        return None
+
+    values = {
+        'text': result.text,
+        'page_count': result.pages,
+        'page_offsets': result.page_offsets,
+        'is_complete': result.complete,
+    }
+    if extracted:
+        # Replace the shorter partial extraction with the one we just made
+        for key, value in values.items():
+            setattr(extracted, key, value)
+        extracted.save()
+    else:
+        # get_or_create in case another worker extracted the same file meanwhile
+        extracted, _ = ExtractedText.objects.get_or_create(
+            content_hash=content_hash,
+            extractor_version=EXTRACTOR_VERSION,
+            defaults=values,
+        )
+    # Keep the search and near-duplicate indexes up to date with every full extraction
+    if extracted.is_complete:
+        index_extracted_text(extracted)
+        index_signature(extracted)
+    return extracted
+
+def get_document_text(document, max_chars=None):
+    """
+    Returns the extracted text of a Document (at least max_chars of it, if given),
+    parsing the file at most once per content hash and extractor version.
+    Returns None if no text could be extracted.
+    """
+    extracted = get_extracted_text(document, max_chars=max_chars)
+    return extracted.text if extracted else None
+
+def get_document_page_text(document, page_number):
+    """
+    Returns the text of one page (1-based) of a paged document using the stored
+    page offset index. Only the pages up to page_number are parsed if the
+    document hasn't been extracted yet. Returns None if the page doesn't exist.
+    """
+    extracted = get_extracted_text(document, max_pages=page_number)
+    if not extracted or page_number < 1 or page_number > len(extracted.page_offsets):
+        return None
+    start = extracted.page_offsets[page_number - 1]
+    if page_number < len(extracted.page_offsets):
+        end = extracted.page_offsets[page_number]
+    else:
+        end = len(extracted.text)
+    return extracted.text[start:end]
+
+def get_prompt_budget():
+    """
+    Characters of document text one AI call may carry: DOCUMENT_AI_PROMPT_CHARS,
+    or DOCUMENT_AI_PROMPT_TOKENS converted to characters if that is smaller.
+    """
+    budget = getattr(settings, 'DOCUMENT_AI_PROMPT_CHARS', AI_CONTENT_MAX_CHARS) or AI_CONTENT_MAX_CHARS
+    tokens = getattr(settings, 'DOCUMENT_AI_PROMPT_TOKENS', 0)
+    if tokens:
+        budget = min(budget, tokens * CHARS_PER_TOKEN)
+    return budget
+
+def summarize_document_content(document_content, prompt="Summarize the key points of this document:", bypass_cache=False, hierarchical=None):
     """
     Summarizes document content using Gemini AI.
-    Takes document content as a string.
+    Takes document content as a string. Identical requests are answered from
+    the AI response cache unless bypass_cache is True.
+    With hierarchical=True (the default for text longer than
+    DOCUMENT_AI_MAP_REDUCE_CHARS) every part of the text is summarized and the
+    summaries are combined (see summarization.py); otherwise the most
+    informative parts are packed into one prompt.
     """
     if not genai:
         print("Gemini AI is not configured. Cannot summarize.")
@@ -81,28 +241,36 @@ def summarize_document_content(document_content, prompt="Summarize the key point
         print("No document content provided for summarization.")
         return None
 
+    if hierarchical is None:
+        threshold = getattr(settings, 'DOCUMENT_AI_MAP_REDUCE_CHARS', 0)
+        hierarchical = bool(threshold) and len(document_content) > threshold
+
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        full_prompt = f"{prompt}\n\nDocument Content:\n{document_content[:10000]}"
-        response = model.generate_content(full_prompt)
-        return response.text
+        if hierarchical:
+            return summarize_long_text(document_content, prompt, get_prompt_budget(), bypass_cache=bypass_cache)
+        return generate_content(
+            f"{prompt}\n\nDocument Content:\n",
+            pack_text(document_content, get_prompt_budget()),
+            bypass_cache=bypass_cache,
+        )
     except Exception as e:
         print(f"Error summarizing document content with Gemini AI: {e}")
         return None
 
-def summarize_document(document_path, prompt="Summarize the key points of this document:"):
+def summarize_document(document, prompt="Summarize the key points of this document:", bypass_cache=False):
     """
-    Reads document content and then summarizes it using Gemini AI.
+    Gets the (cached) text of a Document and then summarizes it using Gemini AI.
     """
-    document_content = get_document_content(document_path)
+    document_content = get_document_text(document)
     if document_content:
-        return summarize_document_content(document_content, prompt)
+        return summarize_document_content(document_content, prompt, bypass_cache=bypass_cache)
     return None
 
-def segment_document_content(document_content, sections=["Executive Summary", "Introduction", "Body", "Conclusion"]):
+def segment_document_content(document_content, sections=["Executive Summary", "Introduction", "Body", "Conclusion"], bypass_cache=False):
     """
     Attempts to segment document content based on predefined sections using Gemini AI.
-    Takes document content as a string.
+    Takes document content as a string. Identical requests are answered from
+    the AI response cache unless bypass_cache is True.
     """
     if not genai:
         print("Gemini AI is not configured. Cannot segment.")
@@ -112,39 +280,175 @@ def segment_document_content(document_content, sections=["Executive Summary", "I
         return None
 
     try:
-        prompt = f"Segment the following document content into these sections: {', '.join(sections)}. Clearly label each section. If a section is not present, indicate that.\n\nDocument Content:\n{document_content[:10000]}"
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        return response.text
+        prompt = f"Segment the following document content into these sections: {', '.join(sections)}. Clearly label each section. If a section is not present, indicate that.\n\nDocument Content:\n"
+        return generate_content(prompt, pack_text(document_content, get_prompt_budget()), bypass_cache=bypass_cache)
     except Exception as e:
         print(f"Error segmenting document content with Gemini AI: {e}")
         return None
 
-def segment_document(document_path, sections=["Executive Summary", "Introduction", "Body", "Conclusion"]):
+def segment_document(document, sections=["Executive Summary", "Introduction", "Body", "Conclusion"], bypass_cache=False):
     """
-    Reads document content and then attempts to segment it using Gemini AI.
+    Gets the (cached) text of a Document and then attempts to segment it using Gemini AI.
     """
-    document_content = get_document_content(document_path)
+    document_content = get_document_text(document)
     if document_content:
-        return segment_document_content(document_content, sections)
+        return segment_document_content(document_content, sections, bypass_cache=bypass_cache)
     return None
 
-def convert_to_pdf(document_path, output_path):
-    """Converts a document to PDF format."""
-    pass  # Implementation depends on the file type and libraries used
+def convert_to_pdf(document_path, output_path, mime_type=None):
+    """
+    Converts a local DOCX, text or image file to PDF in the extraction process pool.
+    Returns a ConversionResult (pages, error).
+    """
+    if mime_type is None:
+        mime_type, _ = mimetypes.guess_type(document_path)
+    engine = get_extraction_engine()
+    try:
+        return engine.submit(run_conversion, document_path, mime_type, output_path, engine.timeout)
+    except FutureTimeoutError:
+        return ConversionResult(error=f"Conversion timed out after {engine.timeout}s")
+    except BrokenProcessPool:
+        return ConversionResult(error="Conversion worker crashed while processing the file")
+
+def convert_document(document, cached_only=False):
+    """
+    Converts a Document to PDF and stores the result as a new Document derived
+    from it, owned by the same user. Conversions are cached by (content hash,
+    CONVERTER_VERSION): converting identical content again only creates the new
+    Document. With cached_only=True, returns None instead of converting.
+    Raises ConversionError if the file can't be converted.
+    """
+    mime_type = get_document_mime_type(document)
+    if not document.file or not can_convert(mime_type):
+        raise ConversionError(f"Cannot convert files of type {mime_type or 'unknown'} to PDF.")
+    content_hash = get_document_hash(document)
+    if not content_hash:
+        raise ConversionError("Could not read the document file.")
+
+    # This document was already converted in its current form
+    existing = document.derivatives.filter(
+        blob__conversions__content_hash=content_hash,
+        blob__conversions__converter_version=CONVERTER_VERSION,
+    ).first()
+    if existing:
+        return existing
+
+    base = os.path.splitext(document.original_filename or os.path.basename(document.file.name))[0]
+    filename = f"{base}.pdf"
+    name = f"{os.path.splitext(document.name)[0]} (PDF)"[:255]
+
+    cached = ConvertedFile.objects.filter(
+        content_hash=content_hash, converter_version=CONVERTER_VERSION
+    ).select_related('blob').first()
+    if cached:
+        from .blobs import release_blob, share_blob
+        derivative = Document(
+            uploaded_by=document.uploaded_by,
+            matter=document.matter,
+            name=name,
+            file_type='application/pdf',
+            derived_from=document,
+        )
+        if share_blob(derivative, cached.blob, filename):
+            try:
+                derivative.save()
+            except Exception:
+                release_blob(derivative.blob_id)
+                raise
+            return derivative
+    if cached_only:
+        return None
+
+    with tempfile.TemporaryDirectory(dir=settings.FILE_UPLOAD_TEMP_DIR) as tmp_dir:
+        path = os.path.join(tmp_dir, 'converted.pdf')
+        with local_copy(document.file.storage, document.file.name, document.file.compression) as source_path:
+            result = convert_to_pdf(source_path, path, mime_type)
+        if not result.ok:
+            raise ConversionError(result.error)
+        derivative = _save_pdf_document(path, filename, document.uploaded_by, document.matter, name, derived_from=document)
+    ConvertedFile.objects.get_or_create(
+        content_hash=content_hash,
+        converter_version=CONVERTER_VERSION,
+        defaults={'blob': derivative.blob, 'page_count': result.pages},
+    )
+    return derivative
 
 def apply_qes(document_path, signature_data):
     """Applies a Qualified Electronic Signature to a document."""
     pass  # Implementation requires integration with a QES provider API
 
 def merge_pdfs(pdf_paths, output_path):
-    """Merges multiple PDF files into one."""
-    pass  # Use a library like PyPDF2
+    """
+    Merges multiple PDF files into one, streaming pages from the inputs to the output.
+    Returns the number of pages written.
+    """
+    return pdf_tools.merge_pdfs(pdf_paths, output_path)
 
-def split_pdf(pdf_path, output_dir):
-    """Splits a PDF file into multiple files."""
-    pass  # Use a library like PyPDF2
+def split_pdf(pdf_path, output_dir, pages_per_file=1):
+    """Splits a PDF file into multiple files. Returns the paths written."""
+    return pdf_tools.split_pdf(pdf_path, output_dir, pages_per_file=pages_per_file)
+
+def annotate_pdf(pdf_path, annotations, output_path=None):
+    """
+    Adds text notes ({'page', 'text', 'rect'} dicts) to a PDF file.
+    Returns the number of annotations added.
+    """
+    return pdf_tools.annotate_pdf(pdf_path, annotations, output_path=output_path)
+
+def _save_pdf_document(path, filename, user, matter, name, derived_from=None):
+    # Stores a PDF written to a local temporary file as a new Document;
+    # Document.save() streams it into blob storage and queues text extraction
+    with open(path, 'rb') as f:
+        document = Document(
+            uploaded_by=user,
+            matter=matter,
+            name=name,
+            file=File(f, name=filename),
+            file_type='application/pdf',
+            derived_from=derived_from,
+        )
+        document.save()
+    return document
+
+def merge_documents(documents, user, name=None):
+    """
+    Merges the PDF files of `documents`, in the given order, into a new Document
+    owned by `user`. The new document keeps the matter when all inputs share one.
+    Raises pdf_tools.PdfToolError if an input is not a readable PDF.
+    """
+    documents = list(documents)
+    for document in documents:
+        if get_document_mime_type(document) != 'application/pdf': # Sniffed, so a PDF named .bin still counts
+            raise pdf_tools.PdfToolError(f"'{document.name}' is not a PDF file.")
+    if len(documents) < 2:
+        raise pdf_tools.PdfToolError("Select at least two PDF documents to merge.")
+
+    matters = {document.matter_id for document in documents}
+    matter = documents[0].matter if len(matters) == 1 else None
+    name = name or f"Merged: {', '.join(document.name for document in documents)}"[:255]
+    # Written to a temporary file on disk, never to memory
+    with tempfile.TemporaryDirectory(dir=settings.FILE_UPLOAD_TEMP_DIR) as tmp_dir, ExitStack() as inputs:
+        path = os.path.join(tmp_dir, 'merged.pdf')
+        merge_pdfs([inputs.enter_context(local_copy(document.file.storage, document.file.name, document.file.compression)) for document in documents], path)
+        return _save_pdf_document(path, 'merged.pdf', user, matter, name)
+
+def split_document(document, user, pages_per_file=1):
+    """
+    Splits a PDF Document into new Documents of `pages_per_file` pages each.
+    Returns the new Documents in page order.
+    """
+    if get_document_mime_type(document) != 'application/pdf':
+        raise pdf_tools.PdfToolError(f"'{document.name}' is not a PDF file.")
 
-def annotate_pdf(pdf_path, annotations):
-    """Adds annotations to a PDF file."""
-    pass  # Use a library or commercial SDK
+    base = os.path.splitext(document.original_filename or os.path.basename(content_name(document.file.name, document.file.compression)))[0]
+    parts = []
+    with tempfile.TemporaryDirectory(dir=settings.FILE_UPLOAD_TEMP_DIR) as tmp_dir, local_copy(document.file.storage, document.file.name, document.file.compression) as source_path:
+        for path in split_pdf(source_path, tmp_dir, pages_per_file=pages_per_file):
+            # split_pdf names parts <name>_p<first>-<last>.pdf
+            first, last = os.path.splitext(path)[0].rsplit('_p', 1)[1].split('-')
+            pages = f"page {first}" if first == last else f"pages {first}-{last}"
+            parts.append(_save_pdf_document(
+                path, f"{base}_p{first}-{last}.pdf", user, document.matter, f"{document.name} ({pages})"[:255],
+                derived_from=document,
+            ))
+    return parts
@@ -4,23 +4,65 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 # Import necessary modules for document download
-from django.http import HttpResponse, Http404
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST, require_http_methods
 from django.conf import settings
-import os
 import mimetypes
-from django.core.files.storage import default_storage
 from django.urls import reverse
-from django.db.models import Q # Import Q for complex lookups
+from django.utils.http import content_disposition_header
 
 from .models import Document
 # Import forms used in views
-from .forms import DocumentUploadForm, DocumentEditForm
+from .forms import BulkUploadForm, DocumentUploadForm, DocumentEditForm
+from .jobs import BACKGROUND_TASKS, enqueue_document_job
+from .downloads import serve_document_file
+from .exports import iter_zip_export
+from .bulk_upload import BulkUploadError, import_zip
+from .uploads import UploadError, abort_upload, append_chunk, complete_upload, create_upload_session
+from .models import UploadSession
+from .search import search_documents
+from .similarity import DEFAULT_NEAR_DUPLICATE_SIMILARITY, find_near_duplicates
+from .pagination import paginate_documents
 # Import utility functions
-from .utils import summarize_document, segment_document, get_document_content
+from .utils import EXTRACTOR_VERSION, convert_document, get_document_mime_type
+from .conversion import ConversionError, can_convert
 # Import custom decorators from accounts app if needed for role-based access
 # from apps.accounts.utils import notary_required, admin_required
 # Import the Matter model to link documents to matters
 from apps.workflows.models import Matter # <-- Import Matter model
+from apps.clients.models import Client
+
+
+def _render_document_list(request, documents, form, matter=None):
+    """Renders one page of `documents` with the upload `form` (empty, or with errors)."""
+    # Only the columns the list shows: the AI text columns can be huge.
+    # The uploader comes in the same query; pages are fetched by cursor, not
+    # OFFSET, using the (…, upload_date, id) indexes on Document.
+    documents = documents.select_related('uploaded_by').only(
+        'name', 'file_type', 'file_size', 'status', 'upload_date', 'uploaded_by__username',
+    )
+    page = paginate_documents(
+        documents, after=request.GET.get('after'), before=request.GET.get('before'),
+        per_page=getattr(settings, 'DOCUMENT_LIST_PAGE_SIZE', 50),
+    )
+
+    # Page links keep the other GET parameters (e.g. the matter filter); they
+    # point at the list view, as the page may be rendered by the upload view
+    def page_url(key, cursor):
+        query = request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query[key] = cursor
+        return f"{reverse('documents:document_list')}?{query.urlencode()}"
+
+    context = {
+        'documents': page,
+        'next_page_url': page_url('after', page.next_cursor) if page.next_cursor else None,
+        'previous_page_url': page_url('before', page.previous_cursor) if page.previous_cursor else None,
+        'form': form,
+        'matter': matter, # Pass the matter object to the template if filtered
+    }
+    return render(request, 'documents/document_list.html', context)
 
 
 @login_required # Require user to be logged in
@@ -65,12 +107,7 @@ def document_list_view(request):
             # Or you could redirect to the unfiltered list: return redirect('documents:document_list')
 
 
-    context = {
-        'documents': documents,
-        'form': DocumentUploadForm(), # Include the upload form on the list page (for general upload)
-        'matter': matter, # Pass the matter object to the template if filtered
-    }
-    return render(request, 'documents/document_list.html', context)
+    return _render_document_list(request, documents, DocumentUploadForm(), matter) # Include the upload form on the list page (for general upload)
 
 @login_required # Require user to be logged in
 def document_upload_view(request):
@@ -86,9 +123,9 @@ def document_upload_view(request):
             # Automatically set file_size and file_type before saving
             if document.file:
                 document.file_size = document.file.size
-                document.file_type = document.file.content_type or mimetypes.guess_type(document.file.name)[0] or 'application/octet-stream'
+                document.file_type = getattr(document.file.file, 'content_type', None) or mimetypes.guess_type(document.file.name)[0] or 'application/octet-stream'
 
-            document.save() # Save the document object
+            document.save() # Save the document object; this queues text extraction (see signals.py)
 
             # Handle ManyToManyField saves if your form includes them (e.g., linking clients)
             # form.save_m2m() # Uncomment if your form has ManyToManyFields
@@ -101,21 +138,58 @@ def document_upload_view(request):
             for field, errors in form.errors.items():
                 for error in errors:
                     messages.error(request, f"Error in {field}: {error}")
-            # Re-fetch documents for rendering the list page
+            # Re-fetch documents for rendering the list page (first page only, as the list view would)
             if request.user.is_superuser or request.user.role == 'admin':
                  documents = Document.objects.all()
             else:
                  documents = Document.objects.filter(uploaded_by=request.user)
-            context = {
-                 'documents': documents,
-                 'form': form, # Pass the form with errors
-            }
-            return render(request, 'documents/document_list.html', context) # Render list with errors
+            return _render_document_list(request, documents, form) # Render list with the form's errors
     else:
         # GET request, redirect to the list page which includes the form
         return redirect('documents:document_list')
 
 
+def _can_upload_for_matter(user, matter):
+    # User is admin, superuser, or assigned to the matter
+    return (user.is_superuser or
+            user.role == 'admin' or
+            user in matter.assigned_users.all()) # Assuming Matter has an assigned_users ManyToManyField
+
+
+# Skipped archive members listed individually after a bulk upload
+BULK_UPLOAD_SKIPPED_SHOWN = 10
+
+
+@login_required
+def document_bulk_upload_view(request):
+    """
+    View to upload a ZIP archive; every file in it becomes a document linked to
+    the chosen matter and/or client. Text extraction is queued for the whole batch.
+    """
+    if request.method == 'POST':
+        form = BulkUploadForm(request.POST, request.FILES, user=request.user)
+        if form.is_valid():
+            archive = form.cleaned_data['archive']
+            matter = form.cleaned_data['matter']
+            try:
+                result = import_zip(archive, request.user, matter=matter, client=form.cleaned_data['client'])
+            except BulkUploadError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, f'{len(result.documents)} document(s) uploaded from "{archive.name}". Their text is being extracted in the background.')
+                for member, reason in result.skipped[:BULK_UPLOAD_SKIPPED_SHOWN]:
+                    messages.warning(request, f'Skipped "{member}": {reason}')
+                if len(result.skipped) > BULK_UPLOAD_SKIPPED_SHOWN:
+                    messages.warning(request, f"{len(result.skipped) - BULK_UPLOAD_SKIPPED_SHOWN} more file(s) were skipped.")
+                if matter:
+                    return redirect('workflows:matter_detail', pk=matter.pk)
+                return redirect('documents:document_list')
+    else:
+        form = BulkUploadForm(user=request.user, initial={'matter': request.GET.get('matter')})
+
+    return render(request, 'documents/document_bulk_upload.html', {'form': form})
+
+
 @login_required # Require user to be logged in
 # @notary_required # Example: Only Notaries can upload for matters
 def document_upload_for_matter_view(request, matter_pk):
@@ -127,9 +201,7 @@ def document_upload_for_matter_view(request, matter_pk):
 
     # Permission check: Ensure the user has permission to upload for this matter
     # Example: User is admin, superuser, or assigned to the matter
-    if not (request.user.is_superuser or
-            request.user.role == 'admin' or
-            request.user in matter.assigned_users.all()): # Assuming Matter has an assigned_users ManyToManyField
+    if not _can_upload_for_matter(request.user, matter):
         messages.error(request, "You do not have permission to upload documents for this matter.")
         return redirect('workflows:matter_detail', pk=matter.pk) # Redirect back to the matter detail page
 
@@ -145,9 +217,9 @@ def document_upload_for_matter_view(request, matter_pk):
             # Automatically set file_size and file_type before saving
             if document.file:
                 document.file_size = document.file.size
-                document.file_type = document.file.content_type or mimetypes.guess_type(document.file.name)[0] or 'application/octet-stream'
+                document.file_type = getattr(document.file.file, 'content_type', None) or mimetypes.guess_type(document.file.name)[0] or 'application/octet-stream'
 
-            document.save() # Save the document object
+            document.save() # Save the document object; this queues text extraction (see signals.py)
 
             # If 'matter' is a ManyToManyField on Document, you would save m2m here:
             # form.save_m2m()
@@ -184,6 +256,21 @@ def document_upload_for_matter_view(request, matter_pk):
         return render(request, 'documents/document_upload_for_matter.html', context)
 
 
+@login_required # Require user to be logged in
+def document_search_view(request):
+    """
+    Full-text search inside the documents the user can see.
+    Results are grouped by document with ranked, highlighted page snippets.
+    """
+    query = request.GET.get('q', '').strip()
+    results = search_documents(query, request.user, EXTRACTOR_VERSION) if query else []
+    context = {
+        'query': query,
+        'results': results,
+    }
+    return render(request, 'documents/document_search.html', context)
+
+
 @login_required # Require user to be logged in
 def document_detail_view(request, pk):
     """
@@ -209,6 +296,19 @@ def document_detail_view(request, pk):
 
     context = {
         'document': document,
+        # Queued/running AI jobs and the most recent failure, if any
+        'active_jobs': document.jobs.filter(status__in=('queued', 'processing')).exclude(task__in=BACKGROUND_TASKS),
+        'failed_job': document.jobs.filter(status='error').exclude(task__in=BACKGROUND_TASKS).order_by('-finished_at').first(),
+        # PDF conversion: latest job and the documents generated from this one
+        'can_convert': bool(document.file) and can_convert(get_document_mime_type(document)),
+        'conversion_job': document.jobs.filter(task='convert').order_by('-created_at').first(),
+        'derivatives': document.derivatives.all(),
+        # Documents with nearly the same text (e.g. an edited re-upload), most similar first
+        'near_duplicates': find_near_duplicates(
+            document, EXTRACTOR_VERSION,
+            threshold=getattr(settings, 'DOCUMENT_NEAR_DUPLICATE_SIMILARITY', DEFAULT_NEAR_DUPLICATE_SIMILARITY),
+            user=request.user,
+        ),
     }
     return render(request, 'documents/document_detail.html', context)
 
@@ -257,29 +357,13 @@ def document_summarize_view(request, pk):
 
     if request.method == 'POST':
         if document.file:
-            try:
-                # Update status to indicate processing
-                document.status = 'processing'
-                document.save()
-
-                # Call the utility function to summarize
-                # Consider running this in a background task for large documents
-                summary = summarize_document(document.file.path)
-
-                if summary:
-                    document.summary = summary
-                    document.status = 'processed'
-                    document.save()
-                    messages.success(request, f'Document "{document.name}" summarized successfully.')
-                else:
-                    document.status = 'error'
-                    document.save()
-                    messages.error(request, f'Failed to summarize document "{document.name}". Check logs.')
-
-            except Exception as e:
-                document.status = 'error'
-                document.save()
-                messages.error(request, f'An error occurred while summarizing document "{document.name}": {e}')
+            # Queue the work for the `process_documents` worker instead of blocking this request.
+            # 'force' skips the AI response cache and asks Gemini again
+            enqueue_document_job(
+                document, 'summarize', requested_by=request.user,
+                options={'bypass_cache': bool(request.POST.get('force'))},
+            )
+            messages.success(request, f'Document "{document.name}" has been queued for summarization. Refresh the page to see the result.')
         else:
             messages.warning(request, f'Document "{document.name}" has no file attached.')
 
@@ -304,29 +388,13 @@ def document_segment_view(request, pk):
 
     if request.method == 'POST':
         if document.file:
-            try:
-                # Update status to indicate processing
-                document.status = 'processing'
-                document.save()
-
-                # Call the utility function to segment
-                # Consider running this in a background task
-                segmentation_result = segment_document(document.file.path)
-
-                if segmentation_result:
-                    document.segmentation_result = segmentation_result
-                    document.status = 'processed'
-                    document.save()
-                    messages.success(request, f'Document "{document.name}" segmented successfully.')
-                else:
-                    document.status = 'error'
-                    document.save()
-                    messages.error(request, f'Failed to segment document "{document.name}". Check logs.')
-
-            except Exception as e:
-                document.status = 'error'
-                document.save()
-                messages.error(request, f'An error occurred while segmenting document "{document.name}": {e}')
+            # Queue the work for the `process_documents` worker instead of blocking this request.
+            # 'force' skips the AI response cache and asks Gemini again
+            enqueue_document_job(
+                document, 'segment', requested_by=request.user,
+                options={'bypass_cache': bool(request.POST.get('force'))},
+            )
+            messages.success(request, f'Document "{document.name}" has been queued for segmentation. Refresh the page to see the result.')
         else:
             messages.warning(request, f'Document "{document.name}" has no file attached.')
 
@@ -373,14 +441,28 @@ def document_convert_view(request, pk):
         return redirect('documents:document_detail', pk=pk) # Using namespace
 
     if request.method == 'POST':
-        # Placeholder for conversion logic
-        messages.info(request, f"Conversion of document '{document.name}' triggered (placeholder).")
-        # Call a utility function for conversion here
-        # success, message, converted_file_path = convert_to_pdf(document.file.path, output_dir)
-        # Update document model with converted file and status
-
-        # For now, just redirect back
-        return redirect('documents:document_detail', pk=pk) # Using namespace
+        mime_type = get_document_mime_type(document)
+        if mime_type == 'application/pdf':
+            messages.info(request, f"'{document.name}' is already a PDF.")
+            return redirect('documents:document_detail', pk=pk)
+        if not document.file or not can_convert(mime_type):
+            messages.error(request, f"Files of type {mime_type or 'unknown'} cannot be converted to PDF.")
+            return redirect('documents:document_detail', pk=pk)
+
+        # Identical content converted before: reuse the cached PDF right away
+        try:
+            converted = convert_document(document, cached_only=True)
+        except ConversionError as e:
+            messages.error(request, str(e))
+            return redirect('documents:document_detail', pk=pk)
+        if converted:
+            messages.success(request, f"Converted '{document.name}' to PDF.")
+            return redirect('documents:document_detail', pk=converted.pk)
+
+        # Otherwise convert in the background worker's process pool
+        enqueue_document_job(document, 'convert', requested_by=request.user)
+        messages.info(request, f"Conversion of '{document.name}' to PDF has been queued. The PDF will be listed on this page when it is ready.")
+        return redirect('documents:document_detail', pk=pk)
 
     # For GET request, maybe show a confirmation page or just redirect
     return redirect('documents:document_detail', pk=pk)
@@ -415,18 +497,14 @@ def document_download_view(request, pk):
     """View to download the document file."""
     document = get_object_or_404(Document, pk=pk)
      # Permission check
-    if not (request.user.is_superuser or request.user.role == 'admin' or document.uploaded_by == request.user):
+    if not _can_download(request.user, document):
         messages.error(request, "You do not have permission to download this document.")
         return redirect('documents:document_list') # Using namespace
 
     if document.file:
-        # Use default_storage to handle different storage backends
-        file_path = document.file.path
-        if default_storage.exists(file_path):
-            with default_storage.open(file_path, 'rb') as file:
-                response = HttpResponse(file.read(), content_type=document.file_type)
-                response['Content-Disposition'] = f'attachment; filename="{os.path.basename(document.file.name)}"'
-                return response
+        if document.file.storage.exists(document.file.name):
+            # Streams the file (or hands it to the web server) with Range and 304 support
+            return serve_document_file(request, document)
         else:
             # If the file is expected but not found on storage
             messages.error(request, "Document file not found on storage.")
@@ -435,3 +513,145 @@ def document_download_view(request, pk):
     else:
         messages.warning(request, "No file attached to this document record.")
         return redirect('documents:document_detail', pk=pk) # Using namespace
+
+
+def _can_download(user, document):
+    # Admins, superusers and the uploader may download a document's file
+    return user.is_superuser or user.role == 'admin' or document.uploaded_by_id == user.pk
+
+
+def _downloadable(user, documents):
+    # The documents of a queryset the user may download (see _can_download)
+    if user.is_superuser or user.role == 'admin':
+        return documents
+    return documents.filter(uploaded_by=user)
+
+
+def _zip_export_response(documents, filename):
+    # The archive is generated while it is sent (see exports.py); its length isn't known up front
+    response = StreamingHttpResponse(iter_zip_export(documents.select_related('blob').order_by('upload_date', 'pk').iterator()), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Cache-Control'] = 'private, no-cache'
+    # Stop nginx from buffering the archive before passing it on
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def matter_documents_export_view(request, matter_pk):
+    """View to download every document of a matter as one ZIP archive."""
+    matter = get_object_or_404(Matter, pk=matter_pk)
+    if not (request.user.is_superuser or request.user.role == 'admin' or matter.created_by == request.user
+            or matter.assigned_users.filter(pk=request.user.pk).exists()):
+        messages.error(request, "You do not have permission to export this matter's documents.")
+        return redirect('workflows:matter_list')
+    # Being on the matter doesn't grant access to other users' files; the archive
+    # holds what document_download_view would let this user download
+    documents = _downloadable(request.user, Document.objects.filter(matter=matter))
+    return _zip_export_response(documents, f'{matter.protocol_number or matter.pk} documents.zip')
+
+
+@login_required
+def client_documents_export_view(request, client_pk):
+    """View to download every document of a client as one ZIP archive."""
+    client = get_object_or_404(Client, pk=client_pk)
+    if not (request.user.is_superuser or request.user.role == 'admin' or client.created_by == request.user):
+        messages.error(request, "You do not have permission to export this client's documents.")
+        return redirect('client_list')
+    documents = _downloadable(request.user, Document.objects.filter(client=client))
+    return _zip_export_response(documents, f'{client} documents.zip')
+
+
+# --- Chunked, resumable uploads (see apps/documents/uploads.py) ---
+# The client (static/js/chunked_upload.js) POSTs to create a session, PUTs each
+# chunk with an X-Upload-Offset header, GETs the session to find where to resume,
+# and POSTs to /complete/ to create the Document.
+
+def _upload_error_response(error):
+    return JsonResponse({'error': str(error), 'received_bytes': error.received_bytes}, status=error.status)
+
+
+def _upload_session_data(session):
+    return {
+        'upload_id': str(session.upload_id),
+        'filename': session.filename,
+        'total_size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'received_bytes': session.received_bytes,
+        'status': session.status,
+        'document_id': session.document_id,
+    }
+
+
+@login_required
+@require_POST
+def upload_session_create_view(request):
+    """Starts a chunked upload; optionally linked to a matter the user may upload to."""
+    matter = None
+    if request.POST.get('matter'):
+        matter = get_object_or_404(Matter, pk=request.POST['matter'])
+        if not _can_upload_for_matter(request.user, matter):
+            return JsonResponse({'error': "You do not have permission to upload documents for this matter."}, status=403)
+    try:
+        total_size = int(request.POST.get('size', 0))
+        chunk_size = int(request.POST.get('chunk_size', 0))
+    except ValueError:
+        return JsonResponse({'error': "size and chunk_size must be integers."}, status=400)
+
+    try:
+        session = create_upload_session(
+            request.user,
+            filename=request.POST.get('filename'),
+            total_size=total_size,
+            chunk_size=chunk_size,
+            name=request.POST.get('name', ''),
+            file_type=request.POST.get('file_type', ''),
+            matter=matter,
+        )
+    except UploadError as e:
+        return _upload_error_response(e)
+    return JsonResponse(_upload_session_data(session), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def upload_session_view(request, upload_id):
+    """GET: session status (resume point). PUT: append a chunk. DELETE: abort the upload."""
+    session = get_object_or_404(UploadSession, upload_id=upload_id, user=request.user)
+
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers.get('X-Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return JsonResponse({'error': "X-Upload-Offset header is required."}, status=400)
+        try:
+            # request.read() streams the body; it is not loaded into request.body
+            append_chunk(session, offset, request, length)
+        except UploadError as e:
+            return _upload_error_response(e)
+    elif request.method == 'DELETE':
+        abort_upload(session)
+
+    return JsonResponse(_upload_session_data(session))
+
+
+@login_required
+@require_POST
+def upload_session_complete_view(request, upload_id):
+    """Assembles the uploaded chunks into a new Document."""
+    session = get_object_or_404(UploadSession, upload_id=upload_id, user=request.user)
+    try:
+        document = complete_upload(session)
+    except UploadError as e:
+        return _upload_error_response(e)
+
+    if session.matter_id:
+        messages.success(request, f'Document "{document.name}" uploaded successfully and linked to Matter "{session.matter.protocol_number}".')
+        redirect_url = reverse('workflows:matter_detail', kwargs={'pk': session.matter_id})
+    else:
+        messages.success(request, f'Document "{document.name}" uploaded successfully!')
+        redirect_url = reverse('documents:document_list')
+    data = _upload_session_data(session)
+    data['redirect_url'] = redirect_url
+    return JsonResponse(data)
@@ -3,6 +3,7 @@
 
 import google.generativeai as genai
 from django.conf import settings
+from apps.ai.utils import generate_content
 import json
 
 if settings.GEMINI_API_KEY:
@@ -11,9 +12,10 @@ else:
     print("WARNING: GEMINI_API_KEY not found in settings. Gemini AI features will not be available.")
     genai = None
 
-def generate_workflow_steps_ai(matter_title, matter_description):
+def generate_workflow_steps_ai(matter_title, matter_description, bypass_cache=False):
     """
     Uses Gemini AI to generate a list of suggested workflow steps for a matter.
+    Identical requests are answered from the AI response cache unless bypass_cache is True.
     """
     if not genai:
         print("Gemini AI is not configured. Cannot generate workflow steps.")
@@ -34,10 +36,9 @@ JSON Workflow Steps:
 """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
+        response_text = generate_content(prompt, bypass_cache=bypass_cache)
         try:
-            json_string = response.text.strip()
+            json_string = response_text.strip()
             if json_string.startswith('[') and json_string.endswith(']'):
                  steps = json.loads(json_string)
                  if isinstance(steps, list):
@@ -51,7 +52,7 @@ JSON Workflow Steps:
 
         except json.JSONDecodeError as e:
             print(f"Error decoding JSON from AI response: {e}")
-            print(f"AI Response Text: {response.text}")
+            print(f"AI Response Text: {response_text}")
             return None
 
     except Exception as e:
@@ -20,6 +20,56 @@ env = environ.Env(
     MEDIA_ROOT=(str, BASE_DIR / 'media'), # Use pathlib for media root
     SECRET_KEY=(str, 'insecure-fallback-key-change-me'), # Fallback for SECRET_KEY
     GEMINI_API_KEY=(str, None), # Gemini API Key
+    # Document text extraction engine (see apps/documents/extraction.py)
+    EXTRACTION_WORKERS=(int, 2), # Size of the extraction process pool; 0 extracts inline
+    EXTRACTION_TIMEOUT=(int, 120), # Wall-clock seconds allowed per document
+    EXTRACTION_MAX_MEMORY_MB=(int, 1024), # Memory ceiling per extraction worker
+    EXTRACTION_MAX_JOBS_PER_WORKER=(int, 50), # Recycle a worker after this many documents
+    # Gemini response cache (see apps/ai/utils.py)
+    AI_CACHE_TTL_SECONDS=(int, 30 * 24 * 3600), # Cached responses expire after 30 days
+    AI_CACHE_MAX_ENTRIES=(int, 10000), # Least recently used entries are evicted past this
+    AI_CACHE_PRUNE_EVERY=(int, 100), # Expired and excess entries are deleted once per this many cache writes
+    # Document processing queue (see apps/documents/jobs.py)
+    DOCUMENT_WORKER_CONCURRENCY=(int, 2), # Jobs run at once by each process_documents worker
+    DOCUMENT_JOB_MAX_ATTEMPTS=(int, 3), # Attempts before a job is marked as error
+    DOCUMENT_JOB_RETRY_BACKOFF=(int, 30), # Seconds before the first retry; doubles each attempt
+    DOCUMENT_JOB_LEASE_SECONDS=(int, 300), # A job whose worker stops heartbeating is re-run after this
+    DOCUMENT_BATCH_FAN_OUT=(int, 4), # Jobs of one admin bulk batch allowed to run at the same time
+    DOCUMENT_AI_RATE_LIMIT=(int, 0), # AI jobs started per minute by each worker; 0 = unlimited
+    DOCUMENT_PEAK_HOURS=(str, '8-19'), # Local hours (e.g. '8-12,13-19') when background jobs give way to interactive ones; '' = never
+    DOCUMENT_PEAK_BACKGROUND_SLOTS=(int, 1), # Background jobs (extraction on upload) run at once per worker during peak hours
+    # AI prompt packing (see apps/documents/packing.py)
+    DOCUMENT_AI_PROMPT_CHARS=(int, 10000), # Document text sent per summarize/segment call
+    DOCUMENT_AI_PROMPT_TOKENS=(int, 0), # Optional budget in tokens (~4 chars each); the smaller budget wins
+    # Map-reduce summaries (see apps/documents/summarization.py)
+    DOCUMENT_AI_MAP_REDUCE_CHARS=(int, 50000), # Longer text is summarized part by part; 0 = always pack one prompt
+    DOCUMENT_AI_CONCURRENCY=(int, 4), # Gemini calls in flight at once per process
+    # Near-duplicate detection (see apps/documents/similarity.py)
+    DOCUMENT_NEAR_DUPLICATE_SIMILARITY=(float, 0.8), # Estimated text similarity at which documents are flagged
+    DOCUMENT_SUMMARY_REUSE_SIMILARITY=(float, 0.9), # Reuse a near-duplicate's summary at this similarity; 0 = never
+    # Document downloads (see apps/documents/downloads.py)
+    DOCUMENT_DOWNLOAD_OFFLOAD=(str, ''), # '' streams from Django; 'nginx' (X-Accel-Redirect), 'sendfile' (X-Sendfile) or 'redirect' (presigned S3 URL)
+    DOCUMENT_DOWNLOAD_ACCEL_PREFIX=(str, '/protected-media/'), # nginx `internal` location aliased to MEDIA_ROOT
+    DOCUMENT_DOWNLOAD_URL_EXPIRE=(int, 300), # Seconds a presigned download URL stays valid
+    # Document file storage (see apps/documents/storage_backends.py)
+    DOCUMENT_STORAGE=(str, 'local'), # 'local' (MEDIA_ROOT) or 's3' (AWS or any S3-compatible service)
+    DOCUMENT_S3_MULTIPART_THRESHOLD=(int, 16 * 1024 * 1024), # Larger files are uploaded as multipart uploads
+    DOCUMENT_S3_MULTIPART_CHUNK_SIZE=(int, 16 * 1024 * 1024), # Size of each uploaded part
+    DOCUMENT_S3_MULTIPART_CONCURRENCY=(int, 8), # Parts uploaded at the same time
+    # Cold tier (see apps/documents/cold_storage.py, `python manage.py compress_cold_documents`)
+    DOCUMENT_COLD_AFTER_DAYS=(int, 180), # Blobs not read for this long are compressed
+    DOCUMENT_COLD_CODEC=(str, 'gzip'), # 'gzip' or 'zstd' (needs the zstandard package)
+    DOCUMENT_COLD_MIN_SAVING=(float, 0.1), # Skip files whose sample shrinks by less than this fraction
+    DOCUMENT_COLD_DELETE_GRACE_HOURS=(int, 24), # Keep a file replaced by its compressed copy this long for running downloads
+    # Chunked uploads (see apps/documents/uploads.py)
+    DOCUMENT_UPLOAD_MAX_SIZE=(int, 1024 * 1024 * 1024), # Largest file accepted by chunked upload (1 GB)
+    DOCUMENT_BULK_UPLOAD_MAX_FILES=(int, 500), # Files accepted from one ZIP archive
+    DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES=(int, 4 * 1024 * 1024 * 1024), # Decompressed bytes accepted from one ZIP archive (4 GB)
+    DOCUMENT_STORAGE_SPOOL_MAX_SIZE=(int, 8 * 1024 * 1024), # Remote files up to this size are extracted from memory, larger ones from a temp copy
+    DOCUMENT_UPLOAD_MAX_CHUNK_SIZE=(int, 32 * 1024 * 1024), # Upper bound for the client's chunk size
+    DOCUMENT_UPLOAD_SESSION_TTL=(int, 24 * 3600), # Unfinished uploads idle this long are discarded
+    DOCUMENT_UPLOAD_STAGING_DIR=(str, str(BASE_DIR / 'upload_staging')), # Local disk where chunks are assembled
+    DOCUMENT_LIST_PAGE_SIZE=(int, 50), # Documents per page in the document list
     # Add other potential API keys here, reading from environment
     CREDAS_API_KEY=(str, None),
     PEPS_SANCTIONS_API_KEY=(str, None),
@@ -84,6 +134,7 @@ INSTALLED_APPS = [
     'apps.workflows',
     'apps.integrations',
     'apps.dashboard',
+    'apps.ai',
 ]
 
 # Crispy Forms Settings
@@ -142,6 +193,12 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': env.db() # Configured via DATABASE_URL in .env
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # SQLite has one writer at a time. Transactions take the write lock when they
+    # begin, waiting up to `timeout` seconds for it, instead of failing with
+    # "database is locked" when process_documents workers write concurrently
+    DATABASES['default'].setdefault('OPTIONS', {}).setdefault('transaction_mode', 'IMMEDIATE')
+    DATABASES['default']['OPTIONS'].setdefault('timeout', 20)
 
 
 # Password validation
@@ -247,6 +304,63 @@ LOGOUT_REDIRECT_URL = '/accounts/login/' # Redirect to the login page after logo
 # Gemini AI API Key
 GEMINI_API_KEY = env('GEMINI_API_KEY')
 
+# Document text extraction engine
+EXTRACTION_WORKERS = env('EXTRACTION_WORKERS')
+EXTRACTION_TIMEOUT = env('EXTRACTION_TIMEOUT')
+EXTRACTION_MAX_MEMORY_MB = env('EXTRACTION_MAX_MEMORY_MB')
+EXTRACTION_MAX_JOBS_PER_WORKER = env('EXTRACTION_MAX_JOBS_PER_WORKER')
+
+# Gemini response cache
+AI_CACHE_TTL_SECONDS = env('AI_CACHE_TTL_SECONDS')
+AI_CACHE_MAX_ENTRIES = env('AI_CACHE_MAX_ENTRIES')
+AI_CACHE_PRUNE_EVERY = env('AI_CACHE_PRUNE_EVERY')
+
+# Document processing queue (run the worker with `python manage.py process_documents`)
+DOCUMENT_WORKER_CONCURRENCY = env('DOCUMENT_WORKER_CONCURRENCY')
+DOCUMENT_JOB_MAX_ATTEMPTS = env('DOCUMENT_JOB_MAX_ATTEMPTS')
+DOCUMENT_JOB_RETRY_BACKOFF = env('DOCUMENT_JOB_RETRY_BACKOFF')
+DOCUMENT_JOB_LEASE_SECONDS = env('DOCUMENT_JOB_LEASE_SECONDS')
+DOCUMENT_BATCH_FAN_OUT = env('DOCUMENT_BATCH_FAN_OUT')
+DOCUMENT_AI_RATE_LIMIT = env('DOCUMENT_AI_RATE_LIMIT')
+DOCUMENT_PEAK_HOURS = env('DOCUMENT_PEAK_HOURS')
+DOCUMENT_PEAK_BACKGROUND_SLOTS = env('DOCUMENT_PEAK_BACKGROUND_SLOTS')
+
+# AI prompt packing: the most informative parts of long documents are sent
+DOCUMENT_AI_PROMPT_CHARS = env('DOCUMENT_AI_PROMPT_CHARS')
+DOCUMENT_AI_PROMPT_TOKENS = env('DOCUMENT_AI_PROMPT_TOKENS')
+
+# Map-reduce summaries of long documents: part summaries run concurrently
+DOCUMENT_AI_MAP_REDUCE_CHARS = env('DOCUMENT_AI_MAP_REDUCE_CHARS')
+DOCUMENT_AI_CONCURRENCY = env('DOCUMENT_AI_CONCURRENCY')
+
+# Near-duplicate detection: flagged documents, and summaries reused between them
+DOCUMENT_NEAR_DUPLICATE_SIMILARITY = env('DOCUMENT_NEAR_DUPLICATE_SIMILARITY')
+DOCUMENT_SUMMARY_REUSE_SIMILARITY = env('DOCUMENT_SUMMARY_REUSE_SIMILARITY')
+
+# Document downloads. With 'nginx', add an internal location, e.g.:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+DOCUMENT_DOWNLOAD_OFFLOAD = env('DOCUMENT_DOWNLOAD_OFFLOAD')
+DOCUMENT_DOWNLOAD_ACCEL_PREFIX = env('DOCUMENT_DOWNLOAD_ACCEL_PREFIX')
+DOCUMENT_DOWNLOAD_URL_EXPIRE = env('DOCUMENT_DOWNLOAD_URL_EXPIRE')
+
+# Cold tier: compressed storage for documents nobody has read for a while
+DOCUMENT_COLD_AFTER_DAYS = env('DOCUMENT_COLD_AFTER_DAYS')
+DOCUMENT_COLD_CODEC = env('DOCUMENT_COLD_CODEC')
+DOCUMENT_COLD_MIN_SAVING = env('DOCUMENT_COLD_MIN_SAVING')
+DOCUMENT_COLD_DELETE_GRACE_HOURS = env('DOCUMENT_COLD_DELETE_GRACE_HOURS')
+
+# Chunked, resumable uploads
+DOCUMENT_UPLOAD_MAX_SIZE = env('DOCUMENT_UPLOAD_MAX_SIZE')
+DOCUMENT_BULK_UPLOAD_MAX_FILES = env('DOCUMENT_BULK_UPLOAD_MAX_FILES')
+DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES = env('DOCUMENT_BULK_UPLOAD_MAX_TOTAL_BYTES')
+DOCUMENT_STORAGE_SPOOL_MAX_SIZE = env('DOCUMENT_STORAGE_SPOOL_MAX_SIZE')
+DOCUMENT_UPLOAD_MAX_CHUNK_SIZE = env('DOCUMENT_UPLOAD_MAX_CHUNK_SIZE')
+DOCUMENT_UPLOAD_SESSION_TTL = env('DOCUMENT_UPLOAD_SESSION_TTL')
+DOCUMENT_UPLOAD_STAGING_DIR = env('DOCUMENT_UPLOAD_STAGING_DIR')
+
+# Document list (keyset pagination)
+DOCUMENT_LIST_PAGE_SIZE = env('DOCUMENT_LIST_PAGE_SIZE')
+
 # Other Integration API Keys (read from environment)
 CREDAS_API_KEY = env('CREDAS_API_KEY', default=None)
 PEPS_SANCTIONS_API_KEY = env('PEPS_SANCTIONS_API_KEY', default=None)
@@ -269,13 +383,27 @@ GOOGLE_OAUTH_REDIRECT_URI = env('GOOGLE_OAUTH_REDIRECT_URI', default='http://loc
 # DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='')
 
 
-# Optional: Django Storages settings (if using cloud storage)
-# DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage' # Example for S3
-# AWS_ACCESS_KEY_ID = env('AWS_ACCESS_KEY_ID', default='')
-# AWS_SECRET_ACCESS_KEY = env('AWS_SECRET_ACCESS_KEY', default='')
-# AWS_STORAGE_BUCKET_NAME = env('AWS_STORAGE_BUCKET_NAME', default='')
-# AWS_S3_REGION_NAME = env('AWS_S3_REGION_NAME', default='')
-# AWS_S3_FILE_OVERWRITE = False
+# Document file storage. With 's3' (requires boto3), files are kept in
+# AWS_STORAGE_BUCKET_NAME; set AWS_S3_ENDPOINT_URL for MinIO or another
+# S3-compatible service, and DOCUMENT_DOWNLOAD_OFFLOAD=redirect to let browsers
+# download straight from the bucket through presigned URLs.
+DOCUMENT_STORAGE = env('DOCUMENT_STORAGE')
+DOCUMENT_S3_MULTIPART_THRESHOLD = env('DOCUMENT_S3_MULTIPART_THRESHOLD')
+DOCUMENT_S3_MULTIPART_CHUNK_SIZE = env('DOCUMENT_S3_MULTIPART_CHUNK_SIZE')
+DOCUMENT_S3_MULTIPART_CONCURRENCY = env('DOCUMENT_S3_MULTIPART_CONCURRENCY')
+if DOCUMENT_STORAGE == 's3':
+    STORAGES = {
+        'default': {'BACKEND': 'apps.documents.storage_backends.DocumentS3Storage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    }
+    AWS_ACCESS_KEY_ID = env('AWS_ACCESS_KEY_ID', default='')
+    AWS_SECRET_ACCESS_KEY = env('AWS_SECRET_ACCESS_KEY', default='')
+    AWS_STORAGE_BUCKET_NAME = env('AWS_STORAGE_BUCKET_NAME', default='')
+    AWS_S3_REGION_NAME = env('AWS_S3_REGION_NAME', default=None)
+    AWS_S3_ENDPOINT_URL = env('AWS_S3_ENDPOINT_URL', default=None)
+    AWS_S3_FILE_OVERWRITE = False
+    AWS_DEFAULT_ACL = None # Objects stay private
+    AWS_QUERYSTRING_EXPIRE = DOCUMENT_DOWNLOAD_URL_EXPIRE
 
 
 
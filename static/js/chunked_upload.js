@@ -0,0 +1,131 @@
+// static/js/chunked_upload.js
+
+// Uploads the file of any <form data-chunked-upload-url="..."> in chunks
+// (see apps/documents/uploads.py), so large scanned bundles don't go through a
+// single multipart POST. A failed chunk is retried after asking the server how
+// much it already has, so an interrupted upload resumes where it stopped.
+// Without JavaScript (or fetch) the form falls back to a normal POST.
+
+(function () {
+    var CHUNK_SIZE = 8 * 1024 * 1024; // Requested chunk size; the server may adjust it
+    var MAX_RETRIES = 5;
+
+    function getCsrfToken(form) {
+        var input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+        return input ? input.value : '';
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    function request(url, options) {
+        return fetch(url, Object.assign({ credentials: 'same-origin' }, options)).then(function (response) {
+            return response.json().catch(function () { return {}; }).then(function (data) {
+                return { ok: response.ok, status: response.status, data: data };
+            });
+        });
+    }
+
+    function uploadChunks(form, file, session, onProgress) {
+        var sessionUrl = form.dataset.chunkedUploadUrl + session.upload_id + '/';
+        var offset = session.received_bytes;
+        var retries = 0;
+
+        function next() {
+            onProgress(offset, file.size);
+            if (offset >= file.size) {
+                return request(sessionUrl + 'complete/', {
+                    method: 'POST',
+                    headers: { 'X-CSRFToken': getCsrfToken(form) },
+                });
+            }
+            var chunk = file.slice(offset, Math.min(offset + session.chunk_size, file.size));
+            return request(sessionUrl, {
+                method: 'PUT',
+                headers: { 'X-CSRFToken': getCsrfToken(form), 'X-Upload-Offset': String(offset) },
+                body: chunk,
+            }).catch(function () {
+                return { ok: false, status: 0, data: {} }; // Network error
+            }).then(function (result) {
+                if (result.ok) {
+                    offset = result.data.received_bytes;
+                    retries = 0;
+                    return next();
+                }
+                if (result.status === 403 || result.status === 404 || retries >= MAX_RETRIES) {
+                    throw new Error(result.data.error || 'Upload failed.');
+                }
+                retries += 1;
+                // Resume from whatever the server actually has
+                return sleep(1000 * retries).then(function () {
+                    return request(sessionUrl, { method: 'GET' });
+                }).then(function (status) {
+                    if (status.ok) {
+                        offset = status.data.received_bytes;
+                    }
+                    return next();
+                }, next);
+            });
+        }
+        return next();
+    }
+
+    function handleSubmit(event) {
+        var form = event.target;
+        var fileInput = form.querySelector('input[type="file"]');
+        var file = fileInput && fileInput.files[0];
+        if (!file || !window.fetch) {
+            return; // Let the browser submit the form normally
+        }
+        event.preventDefault();
+
+        var progress = form.querySelector('.chunked-upload-progress');
+        var button = form.querySelector('button[type="submit"]');
+        if (button) { button.disabled = true; }
+        function onProgress(sent, total) {
+            if (progress) {
+                progress.hidden = false;
+                progress.textContent = 'Uploading... ' + Math.floor(sent * 100 / total) + '%';
+            }
+        }
+
+        var body = new FormData();
+        body.append('filename', file.name);
+        body.append('size', file.size);
+        body.append('chunk_size', CHUNK_SIZE);
+        body.append('file_type', file.type);
+        var nameInput = form.querySelector('input[name="name"]');
+        if (nameInput) { body.append('name', nameInput.value); }
+        if (form.dataset.matter) { body.append('matter', form.dataset.matter); }
+
+        request(form.dataset.chunkedUploadUrl, {
+            method: 'POST',
+            headers: { 'X-CSRFToken': getCsrfToken(form) },
+            body: body,
+        }).then(function (result) {
+            if (!result.ok) {
+                throw new Error(result.data.error || 'Could not start the upload.');
+            }
+            return uploadChunks(form, file, result.data, onProgress);
+        }).then(function (result) {
+            if (!result.ok) {
+                throw new Error(result.data.error || 'Could not finish the upload.');
+            }
+            window.location.href = result.data.redirect_url;
+        }).catch(function (error) {
+            if (progress) {
+                progress.hidden = false;
+                progress.textContent = error.message;
+            }
+            if (button) { button.disabled = false; }
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        var forms = document.querySelectorAll('form[data-chunked-upload-url]');
+        for (var i = 0; i < forms.length; i++) {
+            forms[i].addEventListener('submit', handleSubmit);
+        }
+    });
+})();